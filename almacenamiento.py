@@ -0,0 +1,398 @@
+"""
+Backends de almacenamiento del catastro.
+
+Las funciones de db_utils.py trabajan contra un backend intercambiable, elegido
+con la variable de entorno CATASTRO_DB_BACKEND:
+
+- `sqlite` (por defecto): archivo local, pool de conexiones propio y perfil de PRAGMA.
+- `postgres`: servidor PostgreSQL indicado en DATABASE_URL, con `psycopg2.pool`
+  y cursores del lado del servidor para las lecturas grandes.
+
+Ambos backends entregan conexiones con la misma interfaz (cursor, commit,
+rollback) y aceptan consultas con marcadores `?`.
+"""
+import queue
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from sqlite3 import Error
+from config_manager import obtener_valor, DEFAULT_CONFIG
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.extras
+    import psycopg2.pool
+except ImportError:  # psycopg2 solo es necesario con el backend PostgreSQL
+    psycopg2 = None
+
+# Excepciones de base de datos de cualquiera de los backends
+ERRORES_BD = (Error,) + ((psycopg2.Error,) if psycopg2 is not None else ())
+
+
+def obtener_config_bd():
+    """Obtiene la configuración de la base de datos combinada con los valores por defecto"""
+    config = obtener_valor('base_datos') or {}
+    return {**DEFAULT_CONFIG['base_datos'], **config}
+
+
+# Valores aceptados para los PRAGMA configurables (no admiten parámetros `?`)
+PRAGMAS_TEXTO = {
+    'journal_mode': {'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'WAL'},
+    'synchronous': {'OFF', 'NORMAL', 'FULL', 'EXTRA'},
+    'temp_store': {'DEFAULT', 'FILE', 'MEMORY'},
+}
+PRAGMAS_ENTEROS = ('busy_timeout', 'cache_size', 'mmap_size')
+
+
+def perfil_rendimiento(config=None):
+    """
+    Valida el perfil de PRAGMA de la configuración.
+
+    Args:
+        config (dict): Configuración de base de datos; por defecto la de `obtener_config_bd()`.
+
+    Returns:
+        dict: PRAGMA válidos listos para aplicar, en mayúsculas o como enteros.
+    """
+    config = config if config is not None else obtener_config_bd()
+    perfil = {}
+    # busy_timeout primero, para que el cambio de journal_mode espere si hay bloqueos
+    for nombre in PRAGMAS_ENTEROS:
+        if config.get(nombre) is not None:
+            perfil[nombre] = int(config[nombre])
+    for nombre, permitidos in PRAGMAS_TEXTO.items():
+        valor = config.get(nombre)
+        if valor is None:
+            continue
+        valor = str(valor).upper()
+        if valor not in permitidos:
+            raise ValueError(f"Valor no permitido para PRAGMA {nombre}: {valor}")
+        perfil[nombre] = valor
+    return perfil
+
+
+def aplicar_pragmas(conn, perfil):
+    """Aplica a una conexión los PRAGMA de un perfil ya validado"""
+    for nombre, valor in perfil.items():
+        conn.execute(f"PRAGMA {nombre} = {valor}")
+
+
+class PoolConexiones:
+    """
+    Pool de conexiones SQLite reutilizables, compartido por todas las sesiones.
+
+    Las conexiones se crean bajo demanda hasta `tamano` y se devuelven al pool
+    al salir del bloque `with pool.conexion() as conn`. Antes de entregar una
+    conexión se verifica que siga respondiendo; si no, se descarta y se crea otra.
+    """
+
+    def __init__(self, db_path, tamano=5, timeout=30, pragmas=None):
+        self.db_path = db_path
+        self.tamano = max(1, int(tamano))
+        self.timeout = timeout
+        self.pragmas = pragmas or {}
+        self._libres = queue.LifoQueue()
+        self._creadas = 0
+        self._lock = threading.Lock()
+
+    def _crear_conexion(self):
+        """Abre una conexión nueva y aplica la configuración por conexión"""
+        conn = sqlite3.connect(self.db_path, timeout=self.timeout, check_same_thread=False)
+        # Habilitar claves foráneas
+        conn.execute("PRAGMA foreign_keys = ON")
+        aplicar_pragmas(conn, self.pragmas)
+        return conn
+
+    @staticmethod
+    def _esta_sana(conn):
+        """Verifica que la conexión siga respondiendo"""
+        try:
+            conn.execute('SELECT 1').fetchone()
+            return True
+        except Error:
+            return False
+
+    def _descartar(self, conn):
+        """Cierra una conexión y libera su cupo en el pool"""
+        try:
+            conn.close()
+        except Error:
+            pass
+        with self._lock:
+            self._creadas -= 1
+
+    def adquirir(self):
+        """Entrega una conexión sana, esperando si el pool está agotado"""
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    puede_crear = self._creadas < self.tamano
+                    if puede_crear:
+                        self._creadas += 1
+                if puede_crear:
+                    try:
+                        return self._crear_conexion()
+                    except Error:
+                        with self._lock:
+                            self._creadas -= 1
+                        raise
+                try:
+                    conn = self._libres.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise sqlite3.OperationalError(
+                        f"No hay conexiones disponibles tras esperar {self.timeout} segundos"
+                    )
+
+            if self._esta_sana(conn):
+                return conn
+            self._descartar(conn)
+
+    def liberar(self, conn):
+        """Devuelve una conexión al pool, deshaciendo cualquier transacción pendiente"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Error:
+            self._descartar(conn)
+            return
+        self._libres.put(conn)
+
+    @contextmanager
+    def conexion(self):
+        """Presta una conexión del pool durante el bloque `with`"""
+        conn = self.adquirir()
+        try:
+            yield conn
+        finally:
+            self.liberar(conn)
+
+    def cerrar(self):
+        """Cierra todas las conexiones libres del pool"""
+        while True:
+            try:
+                conn = self._libres.get_nowait()
+            except queue.Empty:
+                break
+            self._descartar(conn)
+
+
+class BackendSQLite:
+    """Backend sobre un archivo SQLite con el pool de conexiones de PoolConexiones"""
+
+    nombre = 'sqlite'
+    # Tipos usados en el esquema
+    tipo_clave = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+    tipo_real = 'REAL'
+    # Subconsulta que expande un arreglo JSON recibido como parámetro
+    sql_lista_json = 'SELECT value FROM json_each(?)'
+    operador_like = 'LIKE'
+
+    def __init__(self, db_path, config=None):
+        config = config if config is not None else obtener_config_bd()
+        self.db_path = db_path
+        self.pool = PoolConexiones(
+            db_path,
+            tamano=config['tamano_pool'],
+            timeout=config['timeout_pool'],
+            pragmas=perfil_rendimiento(config)
+        )
+
+    def adquirir(self):
+        return self.pool.adquirir()
+
+    def liberar(self, conn):
+        self.pool.liberar(conn)
+
+    def cursor_lectura(self, conn):
+        """Cursor para lecturas grandes (en SQLite, un cursor normal)"""
+        return conn.cursor()
+
+    def iniciar_escritura(self, cursor):
+        """Toma el bloqueo de escritura al inicio de una transacción larga"""
+        cursor.execute('BEGIN IMMEDIATE')
+
+    def version_esquema(self, cursor):
+        """Versión del esquema aplicada a la base (PRAGMA user_version)"""
+        cursor.execute('PRAGMA user_version')
+        return cursor.fetchone()[0]
+
+    def fijar_version_esquema(self, cursor, version):
+        cursor.execute(f'PRAGMA user_version = {int(version)}')
+
+    def cerrar(self):
+        self.pool.cerrar()
+
+
+class CursorPostgres:
+    """Cursor de psycopg2 que acepta consultas con marcadores `?`"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @staticmethod
+    def _traducir(query):
+        # psycopg2 usa %s y requiere duplicar los % literales
+        return query.replace('%', '%%').replace('?', '%s')
+
+    def execute(self, query, params=None):
+        if params is None:
+            self._cursor.execute(query)
+        else:
+            self._cursor.execute(self._traducir(query), tuple(params))
+        return self
+
+    def executemany(self, query, filas):
+        # execute_batch agrupa las filas en pocos viajes al servidor
+        psycopg2.extras.execute_batch(self._cursor, self._traducir(query), filas, page_size=1000)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def fetchmany(self, cantidad):
+        return self._cursor.fetchmany(cantidad)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class ConexionPostgres:
+    """Conexión de psycopg2 con la interfaz de sqlite3 que usa db_utils"""
+
+    def __init__(self, conn):
+        self.raw = conn
+
+    def cursor(self, nombre=None):
+        """Cursor normal, o del lado del servidor si se indica `nombre`"""
+        return CursorPostgres(self.raw.cursor(name=nombre) if nombre else self.raw.cursor())
+
+    def execute(self, query, params=None):
+        return self.cursor().execute(query, params)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    @property
+    def in_transaction(self):
+        return self.raw.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class BackendPostgres:
+    """Backend sobre PostgreSQL con `psycopg2.pool.ThreadedConnectionPool`"""
+
+    nombre = 'postgres'
+    tipo_clave = 'SERIAL PRIMARY KEY'
+    tipo_real = 'DOUBLE PRECISION'
+    sql_lista_json = 'SELECT value::bigint FROM json_array_elements_text(?::json)'
+    # LIKE distingue mayúsculas en PostgreSQL; ILIKE reproduce el comportamiento de SQLite
+    operador_like = 'ILIKE'
+
+    def __init__(self, dsn, config=None):
+        if psycopg2 is None:
+            raise RuntimeError("El backend PostgreSQL requiere psycopg2 (pip install psycopg2-binary)")
+        if not dsn:
+            raise RuntimeError("Defina DATABASE_URL para usar el backend PostgreSQL")
+        config = config if config is not None else obtener_config_bd()
+        self.tamano = max(1, int(config['tamano_pool']))
+        self.timeout = config['timeout_pool']
+        self.pool = psycopg2.pool.ThreadedConnectionPool(1, self.tamano, dsn)
+        # ThreadedConnectionPool falla si está agotado; el semáforo hace esperar
+        self._cupos = threading.BoundedSemaphore(self.tamano)
+
+    @staticmethod
+    def _esta_sana(conn):
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def adquirir(self):
+        """Entrega una conexión sana, esperando si el pool está agotado"""
+        if not self._cupos.acquire(timeout=self.timeout):
+            raise psycopg2.OperationalError(
+                f"No hay conexiones disponibles tras esperar {self.timeout} segundos"
+            )
+        try:
+            while True:
+                conn = self.pool.getconn()
+                if self._esta_sana(conn):
+                    return ConexionPostgres(conn)
+                self.pool.putconn(conn, close=True)
+        except Exception:
+            self._cupos.release()
+            raise
+
+    def liberar(self, conn):
+        """Devuelve la conexión al pool, deshaciendo cualquier transacción pendiente"""
+        raw = conn.raw
+        try:
+            if not raw.closed:
+                raw.rollback()
+            self.pool.putconn(raw, close=bool(raw.closed))
+        except psycopg2.Error:
+            self.pool.putconn(raw, close=True)
+        finally:
+            self._cupos.release()
+
+    def cursor_lectura(self, conn):
+        """Cursor del lado del servidor: las filas se traen por lotes, no todas de una vez"""
+        return conn.cursor(nombre=f"catastro_{uuid.uuid4().hex}")
+
+    def iniciar_escritura(self, cursor):
+        # psycopg2 abre la transacción con la primera sentencia
+        pass
+
+    def version_esquema(self, cursor):
+        """Versión del esquema aplicada a la base (tabla version_esquema)"""
+        cursor.execute('CREATE TABLE IF NOT EXISTS version_esquema (version INTEGER NOT NULL)')
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM version_esquema')
+        return cursor.fetchone()[0]
+
+    def fijar_version_esquema(self, cursor, version):
+        cursor.execute('DELETE FROM version_esquema')
+        cursor.execute('INSERT INTO version_esquema (version) VALUES (?)', (int(version),))
+
+    def cerrar(self):
+        self.pool.closeall()
+
+
+def crear_backend(tipo, destino, config=None):
+    """
+    Crea el backend de almacenamiento indicado.
+
+    Args:
+        tipo (str): 'sqlite' o 'postgres'.
+        destino (str): Ruta del archivo SQLite o DSN de PostgreSQL.
+        config (dict): Configuración de base de datos; por defecto la de `obtener_config_bd()`.
+    """
+    if tipo == 'sqlite':
+        return BackendSQLite(destino, config)
+    if tipo in ('postgres', 'postgresql'):
+        return BackendPostgres(destino, config)
+    raise ValueError(f"Backend de base de datos desconocido: {tipo}")
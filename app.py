@@ -3,18 +3,27 @@ import sys
 import io
 import json
 import time
-import sqlite3
 import pandas as pd
 import folium
 import folium.plugins
 import plotly.graph_objects as go
 from pathlib import Path
 from datetime import datetime
-from sqlite3 import Error
 import streamlit as st
 from streamlit_folium import folium_static, st_folium
 from auth import initialize_authentication, check_auth, logout, update_user_profile, register_user
+from db_utils import (
+    init_db, guardar_propiedad, guardar_fotos, obtener_fotos, eliminar_propiedad_bd,
+    obtener_total_propiedades, obtener_conteos_categoria, obtener_propiedades, actualizar_celdas,
+    buscar_propiedades, RESULTADOS_MAXIMOS, sugerir_propiedades, resumen_propietario, autocompletar, parsear_coordenadas,
+    propiedades_en_radio, propiedades_en_poligono, cercanas, valores_distintos, obtener_propiedades_df,
+    datos_formulario, propiedades_duplicadas_archivadas, generacion_datos
+)
 import yaml
+try:
+    from streamlit_searchbox import st_searchbox
+except ImportError:  # Sin el componente, las sugerencias se muestran bajo el campo de búsqueda
+    st_searchbox = None
 from pathlib import Path
 
 # Configuración de la página - DEBE SER EL PRIMER COMANDO STREAMLIT
@@ -196,289 +205,6 @@ if 'DYNO' in os.environ:
     
     # Configurar el puerto para Heroku
     PORT = int(os.environ.get('PORT', 8501))
-    
-    # Configurar la base de datos para producción (si es necesario)
-    DB_DIR = Path('/tmp/catastro_propiedades')
-else:
-    # Configuración para desarrollo local
-    DB_DIR = Path.home() / '.catastro_propiedades'
-    
-# Asegurar que el directorio de la base de datos exista
-DB_DIR.mkdir(exist_ok=True, parents=True)
-DB_PATH = str(DB_DIR / 'catastro_propiedades.db')
-
-# ===== CÓDIGO DE DB_UTILS.PY =====
-# La configuración de la base de datos ya se hizo al inicio del archivo
-
-def get_db_connection():
-    """Crea una conexión a la base de datos SQLite"""
-    conn = None
-    try:
-        conn = sqlite3.connect(DB_PATH)
-        # Habilitar claves foráneas
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
-    except Error as e:
-        st.error(f"Error al conectar a la base de datos: {e}")
-        return None
-
-def init_db():
-    """Inicializa la base de datos con las tablas necesarias"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Tabla de propiedades
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS propiedades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                rut TEXT NOT NULL,
-                propietario TEXT NOT NULL,
-                direccion TEXT NOT NULL,
-                rol_propiedad TEXT NOT NULL,
-                avaluo_total REAL NOT NULL,
-                destino_sii TEXT,
-                destino_dom TEXT,
-                patente_comercial TEXT,
-                num_contacto TEXT,
-                coordenadas TEXT,
-                fiscalizacion_dom TEXT,
-                m2_terreno REAL,
-                m2_construidos REAL,
-                linea_construccion TEXT,
-                ano_construccion INTEGER,
-                expediente_dom TEXT,
-                observaciones TEXT,
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(rut, rol_propiedad)
-            )
-            ''')
-            
-            # Tabla de fotos
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS fotos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                propiedad_id INTEGER,
-                ruta_archivo TEXT NOT NULL,
-                fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (propiedad_id) REFERENCES propiedades (id) ON DELETE CASCADE
-            )
-            ''')
-            
-            # Índices para búsquedas frecuentes
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_rut ON propiedades(rut)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_rol ON propiedades(rol_propiedad)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fotos_propiedad ON fotos(propiedad_id)')
-            
-            conn.commit()
-            return True
-            
-        except Error as e:
-            st.error(f"Error al inicializar la base de datos: {e}")
-            return False
-        finally:
-            conn.close()
-    return False
-
-def guardar_propiedad(propiedad):
-    """Guarda o actualiza una propiedad en la base de datos"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Verificar si la propiedad ya existe (usando RUT como identificador único)
-            rut = propiedad.get('RUT', '')
-            cursor.execute('SELECT id FROM propiedades WHERE rut = ?', (rut,))
-            propiedad_existente = cursor.fetchone()
-            
-            if propiedad_existente:
-                # Actualizar propiedad existente
-                propiedad_id = propiedad_existente[0]
-                cursor.execute('''
-                UPDATE propiedades SET
-                    propietario = ?,
-                    direccion = ?,
-                    rol_propiedad = ?,
-                    avaluo_total = ?,
-                    destino_sii = ?,
-                    destino_dom = ?,
-                    patente_comercial = ?,
-                    num_contacto = ?,
-                    coordenadas = ?,
-                    fiscalizacion_dom = ?,
-                    m2_terreno = ?,
-                    m2_construidos = ?,
-                    linea_construccion = ?,
-                    ano_construccion = ?,
-                    expediente_dom = ?,
-                    observaciones = ?,
-                    fecha_actualizacion = CURRENT_TIMESTAMP
-                WHERE rut = ?
-                ''', (
-                    propiedad.get('Propietario', ''), 
-                    propiedad.get('Dirección', ''),
-                    propiedad.get('ROL Propiedad', ''), 
-                    propiedad.get('Avalúo Total', 0),
-                    propiedad.get('Destino SII', ''),
-                    propiedad.get('Destino DOM', ''), 
-                    propiedad.get('Patente Comercial', ''), 
-                    propiedad.get('N° de contacto', ''),
-                    propiedad.get('Coordenadas', ''), 
-                    propiedad.get('Fiscalización DOM', ''), 
-                    propiedad.get('M2 Terreno', 0),
-                    propiedad.get('M2 Construidos', 0), 
-                    propiedad.get('Línea de Construcción', ''),
-                    propiedad.get('Año de Construcción', ''), 
-                    propiedad.get('Expediente DOM', ''), 
-                    propiedad.get('Observaciones', ''),
-                    rut
-                ))
-            else:
-                # Insertar nueva propiedad
-                cursor.execute('''
-                INSERT INTO propiedades (
-                    rut, propietario, direccion, rol_propiedad, avaluo_total,
-                    destino_sii, destino_dom, patente_comercial, num_contacto,
-                    coordenadas, fiscalizacion_dom, m2_terreno, m2_construidos,
-                    linea_construccion, ano_construccion, expediente_dom, observaciones
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    rut,
-                    propiedad.get('Propietario', ''), 
-                    propiedad.get('Dirección', ''),
-                    propiedad.get('ROL Propiedad', ''), 
-                    propiedad.get('Avalúo Total', 0),
-                    propiedad.get('Destino SII', ''),
-                    propiedad.get('Destino DOM', ''), 
-                    propiedad.get('Patente Comercial', ''), 
-                    propiedad.get('N° de contacto', ''),
-                    propiedad.get('Coordenadas', ''), 
-                    propiedad.get('Fiscalización DOM', ''), 
-                    propiedad.get('M2 Terreno', 0),
-                    propiedad.get('M2 Construidos', 0), 
-                    propiedad.get('Línea de Construcción', ''),
-                    propiedad.get('Año de Construcción', ''), 
-                    propiedad.get('Expediente DOM', ''), 
-                    propiedad.get('Observaciones', '')
-                ))
-                propiedad_id = cursor.lastrowid
-            
-            conn.commit()
-            return propiedad_id
-            
-        except Error as e:
-            st.error(f"Error al guardar la propiedad: {e}")
-            if conn:
-                conn.rollback()
-            return None
-        finally:
-            if conn:
-                conn.close()
-    return None
-
-def guardar_fotos(propiedad_id, fotos):
-    """Guarda las rutas de las fotos en la base de datos"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            # Primero eliminamos las fotos existentes
-            cursor.execute('DELETE FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
-            # Luego insertamos las nuevas
-            for foto in fotos:
-                cursor.execute(
-                    'INSERT INTO fotos (propiedad_id, ruta_archivo) VALUES (?, ?)',
-                    (propiedad_id, foto)
-                )
-            conn.commit()
-            return True
-        except Error as e:
-            st.error(f"Error al guardar las fotos: {e}")
-            conn.rollback()
-            return False
-        finally:
-            conn.close()
-    return False
-
-def obtener_total_propiedades():
-    """Obtiene el número total de propiedades registradas"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM propiedades')
-            total = cursor.fetchone()[0]
-            return total
-        except sqlite3.Error as e:
-            st.error(f"Error al obtener el total de propiedades: {e}")
-            return 0
-        finally:
-            conn.close()
-    return 0
-
-def obtener_propiedades(pagina=1, por_pagina=10, filtros=None):
-    """Obtiene propiedades paginadas con filtros opcionales"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Construir consulta con filtros
-            query = 'SELECT * FROM propiedades'
-            params = []
-            
-            if filtros:
-                condiciones = []
-                for campo, valor in filtros.items():
-                    if valor:
-                        condiciones.append(f"{campo} LIKE ?")
-                        params.append(f"%{valor}%")
-                
-                if condiciones:
-                    query += ' WHERE ' + ' AND '.join(condiciones)
-            
-            # Contar total de registros
-            count_query = 'SELECT COUNT(*) FROM (' + query + ')'
-            cursor.execute(count_query, params)
-            total = cursor.fetchone()[0]
-            
-            # Aplicar paginación
-            offset = (pagina - 1) * por_pagina
-            query += ' ORDER BY fecha_creacion DESC LIMIT ? OFFSET ?'
-            params.extend([por_pagina, offset])
-            
-            cursor.execute(query, params)
-            columnas = [desc[0] for desc in cursor.description]
-            propiedades = [dict(zip(columnas, fila)) for fila in cursor.fetchall()]
-            
-            # Obtener fotos para cada propiedad
-            for propiedad in propiedades:
-                cursor.execute(
-                    'SELECT ruta_archivo FROM fotos WHERE propiedad_id = ?',
-                    (propiedad['id'],)
-                )
-                fotos = [foto[0] for foto in cursor.fetchall()]
-                propiedad['Fotos'] = fotos
-                # Agregar miniatura (primera foto) si existe
-                propiedad['Miniatura'] = fotos[0] if fotos else None
-            
-            return {
-                'datos': propiedades,
-                'total': total,
-                'pagina': pagina,
-                'por_pagina': por_pagina,
-                'total_paginas': (total + por_pagina - 1) // por_pagina
-            }
-            
-        except Error as e:
-            st.error(f"Error al obtener propiedades: {e}")
-            return {'datos': [], 'total': 0, 'pagina': 1, 'por_pagina': por_pagina, 'total_paginas': 0}
-        finally:
-            conn.close()
-    return {'datos': [], 'total': 0, 'pagina': 1, 'por_pagina': por_pagina, 'total_paginas': 0}
 
 # Agregar manejador para eliminar fotos
 if 'delete_photo' in st.query_params and st.query_params['delete_photo'] == 'true':
@@ -487,42 +213,36 @@ if 'delete_photo' in st.query_params and st.query_params['delete_photo'] == 'tru
             propiedad_id = st.query_params['propiedad_id']
             foto_index = int(st.query_params['foto_index'])
             
-            # Obtener la propiedad
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute('SELECT id, fotos FROM propiedades WHERE id = ?', (propiedad_id,))
-            propiedad = cursor.fetchone()
+            # Obtener las fotos de la propiedad
+            fotos = obtener_fotos(propiedad_id)
             
-            if propiedad:
-                fotos = json.loads(propiedad['fotos']) if propiedad['fotos'] else []
-                
-                if 0 <= foto_index < len(fotos):
-                    # Eliminar el archivo de la foto
-                    try:
-                        os.remove(fotos[foto_index])
-                    except Exception as e:
-                        st.error(f"Error al eliminar el archivo: {e}")
-                    
-                    # Eliminar la referencia de la base de datos
-                    fotos.pop(foto_index)
-                    cursor.execute('UPDATE propiedades SET fotos = ? WHERE id = ?', 
-                                 (json.dumps(fotos), propiedad_id))
-                    conn.commit()
+            if 0 <= foto_index < len(fotos):
+                # Eliminar el archivo de la foto
+                try:
+                    os.remove(fotos[foto_index])
+                except Exception as e:
+                    st.error(f"Error al eliminar el archivo: {e}")
+            
+                # Eliminar la referencia de la base de datos
+                fotos.pop(foto_index)
+                if guardar_fotos(propiedad_id, fotos):
                     st.success("Foto eliminada correctamente")
-                else:
-                    st.error("Índice de foto no válido")
             else:
-                st.error("Propiedad no encontrada")
+                st.error("Índice de foto no válido")
                 
         except Exception as e:
             st.error(f"Error al procesar la solicitud: {e}")
-        finally:
-            conn.close()
 
 # Inicializar la base de datos al inicio
 if 'db_initialized' not in st.session_state:
     if init_db():
         st.session_state.db_initialized = True
+        duplicadas = propiedades_duplicadas_archivadas()
+        if duplicadas:
+            st.warning(
+                f"{duplicadas} propiedades repetían RUT (en otro formato) y ROL y se unieron a su registro "
+                "más reciente; sus datos anteriores quedaron en la tabla propiedades_duplicadas."
+            )
     else:
         st.error("No se pudo inicializar la base de datos. La aplicación podría no funcionar correctamente.")
 
@@ -830,23 +550,54 @@ if opcion == "Inicio":
 
 def parse_coordenadas(coord_str):
     """Convierte string de coordenadas a tupla de flotantes (lat, lon)"""
-    try:
-        if not coord_str or not isinstance(coord_str, str):
-            return None
-        
-        # Eliminar paréntesis y espacios si existen
-        coord_str = coord_str.strip('() ').replace(' ', '')
-        
-        # Dividir por coma
-        if ',' in coord_str:
-            lat, lon = coord_str.split(',', 1)
-            lat = float(lat.strip())
-            lon = float(lon.strip())
-            if -90 <= lat <= 90 and -180 <= lon <= 180:
-                return (lat, lon)
-        return None
-    except:
-        return None
+    return parsear_coordenadas(coord_str)
+
+def barra_filtros_avanzados():
+    """
+    Filtros avanzados de la barra lateral (rangos, categorías y fechas).
+
+    Devuelve el diccionario de filtros para obtener_propiedades (ver
+    FILTROS_PROPIEDADES en db_utils).
+    """
+    filtros = {}
+    with st.sidebar.expander("🎚️ Filtros avanzados"):
+        for columna, etiqueta, minimo in (
+            ('avaluo_total', 'Avalúo Total', 0),
+            ('m2_terreno', 'M² Terreno', 0.0),
+            ('m2_construidos', 'M² Construidos', 0.0),
+            ('ano_construccion', 'Año de Construcción', 0),
+        ):
+            col_desde, col_hasta = st.columns(2)
+            desde = col_desde.number_input(f"{etiqueta} desde", value=None, min_value=minimo, key=f"filtro_desde_{columna}")
+            hasta = col_hasta.number_input("hasta", value=None, min_value=minimo, key=f"filtro_hasta_{columna}")
+            if desde is not None or hasta is not None:
+                filtros[columna] = (desde, hasta)
+
+        for columna, etiqueta in (
+            ('destino_sii', 'Destino SII'),
+            ('destino_dom', 'Destino DOM'),
+            ('fiscalizacion_dom', 'Fiscalización DOM'),
+            ('patente_comercial', 'Patente Comercial'),
+        ):
+            # Los valores posibles salen de los contadores por categoría, sin recorrer la tabla
+            seleccion = st.multiselect(
+                etiqueta,
+                options=sorted(obtener_conteos_categoria(columna)),
+                format_func=lambda valor: valor or "(sin dato)",
+                key=f"filtro_categoria_{columna}"
+            )
+            if seleccion:
+                filtros[columna] = seleccion
+
+        for columna, etiqueta in (
+            ('fecha_creacion', 'Fecha de registro'),
+            ('fecha_actualizacion', 'Última actualización'),
+        ):
+            rango = st.date_input(etiqueta, value=[], key=f"filtro_fecha_{columna}")
+            if rango:
+                filtros[columna] = (rango[0], rango[1] if len(rango) > 1 else None)
+
+    return filtros
 
 def validar_rut(rut):
     """
@@ -1525,6 +1276,8 @@ if opcion == "Agregar Propiedad":
                 # Si estamos en modo edición, agregar el ID de la propiedad
                 if modo_edicion and 'id' in st.session_state['propiedad_editar']:
                     propiedad['id'] = st.session_state['propiedad_editar']['id']
+                    # Versión leída: si otra sesión la cambió entretanto, no se sobrescribe
+                    propiedad['version'] = st.session_state['propiedad_editar'].get('version')
                 
                 # Guardar la propiedad en la base de datos
                 propiedad_id = guardar_propiedad(propiedad)
@@ -1553,6 +1306,30 @@ if opcion == "Agregar Propiedad":
                 else:
                     st.error("❌ Error al guardar la propiedad. Por favor intente nuevamente.")
         
+        # Propiedades cercanas (solo en modo edición), p. ej. para revisar vecinos con construcción irregular
+        if modo_edicion and st.session_state['propiedad_editar'].get('id'):
+            with st.expander("📍 Propiedades cercanas", expanded=False):
+                cantidad_cercanas = st.slider("Cantidad de vecinas", min_value=5, max_value=50, value=10, step=5)
+                vecinas = cercanas(st.session_state['propiedad_editar']['id'], cantidad_cercanas)
+                if vecinas:
+                    st.dataframe(
+                        pd.DataFrame(vecinas)[
+                            ['distancia_m', 'direccion', 'propietario', 'rol_propiedad', 'fiscalizacion_dom', 'patente_comercial']
+                        ],
+                        column_config={
+                            'distancia_m': st.column_config.NumberColumn("Distancia (m)", format="%.0f"),
+                            'direccion': "Dirección",
+                            'propietario': "Propietario",
+                            'rol_propiedad': "ROL",
+                            'fiscalizacion_dom': "Fiscalización DOM",
+                            'patente_comercial': "Patente Comercial",
+                        },
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                else:
+                    st.info("La propiedad no tiene coordenadas registradas.")
+
         # Sección 7: Eliminar Propiedad (solo en modo edición) - Fuera del formulario
         if modo_edicion and 'propiedad_editar' in st.session_state and 'id' in st.session_state['propiedad_editar']:
             propiedad_id = st.session_state['propiedad_editar']['id']
@@ -1584,27 +1361,15 @@ if opcion == "Agregar Propiedad":
                 col1, col2, _ = st.columns([1, 1, 3])
                 with col1:
                     if st.button("✅ Confirmar eliminación", key=f"confirmar_si_{propiedad_id}"):
-                        conn = None
-                        try:
-                            conn = get_db_connection()
-                            cursor = conn.cursor()
-                            
-                            # Obtener información de las fotos para eliminarlas del sistema de archivos
-                            cursor.execute('SELECT ruta_archivo FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
-                            fotos = cursor.fetchall()
-                            
+                        fotos = eliminar_propiedad_bd(propiedad_id)
+                        if fotos is not None:
                             # Eliminar archivos físicos
                             for foto in fotos:
                                 try:
-                                    if foto[0] and os.path.exists(foto[0]):
-                                        os.remove(foto[0])
+                                    if foto and os.path.exists(foto):
+                                        os.remove(foto)
                                 except Exception as e:
-                                    st.error(f"Error al eliminar el archivo {foto[0] if foto[0] else 'desconocido'}: {e}")
-                            
-                            # Eliminar registros de la base de datos
-                            cursor.execute('DELETE FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
-                            cursor.execute('DELETE FROM propiedades WHERE id = ?', (propiedad_id,))
-                            conn.commit()
+                                    st.error(f"Error al eliminar el archivo {foto}: {e}")
                             
                             st.success("✅ Propiedad eliminada correctamente.")
                             
@@ -1617,14 +1382,6 @@ if opcion == "Agregar Propiedad":
                             # Esperar 1 segundo antes de recargar para que se vea el mensaje
                             time.sleep(1)
                             st.rerun()
-                            
-                        except Error as e:
-                            st.error(f"❌ Error al eliminar la propiedad: {str(e)}")
-                            if conn:
-                                conn.rollback()
-                        finally:
-                            if conn:
-                                conn.close()
                 
                 with col2:
                     if st.button("❌ Cancelar", key=f"confirmar_no_{propiedad_id}"):
@@ -1645,272 +1402,283 @@ elif opcion == "Ver/Editar Propiedades":
         </div>
     """, unsafe_allow_html=True)
     
-    # Crear pestañas para tabla, mapa y estadísticas
-    tab1, tab2, tab3 = st.tabs(["📋 Tabla de Datos", "🗺️ Mapa de Propiedades", "📈 Estadísticas"])
+    # Selector de vista para tabla, mapa y estadísticas. A diferencia de st.tabs, que
+    # ejecuta el contenido de todas las pestañas en cada recarga, solo se calcula la vista elegida
+    vista = st.radio(
+        "Vista",
+        ["📋 Tabla de Datos", "🗺️ Mapa de Propiedades", "📈 Estadísticas"],
+        horizontal=True,
+        label_visibility="collapsed",
+        key="vista_propiedades"
+    )
     
-    propiedades = obtener_propiedades()
+    # Filtros por columna: las opciones son los valores distintos de la base (en caché
+    # hasta la siguiente escritura) y la selección se aplica en SQL con IN (...)
+    st.sidebar.markdown("### 🔍 Filtros por Columna")
+    filtros_columnas = {}
+    for col_amigable, col_real in (
+        ('RUT', 'rut'),
+        ('Propietario', 'propietario'),
+        ('ROL Propiedad', 'rol_propiedad'),
+        ('Dirección', 'direccion'),
+    ):
+        seleccion = st.sidebar.multiselect(
+            f"Filtrar por {col_amigable}",
+            options=valores_distintos(col_real),
+            default=[],
+            key=f"filtro_{col_real}",
+            help=f"Busque y seleccione {col_amigable.lower()} para filtrar"
+        )
+        if seleccion:
+            filtros_columnas[col_real] = seleccion
+
+    # Los filtros avanzados se aplican en la base y los comparten la tabla y el mapa; quedan
+    # en la sesión, junto con los filtros por columna, para que la exportación use los mismos
+    filtros_avanzados = {**barra_filtros_avanzados(), **filtros_columnas}
+    st.session_state['filtros_avanzados'] = filtros_avanzados
+
+    # Paginación: solo la página visible se lee de la base y tiene widgets de acción.
+    # Los controles se dibujan bajo la tabla; aquí se leen sus valores de la sesión
+    if st.session_state.get('firma_filtros_propiedades') != repr(filtros_avanzados):
+        st.session_state['firma_filtros_propiedades'] = repr(filtros_avanzados)
+        st.session_state['pagina_propiedades'] = 1
+    por_pagina = st.session_state.get('por_pagina_propiedades', 50)
+    propiedades = obtener_propiedades(st.session_state.get('pagina_propiedades', 1), por_pagina, filtros_avanzados)
+    if not propiedades['datos'] and propiedades['total_paginas']:
+        # La página quedó fuera de rango (p. ej. tras eliminar): ir a la última
+        st.session_state['pagina_propiedades'] = propiedades['total_paginas']
+        propiedades = obtener_propiedades(propiedades['total_paginas'], por_pagina, filtros_avanzados)
     
     if len(propiedades['datos']) > 0:
-        with tab1:
+        # Mostrar estadísticas de filtrado
+        if filtros_columnas:
+            def limpiar_filtros_columnas():
+                # En un callback: los multiselect ya están creados en esta ejecución
+                for col in filtros_columnas:
+                    st.session_state[f"filtro_{col}"] = []
+
+            st.sidebar.markdown("---")
+            st.sidebar.markdown("### 📊 Estadísticas de Filtrado")
+            st.sidebar.write(f"Propiedades que cumplen los filtros: **{propiedades['total']}**")
+            st.sidebar.button("Limpiar Filtros", on_click=limpiar_filtros_columnas)
+
+        if vista == "📋 Tabla de Datos":
             # Convertir a DataFrame
             df = pd.DataFrame(propiedades['datos'])
             
-            # Crear filtros para cada columna
-            st.sidebar.markdown("### 🔍 Filtros por Columna")
-            
-            # Diccionario para almacenar los filtros
-            filtros = {}
-            
-            # Mapeo de nombres de columnas amigables a nombres reales en la base de datos
-            mapeo_columnas = {
-                'RUT': 'rut',
-                'Propietario': 'propietario',
-                'ROL Propiedad': 'rol_propiedad',
-                'Dirección': 'direccion'
-            }
-            
-            # Columnas específicas para filtrar (nombres amigables)
-            columnas_filtrables = ['RUT', 'Propietario', 'ROL Propiedad', 'Dirección']
-            
-            # Crear un filtro para cada columna específica
-            for col_amigable in columnas_filtrables:
-                if mapeo_columnas[col_amigable] in df.columns:
-                    col_real = mapeo_columnas[col_amigable]
-                    try:
-                        # Convertir a string y limpiar los valores
-                        df[col_real] = df[col_real].astype(str).str.strip()
-                        
-                        # Obtener valores únicos, ordenados y sin valores vacíos
-                        valores_unicos = sorted([v for v in df[col_real].dropna().unique().tolist() if v and v != 'nan'])
-                        
-                        if valores_unicos:  # Solo crear el filtro si hay valores
-                            seleccion = st.sidebar.multiselect(
-                                f"Filtrar por {col_amigable}",
-                                options=valores_unicos,
-                                default=[],
-                                key=f"filtro_{col_real}",
-                                help=f"Busque y seleccione {col_amigable.lower()} para filtrar"
-                            )
-                            if seleccion:  # Si hay alguna selección, aplicar el filtro
-                                filtros[col_real] = seleccion
-                    except Exception as e:
-                        # Si hay un error al procesar la columna, la omitimos
-                        st.sidebar.error(f"Error al crear filtro para {col_amigable}: {str(e)}")
-                        continue
-            
-            # Aplicar filtros al DataFrame
-            if filtros:
-                for col, valores in filtros.items():
-                    if 'Todos' not in valores:  # Si no se seleccionó 'Todos', aplicar el filtro
-                        df = df[df[col].astype(str).isin(valores)]
-                # Mostrar el DataFrame con los filtros aplicados
-                if not df.empty:
-                    st.write(f"Mostrando {len(df)} de {len(propiedades['datos'])} propiedades")
+            # Mostrar el DataFrame con los filtros aplicados
+            if not df.empty:
+                inicio = (propiedades['pagina'] - 1) * por_pagina
+                st.write(f"Mostrando {inicio + 1}-{inicio + len(df)} de {propiedades['total']} propiedades")
                     
-                    # Crear una copia del DataFrame para no modificar el original
-                    display_df = df.copy()
+                # Crear una copia del DataFrame para no modificar el original
+                display_df = df.copy()
                     
-                    # Configurar las columnas a mostrar
-                    column_config = {}
+                # Configurar las columnas a mostrar
+                column_config = {}
                     
-                    # Configurar la columna de miniatura
-                    if 'Miniatura' in display_df.columns:
-                        # Mover la columna Miniatura al principio
-                        cols = ['Miniatura'] + [col for col in display_df.columns if col != 'Miniatura' and col != 'Fotos']
-                        display_df = display_df[cols]
+                # Configurar la columna de miniatura
+                if 'Miniatura' in display_df.columns:
+                    # Mover la columna Miniatura al principio
+                    cols = ['Miniatura'] + [col for col in display_df.columns if col != 'Miniatura' and col != 'Fotos']
+                    display_df = display_df[cols]
                         
-                        # Configurar la columna de miniaturas
-                        column_config["Miniatura"] = st.column_config.ImageColumn(
-                            "Foto",
-                            help="Miniatura de la propiedad",
-                            width="small"
-                        )
-                    
-                    # Configurar la columna de Fotos (lista completa)
-                    if 'Fotos' in display_df.columns:
-                        column_config["Fotos"] = st.column_config.ListColumn(
-                            "Todas las Fotos",
-                            help="Todas las fotos de la propiedad"
-                        )
-                    
-                    # Agregar columna de acciones
-                    if 'Acciones' not in display_df.columns:
-                        display_df['Acciones'] = ''
-                    
-                    # Configurar la columna de acciones
-                    column_config["Acciones"] = st.column_config.Column(
-                        "Acciones",
-                        help="Acciones disponibles para la propiedad",
+                    # Configurar la columna de miniaturas
+                    column_config["Miniatura"] = st.column_config.ImageColumn(
+                        "Foto",
+                        help="Miniatura de la propiedad",
                         width="small"
                     )
                     
-                    # Mostrar el editor de datos
-                    st.markdown("""
-                        <style>
-                            img {
-                                max-height: 50px;
-                                width: auto;
-                                border-radius: 4px;
-                            }
-                            .stDataFrame img {
-                                max-height: 50px !important;
-                                width: auto !important;
-                            }
-                            .stButton button {
-                                padding: 0.25rem 0.5rem;
-                                font-size: 0.8rem;
-                            }
-                        </style>
-                    """, unsafe_allow_html=True)
+                # Configurar la columna de Fotos (lista completa)
+                if 'Fotos' in display_df.columns:
+                    column_config["Fotos"] = st.column_config.ListColumn(
+                        "Todas las Fotos",
+                        help="Todas las fotos de la propiedad"
+                    )
+                    
+                # lat/lon se calculan desde las coordenadas; no se editan directamente
+                for columna in ('lat', 'lon'):
+                    if columna in display_df.columns:
+                        column_config[columna] = st.column_config.NumberColumn(columna, disabled=True, format="%.6f")
+                # La versión la incrementa la base en cada escritura
+                if 'version' in display_df.columns:
+                    column_config['version'] = st.column_config.NumberColumn("Versión", disabled=True)
+                    
+                # Mostrar el editor de datos
+                st.markdown("""
+                    <style>
+                        img {
+                            max-height: 50px;
+                            width: auto;
+                            border-radius: 4px;
+                        }
+                        .stDataFrame img {
+                            max-height: 50px !important;
+                            width: auto !important;
+                        }
+                        .stButton button {
+                            padding: 0.25rem 0.5rem;
+                            font-size: 0.8rem;
+                        }
+                    </style>
+                """, unsafe_allow_html=True)
                     
-                    # Función para manejar la eliminación de propiedades
-                    def eliminar_propiedad(propiedad_id, propiedad_info):
-                        # Usar el estado de la sesión para controlar la confirmación
-                        if f'confirmar_eliminar_{propiedad_id}' not in st.session_state:
-                            st.session_state[f'confirmar_eliminar_{propiedad_id}'] = False
+                # Función para manejar la eliminación de propiedades
+                def eliminar_propiedad(propiedad_id, propiedad_info):
+                    # Usar el estado de la sesión para controlar la confirmación
+                    if f'confirmar_eliminar_{propiedad_id}' not in st.session_state:
+                        st.session_state[f'confirmar_eliminar_{propiedad_id}'] = False
                         
-                        # Mostrar diálogo de confirmación
-                        if not st.session_state[f'confirmar_eliminar_{propiedad_id}']:
-                            if st.button(f"🗑️ Eliminar {propiedad_id}", key=f"btn_eliminar_{propiedad_id}"):
-                                st.session_state[f'confirmar_eliminar_{propiedad_id}'] = True
-                                st.rerun()
-                        else:
-                            st.warning(
-                                """
-                                ⚠️ **¿Está seguro que desea eliminar esta propiedad?**  
+                    # Mostrar diálogo de confirmación
+                    if not st.session_state[f'confirmar_eliminar_{propiedad_id}']:
+                        if st.button(f"🗑️ Eliminar {propiedad_id}", key=f"btn_eliminar_{propiedad_id}"):
+                            st.session_state[f'confirmar_eliminar_{propiedad_id}'] = True
+                            st.rerun()
+                    else:
+                        st.warning(
+                            """
+                            ⚠️ **¿Está seguro que desea eliminar esta propiedad?**  
                                 
-                                **Propietario:** {}  
-                                **Dirección:** {}  
-                                **RUT:** {}  
+                            **Propietario:** {}  
+                            **Dirección:** {}  
+                            **RUT:** {}  
                                 
-                                Esta acción es irreversible y eliminará todos los datos asociados, incluidas las fotos.
-                                """.format(
-                                    propiedad_info.get('Propietario', 'Sin especificar'),
-                                    propiedad_info.get('Dirección', 'Sin especificar'),
-                                    propiedad_info.get('RUT', 'Sin especificar')
-                                )
+                            Esta acción es irreversible y eliminará todos los datos asociados, incluidas las fotos.
+                            """.format(
+                                propiedad_info.get('Propietario', 'Sin especificar'),
+                                propiedad_info.get('Dirección', 'Sin especificar'),
+                                propiedad_info.get('RUT', 'Sin especificar')
                             )
+                        )
                             
-                            # Botones de confirmación
-                            col1, col2, _ = st.columns([1, 1, 3])
-                            with col1:
-                                if st.button("✅ Confirmar eliminación", key=f"confirmar_si_{propiedad_id}"):
-                                    conn = None
-                                    try:
-                                        conn = get_db_connection()
-                                        cursor = conn.cursor()
-                                        
-                                        # Obtener información de las fotos para eliminarlas del sistema de archivos
-                                        cursor.execute('SELECT ruta_archivo FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
-                                        fotos = cursor.fetchall()
-                                        
-                                        # Eliminar archivos físicos
-                                        for foto in fotos:
-                                            try:
-                                                if foto[0] and os.path.exists(foto[0]):
-                                                    os.remove(foto[0])
-                                            except Exception as e:
-                                                st.error(f"Error al eliminar el archivo {foto[0] if foto[0] else 'desconocido'}: {e}")
-                                        
-                                        # Eliminar registros de la base de datos
-                                        cursor.execute('DELETE FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
-                                        cursor.execute('DELETE FROM propiedades WHERE id = ?', (propiedad_id,))
-                                        conn.commit()
-                                        
-                                        st.success("✅ Propiedad eliminada correctamente.")
-                                        # Limpiar el estado de confirmación
-                                        st.session_state[f'confirmar_eliminar_{propiedad_id}'] = False
-                                        # Esperar 1 segundo antes de recargar para que se vea el mensaje
-                                        time.sleep(1)
-                                        st.rerun()
+                        # Botones de confirmación
+                        col1, col2, _ = st.columns([1, 1, 3])
+                        with col1:
+                            if st.button("✅ Confirmar eliminación", key=f"confirmar_si_{propiedad_id}"):
+                                fotos = eliminar_propiedad_bd(propiedad_id)
+                                if fotos is not None:
+                                    # Eliminar archivos físicos
+                                    for foto in fotos:
+                                        try:
+                                            if foto and os.path.exists(foto):
+                                                os.remove(foto)
+                                        except Exception as e:
+                                            st.error(f"Error al eliminar el archivo {foto}: {e}")
                                         
-                                    except Error as e:
-                                        st.error(f"❌ Error al eliminar la propiedad: {str(e)}")
-                                        if conn:
-                                            conn.rollback()
-                                    finally:
-                                        if conn:
-                                            conn.close()
-                            
-                            with col2:
-                                if st.button("❌ Cancelar", key=f"confirmar_no_{propiedad_id}"):
+                                    st.success("✅ Propiedad eliminada correctamente.")
+                                    # Limpiar el estado de confirmación
                                     st.session_state[f'confirmar_eliminar_{propiedad_id}'] = False
+                                    # Esperar 1 segundo antes de recargar para que se vea el mensaje
+                                    time.sleep(1)
                                     st.rerun()
+                            
+                        with col2:
+                            if st.button("❌ Cancelar", key=f"confirmar_no_{propiedad_id}"):
+                                st.session_state[f'confirmar_eliminar_{propiedad_id}'] = False
+                                st.rerun()
                     
-                    # Mostrar botones de acción para cada propiedad
-                    for idx, row in display_df.iterrows():
-                        col1, col2 = st.columns([1, 1])
+                # Función para guardar solo las celdas modificadas en el editor
+                def guardar_cambios_editor(ids_filas, versiones_filas):
+                    # edited_rows acumula {fila: {columna: valor}} desde que se cargó el editor
+                    edited_rows = st.session_state['editor_propiedades'].get('edited_rows', {})
+                    aplicados = st.session_state.setdefault('editor_cambios_aplicados', {})
+                    # Versiones tras los guardados de esta sesión (las de la grilla pueden estar atrasadas)
+                    versiones_guardadas = st.session_state.setdefault('editor_versiones', {})
                         
-                        with col1:
-                            if st.button(f"✏️ Editar {row['id']}", key=f"editar_{row['id']}"):
-                                # Convertir la fila a diccionario
-                                propiedad_editar = row.to_dict()
-                                
-                                # Mapear nombres de columnas a mayúsculas para consistencia con el formulario
-                                mapeo_columnas = {
-                                    'id': 'ID',
-                                    'rut': 'RUT',
-                                    'propietario': 'Propietario',
-                                    'direccion': 'Dirección',
-                                    'rol': 'ROL',
-                                    'tipo_propiedad': 'Tipo de Propiedad',
-                                    'estado_fiscalizacion': 'Estado de Fiscalización',
-                                    # Agrega aquí más mapeos según sea necesario
-                                }
-                                
-                                # Crear nuevo diccionario con las claves mapeadas
-                                propiedad_editar_mapeada = {}
-                                for key, value in propiedad_editar.items():
-                                    # Usar el nombre mapeado si existe, de lo contrario mantener el original
-                                    new_key = mapeo_columnas.get(key.lower(), key)
-                                    propiedad_editar_mapeada[new_key] = value
-                                
-                                # Guardar los datos en session_state
-                                st.session_state['propiedad_editar'] = propiedad_editar_mapeada
-                                
-                                # Cambiar a la pestaña de Agregar Propiedad
-                                st.session_state['opcion_seleccionada'] = "Agregar Propiedad"
-                                # Forzar recarga para mostrar el formulario de edición
-                                st.rerun()
-                        with col2:
-                            # Llamar a la función de eliminación
-                            eliminar_propiedad(row['id'], row)
+                    # Quedarse solo con las celdas que aún no se han guardado
+                    cambios = {}
+                    for fila, celdas in edited_rows.items():
+                        propiedad_id = int(ids_filas[int(fila)])
+                        ya_guardadas = aplicados.get(propiedad_id, {})
+                        nuevas = {col: val for col, val in celdas.items() if ya_guardadas.get(col, object()) != val}
+                        if nuevas:
+                            cambios[propiedad_id] = nuevas
+                        
+                    if cambios:
+                        versiones = {}
+                        for propiedad_id, version in zip(ids_filas, versiones_filas):
+                            if int(propiedad_id) in cambios:
+                                versiones[int(propiedad_id)] = max(
+                                    int(version), versiones_guardadas.get(int(propiedad_id), 0)
+                                )
+                        resumen = actualizar_celdas(cambios, versiones)
+                        if resumen is not None:
+                            for propiedad_id, celdas in cambios.items():
+                                if propiedad_id not in resumen['conflictos']:
+                                    aplicados.setdefault(propiedad_id, {}).update(celdas)
+                            versiones_guardadas.update(resumen['versiones'])
+                            st.session_state['resumen_editor'] = resumen
                     
-                    # Mostrar el dataframe sin la columna de acciones
-                    display_df = display_df.drop(columns=['Acciones'])
+                # Mostrar el resumen del último guardado
+                resumen = st.session_state.pop('resumen_editor', None)
+                if resumen:
+                    mensaje = f"✅ {resumen['celdas']} celda(s) guardada(s) en {resumen['propiedades']} propiedad(es)"
+                    if resumen['ignoradas']:
+                        mensaje += f" (columnas no editables ignoradas: {', '.join(resumen['ignoradas'])})"
+                    st.success(mensaje)
+                    if resumen['conflictos']:
+                        st.warning(
+                            "⚠️ No se guardaron los cambios de las propiedades "
+                            f"{', '.join(str(propiedad_id) for propiedad_id in resumen['conflictos'])}: "
+                            "otro usuario las modificó mientras usted editaba. Recargue la página para ver sus datos actuales."
+                        )
                     
-                    # Mostrar el editor de datos
-                    edited_df = st.data_editor(
-                        display_df,
-                        column_config=column_config,
-                        num_rows="fixed",
-                        use_container_width=True,
-                        hide_index=True,
-                        key="editor_propiedades"
+                # Mostrar el editor de datos
+                edited_df = st.data_editor(
+                    display_df,
+                    column_config=column_config,
+                    num_rows="fixed",
+                    use_container_width=True,
+                    hide_index=True,
+                    key="editor_propiedades",
+                    on_change=guardar_cambios_editor,
+                    args=(display_df['id'].tolist(), display_df['version'].tolist())
+                )
+
+                # Controles de página
+                col_pagina, col_por_pagina, _ = st.columns([1, 1, 2])
+                with col_pagina:
+                    st.number_input(
+                        f"Página (de {propiedades['total_paginas']})",
+                        min_value=1,
+                        max_value=max(1, propiedades['total_paginas']),
+                        key='pagina_propiedades'
                     )
+                with col_por_pagina:
+                    st.selectbox("Filas por página", [25, 50, 100, 200], index=1, key='por_pagina_propiedades')
+
+                # Acciones sobre una propiedad de la página (los widgets no crecen con la tabla)
+                st.markdown("#### Acciones")
+                filas_pagina = {row['id']: row for _, row in df.iterrows()}
+                propiedad_accion = st.selectbox(
+                    "Propiedad",
+                    options=list(filas_pagina),
+                    format_func=lambda propiedad_id: (
+                        f"{propiedad_id} - {filas_pagina[propiedad_id].get('direccion', '')} "
+                        f"({filas_pagina[propiedad_id].get('propietario', '')})"
+                    ),
+                    key='propiedad_accion'
+                )
+                row = filas_pagina[propiedad_accion]
+                col1, col2 = st.columns([1, 1])
                     
-                    # Guardar cambios si hay modificaciones
-                    if not edited_df.equals(display_df):
-                        # Actualizar propiedades en la base de datos
-                        for i, propiedad in edited_df.iterrows():
-                            guardar_propiedad(propiedad.to_dict())
-                        st.success("¡Cambios guardados exitosamente!")
+                with col1:
+                    if st.button(f"✏️ Editar {row['id']}", key=f"editar_{row['id']}"):
+                        # Datos con las claves del formulario, más el id y la versión leída
+                        st.session_state['propiedad_editar'] = datos_formulario(row.to_dict())
+                            
+                        # Cambiar a la pestaña de Agregar Propiedad
+                        st.session_state['opcion_seleccionada'] = "Agregar Propiedad"
+                        # Forzar recarga para mostrar el formulario de edición
                         st.rerun()
+                with col2:
+                    # Llamar a la función de eliminación
+                    eliminar_propiedad(row['id'], row)
             else:
                 st.warning("No hay propiedades que coincidan con los filtros seleccionados.")
         
-        # Mostrar estadísticas de filtrado
-        if filtros:
-            st.sidebar.markdown("---")
-            st.sidebar.markdown("### 📊 Estadísticas de Filtrado")
-            st.sidebar.write(f"Propiedades mostradas: **{len(df)}** de {len(propiedades['datos'])}")
-            if st.sidebar.button("Limpiar Filtros"):
-                for col in columnas_filtrables:
-                    if f"filtro_{col}" in st.session_state:
-                        st.session_state[f"filtro_{col}"] = []
-                st.rerun()
-        
-        with tab2:
+        elif vista == "🗺️ Mapa de Propiedades":
             m = crear_mapa()
             
             # Agregar agrupador de marcadores
@@ -1921,8 +1689,16 @@ elif opcion == "Ver/Editar Propiedades":
                 icon_create_function=None
             ).add_to(m)
             
+            # El mapa muestra todas las propiedades filtradas, no solo la página de la tabla,
+            # leyendo solo las columnas del marcador y del popup
+            mapa_df = obtener_propiedades_df(filtros_avanzados, columnas=[
+                'coordenadas', 'lat', 'lon', 'direccion', 'rol_propiedad', 'propietario', 'rut',
+                'm2_terreno', 'm2_construidos', 'fiscalizacion_dom', 'destino_dom'
+            ])
+            mapa_df = mapa_df.astype(object).where(mapa_df.notna(), None)
+            
             # Contador para depuración
-            total_propiedades = len(propiedades['datos'])
+            total_propiedades = len(mapa_df)
             sin_coordenadas = 0
             coordenadas_invalidas = 0
             marcadores_agregados = 0
@@ -1930,15 +1706,19 @@ elif opcion == "Ver/Editar Propiedades":
             # Agregar marcadores para cada propiedad con coordenadas válidas
             st.write(f"Total de propiedades: {total_propiedades}")
             
-            for propiedad in propiedades['datos']:
+            for propiedad in mapa_df.to_dict('records'):
                 # Verificar si la propiedad tiene coordenadas y son válidas
                 coordenadas = propiedad.get('Coordenadas') or propiedad.get('coordenadas')
                 
                 if not coordenadas or not isinstance(coordenadas, str):
                     sin_coordenadas += 1
                     continue
-                    
-                coords = parse_coordenadas(coordenadas)
+                
+                # lat/lon ya vienen calculadas desde la base; solo se interpreta el texto si faltan
+                if propiedad.get('lat') is not None and propiedad.get('lon') is not None:
+                    coords = (propiedad['lat'], propiedad['lon'])
+                else:
+                    coords = parse_coordenadas(coordenadas)
                 
                 if not coords:
                     coordenadas_invalidas += 1
@@ -2021,22 +1801,17 @@ elif opcion == "Ver/Editar Propiedades":
             # Mostrar el mapa
             folium_static(m, width=1200, height=700)
         
-        with tab3:
+        else:
             st.markdown("""<h3 style='color: #1e3d59;'>📈 Estado de Fiscalización de las Propiedades</h3>""", unsafe_allow_html=True)
             
             # Mostrar estadísticas detalladas
             st.subheader("Análisis por Fiscalización DOM")
-            fiscalizadas_count = {}
-            for propiedad in propiedades['datos']:
-                # Usar get() con valor por defecto 'No Especificada' si la clave no existe
-                fiscalizacion_dom = propiedad.get('fiscalizacion_dom', 'No Especificada')
-                # Si el valor es None o vacío, usar 'No Especificada'
-                if not fiscalizacion_dom:
-                    fiscalizacion_dom = 'No Especificada'
-                if fiscalizacion_dom in fiscalizadas_count:
-                    fiscalizadas_count[fiscalizacion_dom] += 1
-                else:
-                    fiscalizadas_count[fiscalizacion_dom] = 1
+            # Sobre todas las propiedades filtradas, como el mapa (sin filtros, desde los contadores)
+            total_filtradas = propiedades['total']
+            fiscalizadas_count = {
+                valor or 'No Especificada': cantidad
+                for valor, cantidad in obtener_conteos_categoria('fiscalizacion_dom', filtros_avanzados).items()
+            }
             
             # Gráfico de torta para Fiscalización DOM
             labels = list(fiscalizadas_count.keys())
@@ -2106,82 +1881,50 @@ elif opcion == "Ver/Editar Propiedades":
                 st.metric(
                     label="CONSTRUCCION REGULARIZADA",
                     value=fiscalizadas_count.get('CONSTRUCCION REGULARIZADA', 0),
-                    delta=f"{(fiscalizadas_count.get('CONSTRUCCION REGULARIZADA', 0) / len(propiedades['datos']) * 100):.1f}% del total" if len(propiedades['datos']) > 0 else "0%"
+                    delta=f"{(fiscalizadas_count.get('CONSTRUCCION REGULARIZADA', 0) / total_filtradas * 100):.1f}% del total" if total_filtradas > 0 else "0%"
                 )
             with col2:
                 st.metric(
                     label="CONSTRUCCION IRREGULAR",
                     value=fiscalizadas_count.get('CONSTRUCCION IRREGULAR', 0),
-                    delta=f"{(fiscalizadas_count.get('CONSTRUCCION IRREGULAR', 0) / len(propiedades['datos']) * 100):.1f}% del total" if len(propiedades['datos']) > 0 else "0%"
+                    delta=f"{(fiscalizadas_count.get('CONSTRUCCION IRREGULAR', 0) / total_filtradas * 100):.1f}% del total" if total_filtradas > 0 else "0%"
                 )
             
-            # Análisis de PATENTE COMERCIAL
+            # Análisis de PATENTE COMERCIAL, con la misma fuente que la fiscalización
             st.markdown("---")
             st.subheader("Análisis por Patente Comercial")
-            if 'Patente Comercial' in propiedades['datos'][0]:
-                patentes_count = {}
-                for propiedad in propiedades['datos']:
-                    patente_comercial = propiedad['Patente Comercial']
-                    if patente_comercial in patentes_count:
-                        patentes_count[patente_comercial] += 1
-                    else:
-                        patentes_count[patente_comercial] = 1
-                
-                # Gráfico de barras para Patente Comercial
-                fig2 = go.Figure([
-                    go.Bar(
-                        x=list(patentes_count.keys()),
-                        y=list(patentes_count.values()),
-                        marker_color=['#3498db', '#2ecc71', '#e74c3c']
-                    )
-                ])
-                fig2.update_layout(
-                    title='Distribución por Estado de Patente Comercial',
-                    xaxis_title='Estado de Patente',
-                    yaxis_title='Cantidad de Propiedades',
-                    showlegend=False
+            patentes_count = {
+                valor or 'No Especificada': cantidad
+                for valor, cantidad in obtener_conteos_categoria('patente_comercial', filtros_avanzados).items()
+            }
+            
+            # Gráfico de barras para Patente Comercial
+            fig2 = go.Figure([
+                go.Bar(
+                    x=list(patentes_count.keys()),
+                    y=list(patentes_count.values()),
+                    marker_color=['#3498db', '#2ecc71', '#e74c3c']
                 )
-                st.plotly_chart(fig2, use_container_width=True)
-                
-                # Mostrar métricas para Patente Comercial
-                st.subheader("Resumen de Patentes")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric(
-                        label="PATENTE AL DIA",
-                        value=patentes_count.get('PATENTE AL DIA', 0),
-                        delta=f"{(patentes_count.get('PATENTE AL DIA', 0) / len(propiedades['datos']) * 100):.1f}% del total" if len(propiedades['datos']) > 0 else "0%"
-                    )
-                with col2:
-                    st.metric(
-                        label="PATENTE MOROSA",
-                        value=patentes_count.get('PATENTE MOROSA', 0),
-                        delta=f"{(patentes_count.get('PATENTE MOROSA', 0) / len(propiedades['datos']) * 100):.1f}% del total" if len(propiedades['datos']) > 0 else "0%"
-                    )
-                with col3:
+            ])
+            fig2.update_layout(
+                title='Distribución por Estado de Patente Comercial',
+                xaxis_title='Estado de Patente',
+                yaxis_title='Cantidad de Propiedades',
+                showlegend=False
+            )
+            st.plotly_chart(fig2, use_container_width=True)
+            
+            # Mostrar métricas para Patente Comercial
+            st.subheader("Resumen de Patentes")
+            for col, estado in zip(st.columns(3), ('PATENTE AL DIA', 'PATENTE MOROSA', 'SIN PATENTE')):
+                with col:
                     st.metric(
-                        label="SIN PATENTE",
-                        value=patentes_count.get('SIN PATENTE', 0),
-                        delta=f"{(patentes_count.get('SIN PATENTE', 0) / len(propiedades['datos']) * 100):.1f}% del total" if len(propiedades['datos']) > 0 else "0%"
+                        label=estado,
+                        value=patentes_count.get(estado, 0),
+                        delta=f"{(patentes_count.get(estado, 0) / total_filtradas * 100):.1f}% del total" if total_filtradas > 0 else "0%"
                     )
-                
-                # Análisis cruzado entre Fiscalización y Patente
-                st.markdown("---")
-                st.subheader("Relación entre Fiscalización y Patente Comercial")
-                if not propiedades['datos'].empty:
-                    cross_tab = {}
-                    for propiedad in propiedades['datos']:
-                        fiscalizacion_dom = propiedad['fiscalizacion_dom']
-                        patente_comercial = propiedad['patente_comercial']
-                        if fiscalizacion_dom in cross_tab:
-                            if patente_comercial in cross_tab[fiscalizacion_dom]:
-                                cross_tab[fiscalizacion_dom][patente_comercial] += 1
-                            else:
-                                cross_tab[fiscalizacion_dom][patente_comercial] = 1
-                        else:
-                            cross_tab[fiscalizacion_dom] = {patente_comercial: 1}
-                    
-                    st.write(cross_tab)
+    elif filtros_avanzados:
+        st.info("No hay propiedades que cumplan los filtros seleccionados.")
     else:
         st.info("No hay propiedades registradas.")
 
@@ -2192,108 +1935,192 @@ elif opcion == "Buscar Propiedades":
                 <span style='font-size: 2rem; margin-right: 0.75rem;'>🔍</span>
                 <div>
                     <h2 style='margin: 0;'>Buscar Propiedades</h2>
-                    <p class='subheader' style='margin: 0.25rem 0 0 0;'>Busque propiedades por RUT, Propietario, Dirección o ROL Propiedad</p>
+                    <p class='subheader' style='margin: 0.25rem 0 0 0;'>Busque propiedades por RUT, Propietario, Dirección, ROL Propiedad, Observaciones o Expediente DOM</p>
                 </div>
             </div>
         </div>
     """, unsafe_allow_html=True)
     
-    busqueda = st.text_input("Ingrese término de búsqueda (RUT, Propietario, Dirección, ROL Propiedad)")
+    def usar_sugerencia(texto):
+        st.session_state['termino_busqueda'] = texto
+
+    if st_searchbox is not None:
+        # Sugerencias mientras se escribe; el componente espera una pausa (debounce) antes de consultar
+        elegida = st_searchbox(
+            lambda texto: [(f"{s['tipo']}: {s['texto']}", s['texto']) for s in autocompletar(texto)],
+            label="Buscar mientras escribe",
+            placeholder="RUT, ROL, calle o propietario...",
+            key='autocompletar_busqueda',
+            debounce=250
+        )
+        if elegida and elegida != st.session_state.get('autocompletar_elegida'):
+            st.session_state['autocompletar_elegida'] = elegida
+            usar_sugerencia(elegida)
+
+    busqueda = st.text_input(
+        "Ingrese término de búsqueda (RUT, Propietario, Dirección, ROL Propiedad, Observaciones, Expediente DOM)",
+        key='termino_busqueda'
+    )
+
+    if busqueda and st_searchbox is None:
+        # Completar el término con un ROL, RUT, calle o propietario existente
+        opciones = [s for s in autocompletar(busqueda, 4) if s['texto'] != busqueda]
+        if opciones:
+            columnas_opciones = st.columns(len(opciones))
+            for j, (columna_opcion, opcion) in enumerate(zip(columnas_opciones, opciones)):
+                columna_opcion.button(
+                    f"{opcion['tipo']}: {opcion['texto']}",
+                    key=f"autocompletar_{j}",
+                    on_click=usar_sugerencia,
+                    args=(opcion['texto'],),
+                    use_container_width=True
+                )
     
     if busqueda:
-        # Crear un diccionario de filtros con el término de búsqueda para cada campo relevante
-        filtros = {
-            'RUT': busqueda,
-            'propietario': busqueda,
-            'direccion': busqueda,
-            'rol_propiedad': busqueda
-        }
+        # Resumen del propietario cuando se busca un RUT completo
+        if validar_rut(busqueda):
+            resumen = resumen_propietario(busqueda)
+            if resumen:
+                st.info(
+                    f"👤 **{resumen['propietario']}** (RUT {resumen['rut']}): "
+                    f"{resumen['propiedades']} propiedades, avalúo total "
+                    + f"${resumen['avaluo_total']:,.0f}".replace(",", ".")
+                )
+
+        # Resultados por páginas: se consulta solo la página nueva y se acumulan en la sesión
+        # hasta que cambia el término o los datos (otra sesión guardó o eliminó propiedades)
+        por_pagina = 10
+        generacion = generacion_datos()
+        resultados = st.session_state.get('resultados_busqueda')
+        if not resultados or resultados['termino'] != busqueda or resultados.get('generacion') != generacion:
+            resultados = {'termino': busqueda, 'generacion': generacion, **buscar_propiedades(busqueda, por_pagina)}
+            st.session_state['resultados_busqueda'] = resultados
+        propiedades = resultados['datos']
         
-        # Obtener propiedades que coincidan con cualquiera de los criterios
-        query = """
-            SELECT * FROM propiedades 
-            WHERE RUT LIKE ? 
-               OR propietario LIKE ? 
-               OR direccion LIKE ?
-               OR rol_propiedad LIKE ?
-            ORDER BY fecha_creacion DESC
-        """
+        # Mostrar resultados
+        if propiedades:
+            st.success(
+                f"✅ Mostrando {len(propiedades)} propiedades que coinciden con la búsqueda"
+                + (" (hay más)." if resultados['hay_mas'] else ".")
+            )
+            if resultados['limitada']:
+                st.warning(
+                    f"La búsqueda coincide con más de {RESULTADOS_MAXIMOS} propiedades; se muestran las más "
+                    "recientes sin ordenar por relevancia. Agregue palabras para acotarla."
+                )
         
-        conn = get_db_connection()
-        if conn is not None:
-            try:
-                cursor = conn.cursor()
-                
-                # Usar el mismo término de búsqueda para todos los campos con comodines
-                search_term = f"%{busqueda}%"
-                cursor.execute(query, (search_term, search_term, search_term, search_term))
+            # Mostrar las propiedades encontradas en un formato legible
+            for i, prop in enumerate(propiedades, 1):
+                with st.expander(f"Propiedad {i}: {prop.get('direccion', 'Sin dirección')}", expanded=(i==1)):
+                    col1, col2 = st.columns([1, 2])
                 
-                # Obtener los nombres de las columnas
-                columnas = [desc[0] for desc in cursor.description]
+                    with col1:
+                        # La imagen se lee y se envía solo si se pide (la del primer resultado, por defecto)
+                        if not prop.get('Miniatura'):
+                            st.info("No hay imágenes disponibles para esta propiedad.")
+                        elif st.toggle("📷 Mostrar foto", value=(i == 1), key=f"foto_busqueda_{prop['id']}"):
+                            st.image(
+                                prop['Miniatura'],
+                                caption=f"Propiedad {i}",
+                                use_container_width=True
+                            )
                 
-                # Crear lista de diccionarios con los resultados
-                propiedades = []
-                for fila in cursor.fetchall():
-                    propiedad = dict(zip(columnas, fila))
+                    with col2:
+                        # Fragmento con las coincidencias resaltadas
+                        if prop.get('fragmento'):
+                            st.markdown(f"🔎 {prop['fragmento']}")
+                        st.write(f"**RUT:** {prop.get('rut', 'No especificado')}")
+                        st.write(f"**Propietario:** {prop.get('propietario', 'No especificado')}")
+                        st.write(f"**Dirección:** {prop.get('direccion', 'No especificada')}")
+                        st.write(f"**ROL Propiedad:** {prop.get('rol_propiedad', 'No especificado')}")
+                        st.write(f"**Avalúo Total:** ${prop.get('avaluo_total', 0):,}".replace(",", "."))
                     
-                    # Obtener fotos para la propiedad
-                    cursor.execute(
-                        'SELECT ruta_archivo FROM fotos WHERE propiedad_id = ?',
-                        (propiedad['id'],)
+                        # Botón para ver más detalles
+                        if st.button(f"Ver detalles completos - Propiedad {i}"):
+                            # Aquí podrías redirigir a una vista detallada o mostrar más información
+                            st.session_state['propiedad_detalle'] = prop
+                            st.rerun()
+
+            if resultados['hay_mas']:
+                if st.button("⬇️ Cargar más resultados", use_container_width=True):
+                    pagina = buscar_propiedades(busqueda, por_pagina, len(propiedades))
+                    resultados['datos'] = propiedades + pagina['datos']
+                    resultados['hay_mas'] = pagina['hay_mas']
+                    st.rerun()
+        else:
+            st.info("No se encontraron propiedades que coincidan con la búsqueda.")
+
+            # Sugerencias por similitud para términos mal escritos
+            sugerencias = sugerir_propiedades(busqueda, 10)
+            coincidencias = list(dict.fromkeys(prop['coincidencia'] for prop in sugerencias))[:5]
+            if coincidencias:
+                st.markdown("**¿Quiso decir?**")
+                for j, coincidencia in enumerate(coincidencias):
+                    st.button(
+                        f"🔎 {coincidencia}",
+                        key=f"sugerencia_{j}",
+                        on_click=usar_sugerencia,
+                        args=(coincidencia,)
                     )
-                    fotos = [foto[0] for foto in cursor.fetchall()]
-                    propiedad['Fotos'] = fotos
-                    propiedad['Miniatura'] = fotos[0] if fotos else None
-                    
-                    propiedades.append(propiedad)
-                
-                # Mostrar resultados
-                if propiedades:
-                    st.success(f"✅ Se encontraron {len(propiedades)} propiedades que coinciden con la búsqueda.")
-                    
-                    # Mostrar las propiedades encontradas en un formato legible
-                    for i, prop in enumerate(propiedades, 1):
-                        with st.expander(f"Propiedad {i}: {prop.get('direccion', 'Sin dirección')}", expanded=(i==1)):
-                            col1, col2 = st.columns([1, 2])
-                            
-                            with col1:
-                                if prop.get('Miniatura'):
-                                    st.image(
-                                        prop['Miniatura'],
-                                        caption=f"Propiedad {i}",
-                                        use_container_width=True
-                                    )
-                                else:
-                                    st.info("No hay imágenes disponibles para esta propiedad.")
-                            
-                            with col2:
-                                st.write(f"**RUT:** {prop.get('RUT', 'No especificado')}")
-                                st.write(f"**Propietario:** {prop.get('propietario', 'No especificado')}")
-                                st.write(f"**Dirección:** {prop.get('direccion', 'No especificada')}")
-                                st.write(f"**ROL Propiedad:** {prop.get('rol_propiedad', 'No especificado')}")
-                                st.write(f"**Avalúo Total:** ${prop.get('avaluo_total', 0):,}".replace(",", "."))
-                                
-                                # Botón para ver más detalles
-                                if st.button(f"Ver detalles completos - Propiedad {i}"):
-                                    # Aquí podrías redirigir a una vista detallada o mostrar más información
-                                    st.session_state['propiedad_detalle'] = prop
-                                    st.rerun()
-                else:
-                    st.info("No se encontraron propiedades que coincidan con la búsqueda.")
-                
-            except Error as e:
-                st.error(f"Error al realizar la búsqueda: {e}")
-            finally:
-                conn.close()
+
+    # Búsqueda espacial: un área dibujada en el mapa o un radio alrededor de un punto.
+    # El mapa con Draw se arma solo con el interruptor activado (un expander
+    # cerrado igual lo construiría en cada recarga de la página)
+    if st.toggle("🗺️ Buscar en el mapa", key="buscar_en_mapa"):
+        st.caption("Dibuje un polígono, rectángulo o círculo, o marque un punto y elija el radio.")
+        mapa_busqueda = crear_mapa(zoom_start=15)
+        folium.plugins.Draw(
+            draw_options={'polyline': False, 'circlemarker': False},
+            edit_options={'edit': False}
+        ).add_to(mapa_busqueda)
+        dibujo = st_folium(
+            mapa_busqueda, width=700, height=400, key="mapa_busqueda",
+            returned_objects=['last_active_drawing']
+        )
+        forma = (dibujo or {}).get('last_active_drawing') or {}
+        geometria = forma.get('geometry') or {}
+
+        encontradas = None
+        if geometria.get('type') == 'Polygon':
+            # GeoJSON entrega los vértices como [lon, lat]
+            vertices = [(lat, lon) for lon, lat in geometria['coordinates'][0]]
+            encontradas = propiedades_en_poligono(vertices, RESULTADOS_MAXIMOS)
+        elif geometria.get('type') == 'Point':
+            lon, lat = geometria['coordinates']
+            radio = (forma.get('properties') or {}).get('radius')
+            if not radio:
+                radio = st.number_input("Radio (metros)", min_value=10, max_value=5000, value=200, step=50)
+            encontradas = propiedades_en_radio(lat, lon, radio, RESULTADOS_MAXIMOS)
+
+        if encontradas is None:
+            st.info("Aún no hay un área dibujada.")
+        elif encontradas:
+            st.success(f"✅ {len(encontradas)} propiedades en el área seleccionada.")
+            columnas_mapa = ['rut', 'propietario', 'direccion', 'rol_propiedad', 'avaluo_total']
+            if 'distancia_m' in encontradas[0]:
+                columnas_mapa.append('distancia_m')
+            st.dataframe(
+                pd.DataFrame(encontradas)[columnas_mapa],
+                column_config={'distancia_m': st.column_config.NumberColumn("Distancia (m)", format="%.0f")},
+                hide_index=True,
+                use_container_width=True
+            )
+        else:
+            st.info("No hay propiedades con coordenadas en el área seleccionada.")
 elif opcion == "Exportar Datos":
     st.markdown("""<h2>📊 Exportar Datos</h2>""", unsafe_allow_html=True)
     st.markdown("""<p style='color: #666; margin-bottom: 2rem;'>Exporte los datos del catastro en formato Excel</p>""", unsafe_allow_html=True)
     
-    propiedades = obtener_propiedades()
+    # Mismos filtros (avanzados y por columna) que la lista de propiedades
+    filtros_avanzados = st.session_state.get('filtros_avanzados', {})
+    if filtros_avanzados:
+        st.info("Se exportan solo las propiedades que cumplen los filtros de la lista de propiedades.")
+    # Todas las propiedades, leídas por columnas directo a un DataFrame con tipos
+    df = obtener_propiedades_df(filtros_avanzados, con_fotos=True)
     
-    if len(propiedades['datos']) > 0:
-        # Crear DataFrame con los datos
-        df = pd.DataFrame(propiedades['datos'])
+    if len(df) > 0:
+        # Excel no admite listas en una celda: las rutas de las fotos van separadas por comas
+        df['Fotos'] = df['Fotos'].str.join(', ')
         
         # Exportar a Excel usando BytesIO con openpyxl
         excel_buffer = io.BytesIO()
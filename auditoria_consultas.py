@@ -0,0 +1,165 @@
+"""
+Auditoría de planes de consulta de la base de datos del catastro.
+
+Crea una base SQLite sintética con el esquema de `init_db`, ejecuta las
+funciones de db_utils que usa la aplicación (listado, filtros, búsqueda,
+mapa, fotos, guardado) registrando cada sentencia que llega a SQLite, y
+muestra el `EXPLAIN QUERY PLAN` de cada una. Se marcan los recorridos
+completos de tabla (SCAN sin índice) y los árboles B temporales
+(USE TEMP B-TREE) para ORDER BY, GROUP BY o DISTINCT.
+
+Uso:
+    python auditoria_consultas.py [--filas 20000] [--todas] [--estricto]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+
+import db_utils
+
+CATEGORIAS = {
+    'fiscalizacion_dom': ['CONSTRUCCION REGULARIZADA', 'CONSTRUCCION IRREGULAR', 'SIN FISCALIZAR'],
+    'patente_comercial': ['SI', 'NO'],
+    'destino_dom': ['Habitacional', 'Comercial', 'Industrial'],
+    'destino_sii': ['Habitacional', 'Comercio', 'Oficina', 'Bodega'],
+}
+
+# Sentencias sin plan de consulta interesante ('--' son las internas de triggers y del R*Tree)
+IGNORADAS = ('--', 'PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'CREATE', 'DROP', 'ALTER', 'SELECT 1')
+
+# Lecturas completas a propósito: índices en memoria que se arman una vez por proceso
+LECTURAS_COMPLETAS = ('SELECT id, lat, lon FROM propiedades WHERE lat IS NOT NULL',)
+
+# "SCAN tabla" sin índice (no incluye subconsultas, tablas virtuales ni índices)
+RECORRIDO_COMPLETO = re.compile(r'^SCAN \w+( AS \w+)?$')
+
+# Literales de texto y números, para agrupar las sentencias por forma
+LITERALES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+
+def cargar_datos(filas):
+    """Llena la base con `filas` propiedades sintéticas y algunas fotos"""
+    random.seed(0)
+    db_utils.guardar_propiedades_lote(
+        {
+            'rut': f"{10000000 + i}-{i % 10}",
+            'rol_propiedad': f"{i // 100}-{i % 100}",
+            'propietario': f"Propietario {i}",
+            'direccion': f"Calle {i % 500} #{i}",
+            'avaluo_total': 1000000 + i,
+            'coordenadas': f"{-33.42 + random.random() * 0.04}, {-70.67 + random.random() * 0.04}",
+            **{columna: random.choice(valores) for columna, valores in CATEGORIAS.items()},
+        }
+        for i in range(filas)
+    )
+    for propiedad_id in range(1, min(filas, 200) + 1):
+        db_utils.guardar_fotos(propiedad_id, [f"uploads/{propiedad_id}_{n}.jpg" for n in range(2)])
+
+
+def carga_de_trabajo():
+    """Llamadas a db_utils equivalentes a las que hace la aplicación"""
+    pagina = db_utils.obtener_propiedades(1, 50)
+    yield 'Listado (página 1)', lambda: db_utils.obtener_propiedades(1, 50)
+    yield 'Listado (página 20)', lambda: db_utils.obtener_propiedades(20, 50)
+    yield 'Listado filtrado por texto', lambda: db_utils.obtener_propiedades(1, 50, {'propietario': 'Propietario 12'})
+    for columna, valores in CATEGORIAS.items():
+        yield (f'Listado filtrado por {columna}',
+               lambda columna=columna, valor=valores[0]: db_utils.obtener_propiedades(1, 50, {columna: [valor]}))
+    yield 'Listado con cursor', lambda: db_utils.obtener_propiedades_cursor(
+        db_utils.obtener_propiedades_cursor(None, 50)['siguiente_cursor'], 50)
+    yield 'Listado con cursor por categoría', lambda: db_utils.obtener_propiedades_cursor(
+        None, 50, {'fiscalizacion_dom': ['CONSTRUCCION IRREGULAR']})
+    yield 'Total de propiedades', db_utils.obtener_total_propiedades
+    for columna in CATEGORIAS:
+        yield f'Totales por {columna}', lambda columna=columna: db_utils.obtener_conteos_categoria(columna)
+    yield 'Búsqueda', lambda: db_utils.buscar_propiedades('Calle 12')
+    yield 'Autocompletado', lambda: db_utils.autocompletar('Calle 1')
+    for columna in db_utils.COLUMNAS_VALORES_DISTINTOS:
+        yield f'Valores de {columna}', lambda columna=columna: db_utils.valores_distintos(columna)
+    yield 'Mapa (rectángulo visible)', lambda: db_utils.propiedades_en_bbox(-33.41, -70.66, -33.40, -70.65)
+    yield 'Búsqueda por radio', lambda: db_utils.propiedades_en_radio(-33.40, -70.65, 300)
+    yield 'Búsqueda en polígono', lambda: db_utils.propiedades_en_poligono(
+        [(-33.41, -70.66), (-33.39, -70.66), (-33.40, -70.64)])
+    propiedad_id = pagina['datos'][0]['id']
+    yield 'Propiedades cercanas', lambda: db_utils.cercanas(propiedad_id)
+    yield 'Propiedades cercanas (tras un cambio)', lambda: (
+        db_utils.actualizar_celdas({propiedad_id: {'observaciones': 'Vecinas'}}), db_utils.cercanas(propiedad_id))
+    yield 'Fotos de una propiedad', lambda: db_utils.obtener_fotos(propiedad_id)
+    yield 'Guardar fotos', lambda: db_utils.guardar_fotos(propiedad_id, db_utils.obtener_fotos(propiedad_id))
+    yield 'Guardar propiedad', lambda: db_utils.guardar_propiedad(pagina['datos'][0])
+    yield 'Guardar lote', lambda: db_utils.guardar_propiedades_lote(pagina['datos'][:10])
+    yield 'Editar celdas', lambda: db_utils.actualizar_celdas({propiedad_id: {'observaciones': 'Auditoría'}})
+    yield 'Eliminar propiedad', lambda: db_utils.eliminar_propiedad_bd(pagina['datos'][-1]['id'])
+
+
+def problemas_del_plan(plan):
+    """Pasos del plan que recorren una tabla completa o crean un árbol B temporal"""
+    problemas = []
+    # Recorrer una subconsulta (CO-ROUTINE o MATERIALIZE) no es recorrer una tabla
+    subconsultas = {detalle.split()[-1] for _, _, _, detalle in plan
+                    if detalle.startswith(('CO-ROUTINE', 'MATERIALIZE'))}
+    for _, _, _, detalle in plan:
+        if detalle.startswith('USE TEMP B-TREE'):
+            problemas.append(detalle)
+        elif RECORRIDO_COMPLETO.match(detalle) and detalle.split()[-1] not in subconsultas:
+            problemas.append(detalle)
+    return problemas
+
+
+def auditar(filas, mostrar_todas):
+    """Ejecuta la carga de trabajo y devuelve la cantidad de consultas con problemas"""
+    db_utils.init_db()
+    cargar_datos(filas)
+
+    # Un solo hilo: el pool reutiliza siempre la misma conexión
+    backend = db_utils.backend_actual()
+    conn = backend.adquirir()
+    sentencias = []
+    conn.set_trace_callback(sentencias.append)
+    backend.liberar(conn)
+
+    vistas = set()
+    con_problemas = 0
+    for etiqueta, llamada in carga_de_trabajo():
+        del sentencias[:]
+        llamada()
+        for sentencia in sentencias:
+            texto = ' '.join(sentencia.split())
+            forma = LITERALES.sub('?', texto)
+            if texto.upper().startswith(IGNORADAS) or forma in vistas:
+                continue
+            vistas.add(forma)
+            plan = conn.execute('EXPLAIN QUERY PLAN ' + texto).fetchall()
+            problemas = [] if texto.startswith(LECTURAS_COMPLETAS) else problemas_del_plan(plan)
+            con_problemas += bool(problemas)
+            if problemas or mostrar_todas:
+                print(f"{'⚠️ ' if problemas else '✅'} [{etiqueta}] {forma[:160]}")
+                for _, _, _, detalle in plan:
+                    marca = '   <-- ' if detalle in problemas else ''
+                    print(f"      {detalle}{marca}")
+    conn.set_trace_callback(None)
+    print(f"\n{len(vistas)} consultas distintas, {con_problemas} con recorridos completos o árboles B temporales")
+    return con_problemas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=20000, help='Propiedades sintéticas')
+    parser.add_argument('--todas', action='store_true', help='Mostrar también las consultas sin problemas')
+    parser.add_argument('--estricto', action='store_true', help='Terminar con código 1 si hay problemas')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_utils.DB_PATH = os.path.join(directorio, 'auditoria.db')
+        con_problemas = auditar(args.filas, args.todas)
+        db_utils.backend_actual().cerrar()
+
+    if args.estricto and con_problemas:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
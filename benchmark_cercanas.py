@@ -0,0 +1,109 @@
+"""
+Benchmark del índice de propiedades cercanas (`IndiceCercanas`) con muchas filas.
+
+Mide lo que cuesta el árbol k-d en memoria a medida que la base cambia:
+
+- Carga inicial: leer todas las coordenadas y armar el árbol (primera
+  llamada a `cercanas` del proceso), con su pico de memoria.
+- Consulta sin cambios en la base.
+- Consulta después de una escritura: la generación cambia y el índice solo
+  trae las filas nuevas o editadas (no se rearma).
+- Rearmado en memoria, que ocurre cada MAXIMO_PENDIENTES cambios.
+
+Como referencia, incluye la consulta por radio con el R*Tree
+(`propiedades_en_radio`), que no mantiene nada en memoria.
+
+Uso:
+    python benchmark_cercanas.py [--filas 500000] [--consultas 200]
+"""
+import argparse
+import gc
+import os
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+import db_utils
+
+
+def milisegundos(llamada, repeticiones):
+    """Mediana en ms de `repeticiones` ejecuciones de `llamada()`"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        llamada()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return statistics.median(tiempos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=500000, help='Propiedades sintéticas')
+    parser.add_argument('--consultas', type=int, default=200, help='Consultas por medición')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directorio:
+        db_utils.DB_PATH = os.path.join(directorio, 'benchmark.db')
+        db_utils.init_db()
+        inicio = time.perf_counter()
+        db_utils.guardar_propiedades_lote(
+            {
+                'rut': f"{10000000 + i}-{i % 10}",
+                'rol_propiedad': f"{i // 100}-{i % 100}",
+                'propietario': f"Propietario {i}",
+                'direccion': f"Calle {i % 500} #{i}",
+                'avaluo_total': 1000000 + i,
+                'coordenadas': f"{-33.42 + random.random() * 0.04}, {-70.67 + random.random() * 0.04}",
+            }
+            for i in range(args.filas)
+        )
+        print(f"{args.filas} propiedades (carga de la base: {time.perf_counter() - inicio:.0f} s)\n")
+        ids = [random.randint(1, args.filas) for _ in range(args.consultas)]
+        siguiente = iter(ids * 1000).__next__
+
+        # Primera llamada del proceso; el pico se mide en una segunda carga, sin contar el tiempo
+        # (tracemalloc encarece cada asignación)
+        inicio = time.perf_counter()
+        db_utils.cercanas(1)
+        carga_inicial = (time.perf_counter() - inicio) * 1000
+        db_utils.indice_cercanas.clear()
+        gc.collect()
+        tracemalloc.start()
+        db_utils.cercanas(1)
+        _, pico = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        sin_cambios = milisegundos(lambda: db_utils.cercanas(siguiente()), args.consultas)
+
+        def editar_y_consultar():
+            propiedad_id = siguiente()
+            db_utils.actualizar_celdas({propiedad_id: {
+                'coordenadas': f"{-33.42 + random.random() * 0.04}, {-70.67 + random.random() * 0.04}"
+            }})
+            inicio = time.perf_counter()
+            db_utils.cercanas(propiedad_id)
+            return (time.perf_counter() - inicio) * 1000
+        # La escritura no se cuenta: solo la sincronización y la consulta que le siguen
+        tras_escritura = statistics.median(editar_y_consultar() for _ in range(min(args.consultas, 50)))
+
+        indice = db_utils.indice_cercanas(db_utils.DB_PATH)
+        rearmado = milisegundos(indice.armar, 3)
+
+        por_radio = milisegundos(
+            lambda: db_utils.propiedades_en_radio(-33.40, -70.65, 100, db_utils.RESULTADOS_MAXIMOS), args.consultas
+        )
+        db_utils.backend_actual().cerrar()
+
+    print(f"{'Operación':<48} {'Tiempo':>12}")
+    print(f"{'Carga inicial y armado del árbol':<48} {carga_inicial:9.0f} ms   (pico {pico / 2**20:.0f} MB)")
+    print(f"{'cercanas(k=10) sin cambios':<48} {sin_cambios:9.2f} ms")
+    print(f"{'cercanas(k=10) tras una escritura':<48} {tras_escritura:9.2f} ms")
+    print(f"{'Rearmado en memoria (cada ' + str(indice.MAXIMO_PENDIENTES) + ' cambios)':<48} {rearmado:9.0f} ms")
+    print(f"{'propiedades_en_radio(100 m) con el R*Tree':<48} {por_radio:9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark de concurrencia lectura/escritura de la base de datos del catastro.
+
+Simula varias sesiones de Streamlit (hilos del mismo proceso) que leen la lista
+de propiedades mientras otras guardan cambios, primero con el modo por defecto
+de SQLite (rollback journal) y luego con el perfil de rendimiento configurado
+(WAL + PRAGMA de `base_datos` en la configuración).
+
+Uso:
+    python benchmark_concurrencia.py [--lectores 8] [--escritores 2] [--segundos 5] [--filas 20000]
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from almacenamiento import PoolConexiones, perfil_rendimiento, obtener_config_bd
+
+PERFIL_POR_DEFECTO = {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000}
+
+
+def crear_base_sintetica(ruta, filas):
+    """Crea una base con el esquema de propiedades y `filas` registros sintéticos"""
+    conn = sqlite3.connect(ruta)
+    conn.execute('''
+    CREATE TABLE propiedades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        rut TEXT NOT NULL,
+        propietario TEXT NOT NULL,
+        direccion TEXT NOT NULL,
+        rol_propiedad TEXT NOT NULL,
+        avaluo_total REAL NOT NULL,
+        fiscalizacion_dom TEXT,
+        observaciones TEXT,
+        fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(rut, rol_propiedad)
+    )
+    ''')
+    conn.executemany(
+        'INSERT INTO propiedades (rut, propietario, direccion, rol_propiedad, avaluo_total, fiscalizacion_dom) '
+        'VALUES (?, ?, ?, ?, ?, ?)',
+        (
+            (f"{10000000 + i}-{i % 10}", f"Propietario {i}", f"Calle {i % 500} #{i}",
+             f"{i // 100}-{i % 100}", 1000000 + i, random.choice(['CONSTRUCCION REGULARIZADA', 'CONSTRUCCION IRREGULAR']))
+            for i in range(filas)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def ejecutar_escenario(ruta, perfil, lectores, escritores, segundos, filas):
+    """Ejecuta sesiones lectoras y escritoras en paralelo y devuelve las métricas"""
+    pool = PoolConexiones(ruta, tamano=lectores + escritores, pragmas=perfil)
+    # Aplicar el modo de journal antes de empezar a medir
+    with pool.conexion():
+        pass
+
+    fin = time.perf_counter() + segundos
+    latencias_lectura = []
+    latencias_escritura = []
+    errores = []
+    lock = threading.Lock()
+
+    def sesion_lectora():
+        propias = []
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            try:
+                with pool.conexion() as conn:
+                    conn.execute(
+                        'SELECT * FROM propiedades ORDER BY id DESC LIMIT 50 OFFSET ?',
+                        (random.randint(0, max(filas - 50, 0)),)
+                    ).fetchall()
+                    conn.execute('SELECT COUNT(*) FROM propiedades').fetchone()
+                propias.append(time.perf_counter() - inicio)
+            except sqlite3.Error as e:
+                with lock:
+                    errores.append(str(e))
+        with lock:
+            latencias_lectura.extend(propias)
+
+    def sesion_escritora():
+        propias = []
+        while time.perf_counter() < fin:
+            inicio = time.perf_counter()
+            try:
+                with pool.conexion() as conn:
+                    conn.execute(
+                        'UPDATE propiedades SET observaciones = ?, fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = ?',
+                        (f"editado {inicio}", random.randint(1, filas))
+                    )
+                    conn.commit()
+                propias.append(time.perf_counter() - inicio)
+            except sqlite3.Error as e:
+                with lock:
+                    errores.append(str(e))
+        with lock:
+            latencias_escritura.extend(propias)
+
+    hilos = [threading.Thread(target=sesion_lectora) for _ in range(lectores)]
+    hilos += [threading.Thread(target=sesion_escritora) for _ in range(escritores)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    pool.cerrar()
+
+    def p95(valores):
+        return statistics.quantiles(valores, n=20)[-1] * 1000 if len(valores) >= 20 else float('nan')
+
+    return {
+        'lecturas_por_s': len(latencias_lectura) / segundos,
+        'escrituras_por_s': len(latencias_escritura) / segundos,
+        'p95_lectura_ms': p95(latencias_lectura),
+        'p95_escritura_ms': p95(latencias_escritura),
+        'errores': len(errores),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lectores', type=int, default=8, help='Sesiones que leen la lista de propiedades')
+    parser.add_argument('--escritores', type=int, default=2, help='Sesiones que guardan cambios')
+    parser.add_argument('--segundos', type=float, default=5, help='Duración de cada escenario')
+    parser.add_argument('--filas', type=int, default=20000, help='Propiedades sintéticas')
+    args = parser.parse_args()
+
+    escenarios = [
+        ('Por defecto (rollback journal)', PERFIL_POR_DEFECTO),
+        ('Perfil configurado (WAL)', perfil_rendimiento(obtener_config_bd())),
+    ]
+
+    print(f"Sesiones: {args.lectores} lectoras + {args.escritores} escritoras, "
+          f"{args.segundos}s por escenario, {args.filas} propiedades\n")
+    for nombre, perfil in escenarios:
+        with tempfile.TemporaryDirectory() as directorio:
+            ruta = os.path.join(directorio, 'benchmark.db')
+            crear_base_sintetica(ruta, args.filas)
+            r = ejecutar_escenario(ruta, perfil, args.lectores, args.escritores, args.segundos, args.filas)
+        print(f"== {nombre} ==")
+        print(f"   PRAGMA: {perfil}")
+        print(f"   Lecturas/s:   {r['lecturas_por_s']:10.1f}   p95: {r['p95_lectura_ms']:8.2f} ms")
+        print(f"   Escrituras/s: {r['escrituras_por_s']:10.1f}   p95: {r['p95_escritura_ms']:8.2f} ms")
+        print(f"   Errores (database is locked): {r['errores']}\n")
+
+
+if __name__ == '__main__':
+    main()
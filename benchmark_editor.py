@@ -0,0 +1,68 @@
+"""
+Benchmark del guardado de la grilla de Ver/Editar Propiedades.
+
+Compara, sobre una grilla de N propiedades, el guardado anterior (una llamada a
+`guardar_propiedad` por cada fila, con su propia conexión y commit) contra el
+guardado por delta (`actualizar_celdas` con solo las celdas modificadas, en una
+transacción).
+
+Uso:
+    python benchmark_editor.py [--filas 5000] [--editadas 3]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import db_utils
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=5000, help='Propiedades en la grilla')
+    parser.add_argument('--editadas', type=int, default=3, help='Filas con una celda modificada')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directorio:
+        db_utils.DB_PATH = os.path.join(directorio, 'benchmark.db')
+        db_utils.init_db()
+        db_utils.guardar_propiedades_lote(
+            {'rut': f"{10000000 + i}-{i % 10}", 'rol_propiedad': f"{i // 100}-{i % 100}",
+             'propietario': f"Propietario {i}", 'direccion': f"Calle {i % 500} #{i}", 'avaluo_total': 1000000 + i}
+            for i in range(args.filas)
+        )
+        grilla = db_utils.obtener_propiedades(1, args.filas)['datos']
+        editadas = grilla[:args.editadas]
+
+        # Guardado anterior: cada fila de la grilla se reescribe completa
+        inicio = time.perf_counter()
+        for fila in grilla:
+            db_utils.guardar_propiedad({clave: fila[columna] for columna, clave, _ in db_utils.COLUMNAS_PROPIEDAD})
+        tiempo_anterior = time.perf_counter() - inicio
+
+        # Guardado por delta: solo las celdas modificadas, en una transacción
+        cambios = {fila['id']: {'observaciones': 'Revisado en terreno'} for fila in editadas}
+        inicio = time.perf_counter()
+        resumen = db_utils.actualizar_celdas(cambios)
+        tiempo_delta = time.perf_counter() - inicio
+
+        # Peor caso del delta: una celda modificada en todas las filas
+        cambios_todas = {fila['id']: {'observaciones': 'Revisión masiva'} for fila in grilla}
+        inicio = time.perf_counter()
+        resumen_todas = db_utils.actualizar_celdas(cambios_todas)
+        tiempo_todas = time.perf_counter() - inicio
+
+        db_utils.backend_actual().cerrar()
+
+    filas_resultado = [
+        ("Guardado anterior (fila por fila)", tiempo_anterior, f"{len(grilla)} commits"),
+        (f"Delta ({resumen['celdas']} celdas en {resumen['propiedades']} filas)", tiempo_delta, "1 commit"),
+        (f"Delta ({resumen_todas['celdas']} celdas en {resumen_todas['propiedades']} filas)", tiempo_todas, "1 commit"),
+    ]
+    print(f"Grilla de {args.filas} propiedades\n")
+    for etiqueta, tiempo, commits in filas_resultado:
+        print(f"{etiqueta:<40} {tiempo * 1000:10.1f} ms  ({commits})")
+
+
+if __name__ == '__main__':
+    main()
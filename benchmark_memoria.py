@@ -0,0 +1,94 @@
+"""
+Benchmark de memoria al cargar propiedades en un DataFrame.
+
+Compara la carga anterior (`obtener_propiedades` arma un diccionario por fila
+y luego `pd.DataFrame` los convierte) contra la lectura por columnas de
+`obtener_propiedades_df`, con tipos explícitos y categorías. Mide el pico de
+memoria durante la carga (tracemalloc) y lo que ocupa el DataFrame resultante.
+
+Uso:
+    python benchmark_memoria.py [--filas 100000]
+"""
+import argparse
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+import db_utils
+
+CATEGORIAS = {
+    'fiscalizacion_dom': ['CONSTRUCCION REGULARIZADA', 'CONSTRUCCION IRREGULAR', 'SIN FISCALIZAR'],
+    'patente_comercial': ['PATENTE AL DIA', 'PATENTE MOROSA', 'SIN PATENTE'],
+    'destino_dom': ['Habitacional', 'Comercial', 'Industrial'],
+    'destino_sii': ['Habitacional', 'Comercio', 'Oficina', 'Bodega'],
+}
+
+
+def medir(carga):
+    """
+    Ejecuta `carga` dos veces y devuelve (DataFrame, segundos, pico de memoria en bytes).
+
+    El tiempo se toma sin tracemalloc, que encarece cada asignación.
+    """
+    gc.collect()
+    inicio = time.perf_counter()
+    carga()
+    segundos = time.perf_counter() - inicio
+    gc.collect()
+    tracemalloc.start()
+    df = carga()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return df, segundos, pico
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--filas', type=int, default=100000, help='Propiedades sintéticas')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with tempfile.TemporaryDirectory() as directorio:
+        db_utils.DB_PATH = os.path.join(directorio, 'benchmark.db')
+        db_utils.init_db()
+        db_utils.guardar_propiedades_lote(
+            {
+                'rut': f"{10000000 + i}-{i % 10}",
+                'rol_propiedad': f"{i // 100}-{i % 100}",
+                'propietario': f"Propietario {i}",
+                'direccion': f"Calle {i % 500} #{i}",
+                'avaluo_total': 1000000 + i,
+                'coordenadas': f"{-33.42 + random.random() * 0.04}, {-70.67 + random.random() * 0.04}",
+                'ano_construccion': 1950 + i % 70,
+                **{columna: random.choice(valores) for columna, valores in CATEGORIAS.items()},
+            }
+            for i in range(args.filas)
+        )
+
+        anterior, tiempo_anterior, pico_anterior = medir(
+            lambda: pd.DataFrame(db_utils.obtener_propiedades(1, args.filas)['datos'])
+        )
+        columnar, tiempo_columnar, pico_columnar = medir(
+            lambda: db_utils.obtener_propiedades_df(con_fotos=True)
+        )
+        db_utils.backend_actual().cerrar()
+
+    print(f"{args.filas} propiedades\n")
+    print(f"{'Carga':<38} {'Tiempo':>10} {'Pico':>12} {'DataFrame':>12}")
+    for etiqueta, df, tiempo, pico in (
+        ("Diccionarios + pd.DataFrame", anterior, tiempo_anterior, pico_anterior),
+        ("Por columnas con tipos", columnar, tiempo_columnar, pico_columnar),
+    ):
+        ocupado = df.memory_usage(deep=True).sum()
+        print(f"{etiqueta:<38} {tiempo * 1000:8.0f} ms {pico / 2**20:9.1f} MB {ocupado / 2**20:9.1f} MB")
+    print(f"\nReducción: pico {1 - pico_columnar / pico_anterior:.0%}, DataFrame "
+          f"{1 - columnar.memory_usage(deep=True).sum() / anterior.memory_usage(deep=True).sum():.0%}")
+
+
+if __name__ == '__main__':
+    main()
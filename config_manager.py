@@ -16,6 +16,17 @@ DEFAULT_CONFIG = {
         "zoom_inicial": 14,
         "tipo_mapa": "OpenStreetMap",
         "mostrar_marcadores": True
+    },
+    "base_datos": {
+        "tamano_pool": 5,  # Conexiones SQLite reutilizables por proceso
+        "timeout_pool": 30,  # Segundos de espera por una conexión libre
+        # Perfil de rendimiento de SQLite (PRAGMA aplicados al iniciar)
+        "journal_mode": "WAL",  # WAL permite leer mientras otra sesión escribe
+        "synchronous": "NORMAL",
+        "cache_size": -20000,  # Negativo = KiB (aprox. 20 MB por conexión)
+        "mmap_size": 268435456,  # 256 MB
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000  # Milisegundos
     }
 }
 
@@ -1,3 +1,9 @@
+"""
+Respaldos de la base de datos por copia del archivo.
+
+Solo aplica al backend SQLite: con CATASTRO_DB_BACKEND=postgres la base vive
+en el servidor y se respalda con pg_dump.
+"""
 import os
 import shutil
 from datetime import datetime
@@ -15,6 +21,10 @@ def crear_backup_db(ruta_db, directorio_backup='backups'):
     Returns:
         str: Ruta al archivo de backup creado o None si hubo un error.
     """
+    if os.environ.get('CATASTRO_DB_BACKEND', 'sqlite').lower() != 'sqlite':
+        print("Los backups por copia de archivo solo aplican a SQLite; con PostgreSQL use pg_dump")
+        return None
+
     try:
         # Crear directorio de backups si no existe
         Path(directorio_backup).mkdir(parents=True, exist_ok=True)
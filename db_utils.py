@@ -1,82 +1,2640 @@
-import sqlite3
 import os
+import re
+import math
+import json
+import unicodedata
+import base64
+import threading
+import heapq
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
 from pathlib import Path
-from sqlite3 import Error
+import pandas as pd
 import streamlit as st
+from almacenamiento import crear_backend, ERRORES_BD
 
 # Configuración de la base de datos
-DB_DIR = Path.home() / '.catastro_propiedades'
+if 'DYNO' in os.environ:
+    # Configuración para producción en Heroku
+    DB_DIR = Path('/tmp/catastro_propiedades')
+else:
+    # Configuración para desarrollo local
+    DB_DIR = Path.home() / '.catastro_propiedades'
 DB_DIR.mkdir(exist_ok=True, parents=True)
 DB_PATH = str(DB_DIR / 'catastro_propiedades.db')
 
+# Backend de almacenamiento: 'sqlite' (archivo en DB_PATH) o 'postgres' (DATABASE_URL)
+BACKEND = os.environ.get('CATASTRO_DB_BACKEND', 'sqlite').lower()
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_backend(tipo, destino):
+    """Obtiene el backend del proceso (uno por tipo y destino), compartido por todas las sesiones"""
+    return crear_backend(tipo, destino)
+
+
+def backend_actual():
+    """Backend elegido con CATASTRO_DB_BACKEND ('sqlite' por defecto o 'postgres')"""
+    if BACKEND == 'sqlite':
+        return obtener_backend(BACKEND, DB_PATH)
+    return obtener_backend(BACKEND, DATABASE_URL)
+
+
+@contextmanager
 def get_db_connection():
-    """Crea una conexión a la base de datos SQLite"""
+    """
+    Presta una conexión del backend actual; entrega None si no se pudo conectar.
+
+    Los errores de configuración (p. ej. un PRAGMA no permitido en el perfil
+    de rendimiento, que `perfil_rendimiento` rechaza con ValueError) se
+    informan igual que los de conexión.
+    """
     conn = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        # Habilitar claves foráneas
-        conn.execute("PRAGMA foreign_keys = ON")
-        return conn
-    except Error as e:
+        backend = backend_actual()
+        conn = backend.adquirir()
+    except (*ERRORES_BD, RuntimeError, ValueError) as e:
         st.error(f"Error al conectar a la base de datos: {e}")
-        return None
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            backend.liberar(conn)
+
 
 def init_db():
     """Inicializa la base de datos con las tablas necesarias"""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Tabla de propiedades
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS propiedades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                rut TEXT NOT NULL,
-                propietario TEXT NOT NULL,
-                direccion TEXT NOT NULL,
-                rol_propiedad TEXT NOT NULL,
-                avaluo_total REAL NOT NULL,
-                destino_sii TEXT,
-                destino_dom TEXT,
-                patente_comercial TEXT,
-                num_contacto TEXT,
-                coordenadas TEXT,
-                fiscalizacion_dom TEXT,
-                m2_terreno REAL,
-                m2_construidos REAL,
-                linea_construccion TEXT,
-                ano_construccion INTEGER,
-                expediente_dom TEXT,
-                observaciones TEXT,
-                fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(rut, rol_propiedad)
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                backend = backend_actual()
+                cursor = conn.cursor()
+                # Todo el esquema en una transacción: una migración que falla no deja cambios a medias
+                backend.iniciar_escritura(cursor)
+
+                # Tabla de propiedades
+                cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS propiedades (
+                    id {backend.tipo_clave},
+                    rut TEXT NOT NULL,
+                    propietario TEXT NOT NULL,
+                    direccion TEXT NOT NULL,
+                    rol_propiedad TEXT NOT NULL,
+                    avaluo_total {backend.tipo_real} NOT NULL,
+                    destino_sii TEXT,
+                    destino_dom TEXT,
+                    patente_comercial TEXT,
+                    num_contacto TEXT,
+                    coordenadas TEXT,
+                    lat {backend.tipo_real},
+                    lon {backend.tipo_real},
+                    fiscalizacion_dom TEXT,
+                    m2_terreno {backend.tipo_real},
+                    m2_construidos {backend.tipo_real},
+                    linea_construccion TEXT,
+                    ano_construccion INTEGER,
+                    expediente_dom TEXT,
+                    observaciones TEXT,
+                    fecha_creacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    fecha_actualizacion TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE(rut, rol_propiedad)
+                )
+                ''')
+
+                # Tabla de fotos
+                cursor.execute(f'''
+                CREATE TABLE IF NOT EXISTS fotos (
+                    id {backend.tipo_clave},
+                    propiedad_id INTEGER,
+                    ruta_archivo TEXT NOT NULL,
+                    fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (propiedad_id) REFERENCES propiedades (id) ON DELETE CASCADE
+                )
+                ''')
+
+                # Crear índices para búsquedas frecuentes
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_rol ON propiedades(rol_propiedad)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_fotos_propiedad ON fotos(propiedad_id)')
+                # Índice compuesto para ordenar y paginar por (fecha_creacion, id) sin ordenar la tabla
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_fecha_id ON propiedades(fecha_creacion, id)')
+
+                # Contadores mantenidos por triggers (total y por categoría)
+                crear_contadores(cursor, backend)
+
+                # Columnas lat/lon numéricas e índice espacial
+                crear_indice_espacial(cursor, backend)
+
+                # Cambios de esquema versionados
+                aplicar_migraciones(cursor, backend)
+
+                conn.commit()
+                return True
+
+            except ERRORES_BD as e:
+                st.error(f"Error al inicializar la base de datos: {e}")
+                return False
+    return False
+
+
+# Columnas con totales por valor mantenidos en la tabla conteos_propiedades
+CATEGORIAS_CONTEO = ('fiscalizacion_dom', 'patente_comercial', 'destino_dom', 'destino_sii')
+
+
+def crear_contadores(cursor, backend):
+    """
+    Crea la tabla conteos_propiedades y los triggers que la mantienen al día.
+
+    Guarda el total de propiedades (categoria 'total') y el total por valor de
+    cada columna de CATEGORIAS_CONTEO, de modo que leer un total cuesta O(1)
+    en lugar de un COUNT(*) sobre la tabla. La primera vez se llena con los
+    datos existentes.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS conteos_propiedades (
+        categoria TEXT NOT NULL,
+        valor TEXT NOT NULL,
+        total INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (categoria, valor)
+    )
+    ''')
+
+    def sumar(signo, fila):
+        sentencias = [
+            "INSERT INTO conteos_propiedades (categoria, valor, total) VALUES ('total', '', {s}1) "
+            "ON CONFLICT(categoria, valor) DO UPDATE SET total = conteos_propiedades.total {s} 1;".format(s=signo)
+        ]
+        for columna in CATEGORIAS_CONTEO:
+            sentencias.append(
+                "INSERT INTO conteos_propiedades (categoria, valor, total) "
+                "VALUES ('{c}', COALESCE({f}.{c}, ''), {s}1) "
+                "ON CONFLICT(categoria, valor) DO UPDATE SET total = conteos_propiedades.total {s} 1;".format(
+                    c=columna, f=fila, s=signo
+                )
+            )
+        return '\n'.join(sentencias)
+
+    if backend.nombre == 'postgres':
+        # Una función de trigger para las tres operaciones; en UPDATE resta el valor anterior y suma el nuevo
+        cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION fn_conteos_propiedades() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('DELETE', 'UPDATE') THEN
+                {sumar('-', 'OLD')}
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {sumar('+', 'NEW')}
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_conteos_propiedades ON propiedades')
+        cursor.execute(f'''
+        CREATE TRIGGER trg_conteos_propiedades
+        AFTER INSERT OR DELETE OR UPDATE OF {', '.join(CATEGORIAS_CONTEO)} ON propiedades
+        FOR EACH ROW EXECUTE PROCEDURE fn_conteos_propiedades()
+        ''')
+    else:
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_conteos_insert AFTER INSERT ON propiedades
+        BEGIN
+            {sumar('+', 'NEW')}
+        END
+        ''')
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_conteos_delete AFTER DELETE ON propiedades
+        BEGIN
+            {sumar('-', 'OLD')}
+        END
+        ''')
+        # En una actualización de categorías se resta el valor anterior y se suma el nuevo
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_conteos_update AFTER UPDATE OF {', '.join(CATEGORIAS_CONTEO)} ON propiedades
+        BEGIN
+            {sumar('-', 'OLD')}
+            {sumar('+', 'NEW')}
+        END
+        ''')
+
+    # Llenar los contadores con los datos existentes la primera vez
+    cursor.execute("SELECT 1 FROM conteos_propiedades WHERE categoria = 'total'")
+    if cursor.fetchone() is None:
+        cursor.execute(
+            "INSERT INTO conteos_propiedades (categoria, valor, total) "
+            "SELECT 'total', '', COUNT(*) FROM propiedades"
+        )
+        for columna in CATEGORIAS_CONTEO:
+            cursor.execute(
+                f"INSERT INTO conteos_propiedades (categoria, valor, total) "
+                f"SELECT '{columna}', COALESCE({columna}, ''), COUNT(*) FROM propiedades "
+                f"GROUP BY COALESCE({columna}, '')"
             )
-            ''')
-            
-            # Tabla de fotos
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS fotos (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                propiedad_id INTEGER,
-                ruta_archivo TEXT NOT NULL,
-                fecha_subida TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (propiedad_id) REFERENCES propiedades (id) ON DELETE CASCADE
+
+
+def columnas_tabla(cursor, backend, tabla):
+    """Nombres de las columnas existentes de una tabla"""
+    if backend.nombre == 'postgres':
+        cursor.execute('SELECT column_name FROM information_schema.columns WHERE table_name = ?', (tabla,))
+    else:
+        cursor.execute(f'PRAGMA table_info({tabla})')
+        return {fila[1] for fila in cursor.fetchall()}
+    return {fila[0] for fila in cursor.fetchall()}
+
+
+def parsear_coordenadas(coord_str):
+    """Convierte el texto 'lat, lon' en una tupla de flotantes, o None si no es válido"""
+    try:
+        if not coord_str or not isinstance(coord_str, str):
+            return None
+
+        # Eliminar paréntesis y espacios si existen
+        coord_str = coord_str.strip('() ').replace(' ', '')
+
+        if ',' in coord_str:
+            lat, lon = coord_str.split(',', 1)
+            lat = float(lat)
+            lon = float(lon)
+            if -90 <= lat <= 90 and -180 <= lon <= 180:
+                return (lat, lon)
+        return None
+    except ValueError:
+        return None
+
+
+def crear_indice_espacial(cursor, backend):
+    """
+    Agrega las columnas lat/lon (calculadas desde el texto de `coordenadas`) y su índice.
+
+    En SQLite el índice es la tabla R*Tree `propiedades_rtree`, mantenida por
+    triggers sobre lat/lon. PostgreSQL no tiene R*Tree sin extensiones, así que
+    ahí se usa un índice B-tree sobre (lat, lon).
+    """
+    # Bases creadas antes de que existieran las columnas lat/lon
+    faltantes = [columna for columna in ('lat', 'lon') if columna not in columnas_tabla(cursor, backend, 'propiedades')]
+    for columna in faltantes:
+        cursor.execute(f'ALTER TABLE propiedades ADD COLUMN {columna} {backend.tipo_real}')
+
+    if backend.nombre == 'postgres':
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_lat_lon ON propiedades(lat, lon)')
+    else:
+        cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS propiedades_rtree USING rtree(
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_rtree_insert AFTER INSERT ON propiedades
+        WHEN NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL
+        BEGIN
+            INSERT INTO propiedades_rtree VALUES (NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_rtree_update AFTER UPDATE OF lat, lon ON propiedades
+        BEGIN
+            DELETE FROM propiedades_rtree WHERE id = OLD.id;
+            INSERT INTO propiedades_rtree
+            SELECT NEW.id, NEW.lat, NEW.lat, NEW.lon, NEW.lon
+            WHERE NEW.lat IS NOT NULL AND NEW.lon IS NOT NULL;
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_rtree_delete AFTER DELETE ON propiedades
+        BEGIN
+            DELETE FROM propiedades_rtree WHERE id = OLD.id;
+        END
+        ''')
+
+    # Llenar lat/lon desde el texto existente (los triggers cargan el R*Tree)
+    if faltantes:
+        cursor.execute("SELECT id, coordenadas FROM propiedades WHERE coordenadas IS NOT NULL AND coordenadas <> ''")
+        filas = []
+        for propiedad_id, coordenadas in cursor.fetchall():
+            coords = parsear_coordenadas(coordenadas)
+            if coords:
+                filas.append(coords + (propiedad_id,))
+        cursor.executemany('UPDATE propiedades SET lat = ?, lon = ? WHERE id = ?', filas)
+
+
+def migracion_indices_categorias(cursor, backend):
+    """Índices (categoría, fecha_creacion, id) para filtrar, agrupar y paginar por categoría"""
+    for columna in CATEGORIAS_CONTEO:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_propiedades_{columna}_fecha '
+            f'ON propiedades({columna}, fecha_creacion, id)'
+        )
+
+
+# Columnas de texto con una columna sombra normalizada (<columna>_norm)
+COLUMNAS_NORMALIZADAS = ('propietario', 'direccion')
+
+# Abreviaturas frecuentes en nombres y calles (ya sin tildes ni mayúsculas)
+ABREVIATURAS = {
+    'av': 'avenida', 'avda': 'avenida', 'avd': 'avenida',
+    'pje': 'pasaje', 'psje': 'pasaje',
+    'pob': 'poblacion', 'pbl': 'poblacion',
+    'vla': 'villa', 'pza': 'plaza', 'cam': 'camino',
+    'gral': 'general', 'pdte': 'presidente', 'cdte': 'comandante', 'cmdte': 'comandante',
+    'cnel': 'coronel', 'tte': 'teniente', 'cap': 'capitan', 'sgto': 'sargento',
+    'dr': 'doctor', 'prof': 'profesor', 'ing': 'ingeniero', 'mons': 'monsenor',
+    'sta': 'santa', 'sto': 'santo', 'fco': 'francisco',
+    'nro': 'numero', 'depto': 'departamento', 'dpto': 'departamento',
+}
+
+
+def normalizar_texto(texto):
+    """
+    Normaliza un nombre o dirección para compararlo: sin tildes, en minúsculas,
+    con las abreviaturas expandidas y un solo espacio entre palabras.
+
+    "Av. Independencia  #1234" y "AVENIDA INDEPENDENCIA 1234" quedan iguales.
+    """
+    return ' '.join(ABREVIATURAS.get(palabra, palabra) for palabra in palabras_texto(texto))
+
+
+def palabras_texto(texto):
+    """Palabras de un texto sin tildes y en minúsculas, separadas como en el índice de texto completo"""
+    if texto is None:
+        return []
+    texto = unicodedata.normalize('NFKD', str(texto))
+    texto = ''.join(caracter for caracter in texto if not unicodedata.combining(caracter)).lower()
+    return re.findall(r'\w+', texto)
+
+
+def normalizar_rut(rut):
+    """
+    RUT canónico: dígitos más verificador, sin puntos, guion, espacios ni ceros
+    a la izquierda ("12.345.678-k", "12345678-K" y "12345678K" dan "12345678K").
+
+    Debe coincidir con SQL_RUT_CANONICO, que aplica la misma regla en la base.
+    """
+    if rut is None:
+        return ''
+    return str(rut).upper().replace('.', '').replace('-', '').replace(' ', '').lstrip('0')
+
+
+# normalizar_rut como expresión SQL (SQLite y PostgreSQL), para llenar rut_norm en bloque
+SQL_RUT_CANONICO = "LTRIM(REPLACE(REPLACE(REPLACE(UPPER({columna}), '.', ''), '-', ''), ' ', ''), '0')"
+
+
+# Columnas indexadas para la búsqueda de texto, con su peso en el ranking bm25
+COLUMNAS_TEXTO = (
+    ('propietario_norm', 10.0),
+    ('direccion_norm', 5.0),
+    ('rol_propiedad', 8.0),
+    ('observaciones', 1.0),
+    ('expediente_dom', 2.0),
+)
+
+
+def documento_pg(columnas):
+    """tsvector de PostgreSQL con el texto de las columnas indicadas"""
+    return "to_tsvector('simple', " + " || ' ' || ".join(
+        f"COALESCE({columna}, '')" for columna, _ in columnas
+    ) + ")"
+
+
+def crear_tabla_fts(cursor, tabla, prefijo_trigger, columnas, opciones):
+    """
+    (Re)crea una tabla FTS5 de contenido externo sobre propiedades y los triggers
+    que la mantienen al día, e indexa las filas existentes.
+
+    Args:
+        tabla (str): Nombre de la tabla FTS5.
+        prefijo_trigger (str): Prefijo de los triggers (<prefijo>_insert, _delete, _update).
+        columnas (list): Columnas de propiedades a indexar.
+        opciones (str): Opciones adicionales de fts5 (tokenize, prefix, detail...).
+    """
+    for operacion in ('insert', 'delete', 'update'):
+        cursor.execute(f'DROP TRIGGER IF EXISTS {prefijo_trigger}_{operacion}')
+    cursor.execute(f'DROP TABLE IF EXISTS {tabla}')
+
+    lista = ', '.join(columnas)
+    nuevos = ', '.join(f'NEW.{columna}' for columna in columnas)
+    viejos = ', '.join(f'OLD.{columna}' for columna in columnas)
+    cursor.execute(f"""
+    CREATE VIRTUAL TABLE {tabla} USING fts5(
+        {lista},
+        content='propiedades', content_rowid='id',
+        {opciones}
+    )
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {prefijo_trigger}_insert AFTER INSERT ON propiedades
+    BEGIN
+        INSERT INTO {tabla} (rowid, {lista}) VALUES (NEW.id, {nuevos});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {prefijo_trigger}_delete AFTER DELETE ON propiedades
+    BEGIN
+        INSERT INTO {tabla} ({tabla}, rowid, {lista}) VALUES ('delete', OLD.id, {viejos});
+    END
+    """)
+    cursor.execute(f"""
+    CREATE TRIGGER {prefijo_trigger}_update AFTER UPDATE OF {lista} ON propiedades
+    BEGIN
+        INSERT INTO {tabla} ({tabla}, rowid, {lista}) VALUES ('delete', OLD.id, {viejos});
+        INSERT INTO {tabla} (rowid, {lista}) VALUES (NEW.id, {nuevos});
+    END
+    """)
+    # Indexar las propiedades existentes
+    cursor.execute(f"INSERT INTO {tabla} ({tabla}) VALUES ('rebuild')")
+
+
+def crear_indice_texto(cursor, backend, columnas):
+    """
+    (Re)crea el índice de texto completo de Buscar Propiedades sobre `columnas`.
+
+    En SQLite es la tabla FTS5 `propiedades_fts` (sin acentos ni mayúsculas),
+    con el ranking bm25 ponderado como 'rank'. En PostgreSQL es un índice GIN
+    sobre el tsvector de las mismas columnas.
+
+    Args:
+        columnas (tuple): Pares (columna, peso en el ranking).
+    """
+    if backend.nombre == 'postgres':
+        cursor.execute('DROP INDEX IF EXISTS idx_propiedades_fts')
+        cursor.execute(f'CREATE INDEX idx_propiedades_fts ON propiedades USING GIN ({documento_pg(columnas)})')
+        return
+
+    crear_tabla_fts(
+        cursor, 'propiedades_fts', 'trg_fts', [columna for columna, _ in columnas],
+        "tokenize='unicode61 remove_diacritics 2', prefix='2 3'"
+    )
+    # Ranking bm25 con los pesos de cada columna, usado por ORDER BY rank
+    pesos = ', '.join(str(peso) for _, peso in columnas)
+    cursor.execute("INSERT INTO propiedades_fts (propiedades_fts, rank) VALUES ('rank', ?)", (f'bm25({pesos})',))
+
+
+def migracion_busqueda_texto(cursor, backend):
+    """Índice de texto completo sobre las columnas de texto originales"""
+    crear_indice_texto(cursor, backend, (
+        ('propietario', 10.0),
+        ('direccion', 5.0),
+        ('rol_propiedad', 8.0),
+        ('observaciones', 1.0),
+        ('expediente_dom', 2.0),
+    ))
+
+
+def migracion_columnas_normalizadas(cursor, backend):
+    """
+    Columnas propietario_norm y direccion_norm (ver `normalizar_texto`), llenadas
+    desde los datos existentes e indexadas. El índice de texto completo pasa a
+    usarlas, para que las abreviaturas también coincidan en la búsqueda.
+    """
+    existentes = columnas_tabla(cursor, backend, 'propiedades')
+    for columna in COLUMNAS_NORMALIZADAS:
+        if f'{columna}_norm' not in existentes:
+            cursor.execute(f'ALTER TABLE propiedades ADD COLUMN {columna}_norm TEXT')
+
+    cursor.execute(f"SELECT id, {', '.join(COLUMNAS_NORMALIZADAS)} FROM propiedades")
+    filas = [
+        tuple(normalizar_texto(valor) for valor in fila[1:]) + (fila[0],)
+        for fila in cursor.fetchall()
+    ]
+    asignaciones = ', '.join(f'{columna}_norm = ?' for columna in COLUMNAS_NORMALIZADAS)
+    cursor.executemany(f'UPDATE propiedades SET {asignaciones} WHERE id = ?', filas)
+
+    for columna in COLUMNAS_NORMALIZADAS:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS idx_propiedades_{columna}_norm ON propiedades({columna}_norm)'
+        )
+    crear_indice_texto(cursor, backend, COLUMNAS_TEXTO)
+
+
+def migracion_generacion_y_trigramas(cursor, backend):
+    """
+    Generación de los datos y soporte de la búsqueda aproximada.
+
+    - La fila ('generacion', '') de conteos_propiedades aumenta con cada
+      escritura en propiedades; los cachés en memoria la usan como clave.
+    - SQLite: `propiedades_fts_vocab` expone el vocabulario del índice de texto
+      (palabras de cada columna), sobre el que `indice_vocabulario` arma el
+      índice de trigramas. PostgreSQL: índices GIN de pg_trgm sobre las
+      columnas normalizadas.
+    """
+    cursor.execute(
+        "INSERT INTO conteos_propiedades (categoria, valor, total) VALUES ('generacion', '', 0) "
+        "ON CONFLICT(categoria, valor) DO NOTHING"
+    )
+    incremento = "UPDATE conteos_propiedades SET total = total + 1 WHERE categoria = 'generacion';"
+    if backend.nombre == 'postgres':
+        cursor.execute(f'''
+        CREATE OR REPLACE FUNCTION fn_generacion_propiedades() RETURNS trigger AS $$
+        BEGIN
+            {incremento}
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS trg_generacion_propiedades ON propiedades')
+        # Un incremento por sentencia, no por fila
+        cursor.execute('''
+        CREATE TRIGGER trg_generacion_propiedades
+        AFTER INSERT OR DELETE OR UPDATE ON propiedades
+        FOR EACH STATEMENT EXECUTE PROCEDURE fn_generacion_propiedades()
+        ''')
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for columna in COLUMNAS_NORMALIZADAS:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS idx_propiedades_{columna}_norm_trgm '
+                f'ON propiedades USING GIN ({columna}_norm gin_trgm_ops)'
+            )
+        return
+
+    for operacion in ('INSERT', 'DELETE', 'UPDATE'):
+        cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_generacion_{operacion.lower()} AFTER {operacion} ON propiedades
+        BEGIN
+            {incremento}
+        END
+        ''')
+    cursor.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS propiedades_fts_vocab USING fts5vocab(propiedades_fts, 'col')"
+    )
+
+
+def migracion_rut_canonico(cursor, backend):
+    """
+    Columna rut_norm con el RUT canónico (ver `normalizar_rut`) y un índice
+    único (rut_norm, rol_propiedad), que usan las búsquedas por RUT, el guardado
+    y los resúmenes por propietario.
+
+    Se llena con una sola sentencia UPDATE (SQL_RUT_CANONICO). Si el catastro
+    ya tenía la misma propiedad con el RUT escrito de distintas formas, solo la
+    actualizada más recientemente conserva rut_norm; las demás quedan en NULL
+    (fuera del índice único) hasta que `migracion_rut_canonico_obligatorio`
+    las une a esa.
+    """
+    if 'rut_norm' not in columnas_tabla(cursor, backend, 'propiedades'):
+        cursor.execute('ALTER TABLE propiedades ADD COLUMN rut_norm TEXT')
+    cursor.execute(f"UPDATE propiedades SET rut_norm = {SQL_RUT_CANONICO.format(columna='rut')}")
+
+    cursor.execute('''
+    UPDATE propiedades SET rut_norm = NULL
+    WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (
+                PARTITION BY rut_norm, rol_propiedad ORDER BY fecha_actualizacion DESC, id DESC
+            ) AS orden
+            FROM propiedades
+        ) AS duplicadas
+        WHERE orden > 1
+    )
+    ''')
+
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_propiedades_rut_norm_rol ON propiedades(rut_norm, rol_propiedad)'
+    )
+    # Reemplazado por el índice anterior
+    cursor.execute('DROP INDEX IF EXISTS idx_propiedades_rut')
+
+
+def migracion_indices_filtros(cursor, backend):
+    """
+    Índices para los filtros de rango más usados de FILTROS_PROPIEDADES: avalúo
+    y fecha de actualización (la de creación ya tiene idx_propiedades_fecha_id).
+    """
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_avaluo ON propiedades(avaluo_total)')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_propiedades_fecha_actualizacion ON propiedades(fecha_actualizacion)'
+    )
+
+
+def migracion_version_filas(cursor, backend):
+    """
+    Columna `version` para el control de concurrencia optimista: cada
+    actualización la incrementa, y quien edita con la versión que leyó solo
+    escribe si nadie la cambió entretanto (ver `guardar_propiedad`).
+    """
+    if 'version' not in columnas_tabla(cursor, backend, 'propiedades'):
+        cursor.execute('ALTER TABLE propiedades ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+
+def reconstruir_tabla_sqlite(cursor, cambiar_definicion):
+    """
+    Reconstruye la tabla propiedades de SQLite con otra definición, que
+    SQLite no permite cambiar con ALTER TABLE (restricciones, NOT NULL).
+
+    Copia las filas a una tabla nueva creada con `cambiar_definicion(sql)`
+    aplicado al CREATE TABLE actual, la pone en lugar de la anterior y vuelve a
+    crear sus índices y triggers. Las fotos se respaldan antes, porque al
+    borrar la tabla anterior el ON DELETE CASCADE las eliminaría.
+    """
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'propiedades'")
+    definicion = cambiar_definicion(cursor.fetchone()[0])
+    cursor.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = 'propiedades' "
+        "AND type IN ('index', 'trigger') AND sql IS NOT NULL"
+    )
+    dependientes = [fila[0] for fila in cursor.fetchall()]
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'propiedades'")
+    secuencia = cursor.fetchone()
+    cursor.execute('PRAGMA table_info(propiedades)')
+    columnas = ', '.join(fila[1] for fila in cursor.fetchall())
+
+    cursor.execute(re.sub(r'^CREATE TABLE "?propiedades"?', 'CREATE TABLE propiedades_nueva', definicion))
+    cursor.execute(f'INSERT INTO propiedades_nueva ({columnas}) SELECT {columnas} FROM propiedades')
+    cursor.execute('CREATE TEMP TABLE fotos_respaldo AS SELECT * FROM fotos')
+    cursor.execute('DROP TABLE propiedades')
+    cursor.execute('ALTER TABLE propiedades_nueva RENAME TO propiedades')
+    cursor.execute('INSERT INTO fotos SELECT * FROM fotos_respaldo WHERE propiedad_id IN (SELECT id FROM propiedades)')
+    cursor.execute('DROP TABLE fotos_respaldo')
+    # AUTOINCREMENT no debe reutilizar los ids de propiedades eliminadas
+    if secuencia:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'propiedades'", secuencia)
+    for sql in dependientes:
+        cursor.execute(sql)
+
+
+def migracion_rut_canonico_obligatorio(cursor, backend):
+    """
+    rut_norm pasa a ser obligatorio y (rut_norm, rol_propiedad) la única clave.
+
+    - Las propiedades repetidas (mismo RUT canónico y ROL, que la migración 5
+      dejó sin rut_norm) se unen a la actualizada más recientemente: sus fotos
+      pasan a ella, sus datos se archivan en `propiedades_duplicadas` (con el
+      id de la que se conservó en `propiedad_conservada`) y se eliminan.
+    - Se elimina la restricción UNIQUE(rut, rol_propiedad) del esquema
+      original: un RUT con otro formato chocaba con ella en vez de actualizar
+      la propiedad por el ON CONFLICT de UPSERT_PROPIEDAD.
+    """
+    rut_canonico = SQL_RUT_CANONICO.format(columna='rut')
+    cursor.execute(f'''
+    CREATE TEMP TABLE propiedades_reemplazos AS
+    SELECT id, conservada FROM (
+        SELECT id, FIRST_VALUE(id) OVER (
+            PARTITION BY {rut_canonico}, rol_propiedad
+            ORDER BY rut_norm IS NULL, fecha_actualizacion DESC, id DESC
+        ) AS conservada
+        FROM propiedades
+    ) AS grupos
+    WHERE id <> conservada
+    ''')
+    cursor.execute('''
+    CREATE TABLE propiedades_duplicadas AS
+    SELECT p.*, r.conservada AS propiedad_conservada
+    FROM propiedades p JOIN propiedades_reemplazos r ON r.id = p.id
+    ''')
+    cursor.execute('''
+    UPDATE fotos SET propiedad_id = (
+        SELECT conservada FROM propiedades_reemplazos r WHERE r.id = fotos.propiedad_id
+    )
+    WHERE propiedad_id IN (SELECT id FROM propiedades_reemplazos)
+    ''')
+    cursor.execute('DELETE FROM propiedades WHERE id IN (SELECT id FROM propiedades_reemplazos)')
+    cursor.execute('DROP TABLE propiedades_reemplazos')
+    cursor.execute(f'UPDATE propiedades SET rut_norm = {rut_canonico} WHERE rut_norm IS NULL')
+
+    if backend.nombre == 'postgres':
+        cursor.execute('ALTER TABLE propiedades DROP CONSTRAINT IF EXISTS propiedades_rut_rol_propiedad_key')
+        cursor.execute('ALTER TABLE propiedades ALTER COLUMN rut_norm SET NOT NULL')
+        return
+
+    def cambiar_definicion(sql):
+        sql = re.sub(r',\s*UNIQUE\s*\(\s*rut\s*,\s*rol_propiedad\s*\)', '', sql)
+        return re.sub(r'\brut_norm TEXT\b(?! NOT NULL)', 'rut_norm TEXT NOT NULL', sql)
+    reconstruir_tabla_sqlite(cursor, cambiar_definicion)
+
+
+def migracion_version_obligatoria(cursor, backend):
+    """
+    `version` pasa a ser NOT NULL DEFAULT 1 también en las bases donde la
+    columna ya existía sin esa definición (la migración 7 no la cambiaba): una
+    fila con version NULL nunca coincidía al guardar con la versión leída y se
+    informaba como conflicto.
+    """
+    cursor.execute('UPDATE propiedades SET version = 1 WHERE version IS NULL')
+    if backend.nombre == 'postgres':
+        cursor.execute('ALTER TABLE propiedades ALTER COLUMN version SET DEFAULT 1')
+        cursor.execute('ALTER TABLE propiedades ALTER COLUMN version SET NOT NULL')
+        return
+
+    cursor.execute('PRAGMA table_info(propiedades)')
+    _, _, _, obligatoria, defecto, _ = next(fila for fila in cursor.fetchall() if fila[1] == 'version')
+    if not obligatoria or defecto != '1':
+        reconstruir_tabla_sqlite(cursor, lambda sql: re.sub(
+            r'\bversion\b[^,)]*', 'version INTEGER NOT NULL DEFAULT 1', sql, count=1
+        ))
+
+
+# Migraciones del esquema en orden: (versión, función que la aplica)
+MIGRACIONES = (
+    (1, migracion_indices_categorias),
+    (2, migracion_busqueda_texto),
+    (3, migracion_columnas_normalizadas),
+    (4, migracion_generacion_y_trigramas),
+    (5, migracion_rut_canonico),
+    (6, migracion_indices_filtros),
+    (7, migracion_version_filas),
+    (8, migracion_rut_canonico_obligatorio),
+    (9, migracion_version_obligatoria),
+)
+
+
+def aplicar_migraciones(cursor, backend):
+    """
+    Aplica las migraciones de MIGRACIONES posteriores a la versión de la base.
+
+    La versión se guarda con el backend (PRAGMA user_version en SQLite, tabla
+    version_esquema en PostgreSQL) dentro de la misma transacción de init_db.
+    """
+    version = backend.version_esquema(cursor)
+    for numero, migracion in MIGRACIONES:
+        if numero > version:
+            migracion(cursor, backend)
+            backend.fijar_version_esquema(cursor, numero)
+
+
+# Columnas editables de propiedades: (columna en la base, clave del formulario, valor por defecto)
+COLUMNAS_PROPIEDAD = (
+    ('rut', 'RUT', ''),
+    ('propietario', 'Propietario', ''),
+    ('direccion', 'Dirección', ''),
+    ('rol_propiedad', 'ROL Propiedad', ''),
+    ('avaluo_total', 'Avalúo Total', 0),
+    ('destino_sii', 'Destino SII', ''),
+    ('destino_dom', 'Destino DOM', ''),
+    ('patente_comercial', 'Patente Comercial', ''),
+    ('num_contacto', 'N° de contacto', ''),
+    ('coordenadas', 'Coordenadas', ''),
+    ('fiscalizacion_dom', 'Fiscalización DOM', ''),
+    ('m2_terreno', 'M2 Terreno', 0),
+    ('m2_construidos', 'M2 Construidos', 0),
+    ('linea_construccion', 'Línea de Construcción', ''),
+    ('ano_construccion', 'Año de Construcción', None),
+    ('expediente_dom', 'Expediente DOM', ''),
+    ('observaciones', 'Observaciones', ''),
+)
+
+
+# Columnas que se escriben al guardar: las editables más las derivadas de ellas
+# (lat/lon desde 'coordenadas', las columnas normalizadas y el RUT canónico)
+COLUMNAS_ESCRITURA = (
+    tuple(columna for columna, _, _ in COLUMNAS_PROPIEDAD)
+    + ('lat', 'lon')
+    + tuple(f'{columna}_norm' for columna in COLUMNAS_NORMALIZADAS)
+    + ('rut_norm',)
+)
+
+# Inserta una propiedad o, si ya existe la misma (RUT canónico y ROL), la actualiza
+UPSERT_PROPIEDAD = f'''
+INSERT INTO propiedades ({', '.join(COLUMNAS_ESCRITURA)})
+VALUES ({', '.join('?' for _ in COLUMNAS_ESCRITURA)})
+ON CONFLICT(rut_norm, rol_propiedad) DO UPDATE SET
+    {', '.join(f"{columna} = excluded.{columna}" for columna in COLUMNAS_ESCRITURA
+               if columna not in ('rut_norm', 'rol_propiedad'))},
+    version = propiedades.version + 1,
+    fecha_actualizacion = CURRENT_TIMESTAMP
+'''
+
+
+def columnas_derivadas(celdas):
+    """Valores de las columnas calculadas a partir de las celdas dadas ({columna: valor})"""
+    derivadas = {}
+    if 'coordenadas' in celdas:
+        derivadas['lat'], derivadas['lon'] = parsear_coordenadas(celdas['coordenadas']) or (None, None)
+    for columna in COLUMNAS_NORMALIZADAS:
+        if columna in celdas:
+            derivadas[f'{columna}_norm'] = normalizar_texto(celdas[columna])
+    if 'rut' in celdas:
+        derivadas['rut_norm'] = normalizar_rut(celdas['rut'])
+    return derivadas
+
+
+def valores_propiedad(propiedad):
+    """Ordena los valores de una propiedad según COLUMNAS_ESCRITURA (acepta claves del formulario o de la base)"""
+    valores = {}
+    for columna, clave, defecto in COLUMNAS_PROPIEDAD:
+        valor = propiedad.get(columna, propiedad.get(clave, defecto))
+        valores[columna] = defecto if valor is None else valor
+    valores.update(columnas_derivadas(valores))
+    return tuple(valores[columna] for columna in COLUMNAS_ESCRITURA)
+
+
+def datos_formulario(fila):
+    """
+    Datos de una propiedad leída de la base (p. ej. una fila de `obtener_propiedades`)
+    con las claves del formulario de COLUMNAS_PROPIEDAD, más su 'id' y la 'version'
+    leída, para editarla y guardarla con `guardar_propiedad`. Los nulos (None o
+    NaN de pandas) quedan como None.
+    """
+    datos = {
+        'id': None if fila.get('id') is None else int(fila['id']),
+        'version': None if fila.get('version') is None else int(fila['version']),
+    }
+    for columna, clave, _ in COLUMNAS_PROPIEDAD:
+        valor = fila.get(columna)
+        datos[clave] = None if valor is None or pd.isna(valor) else valor
+    return datos
+
+
+def guardar_propiedad(propiedad):
+    """
+    Guarda o actualiza una propiedad en la base de datos.
+
+    Con 'id' (modo edición) se actualiza esa fila; sin él, se inserta o se
+    actualiza la propiedad con el mismo RUT canónico y ROL (UPSERT_PROPIEDAD).
+    Si además trae la 'version' que se leyó, solo se escribe si la fila sigue
+    en esa versión; si otra sesión la cambió entretanto se avisa el conflicto
+    y no se guarda (ver `migracion_version_filas`).
+    """
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                valores = valores_propiedad(propiedad)
+
+                if propiedad.get('id') is not None:
+                    asignaciones = ', '.join(f"{columna} = ?" for columna in COLUMNAS_ESCRITURA)
+                    query = (
+                        f"UPDATE propiedades SET {asignaciones}, version = version + 1, "
+                        f"fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = ?"
+                    )
+                    params = valores + (propiedad['id'],)
+                    if propiedad.get('version') is not None:
+                        query += ' AND version = ?'
+                        params += (propiedad['version'],)
+                    cursor.execute(query + ' RETURNING id', params)
+                else:
+                    cursor.execute(UPSERT_PROPIEDAD + ' RETURNING id', valores)
+                fila = cursor.fetchone()
+                if fila is None:
+                    conn.rollback()
+                    cursor.execute('SELECT version FROM propiedades WHERE id = ?', (propiedad['id'],))
+                    actual = cursor.fetchone()
+                    if actual is None:
+                        st.warning(
+                            "⚠️ La propiedad fue eliminada mientras la editaba. No se guardaron sus cambios."
+                        )
+                    else:
+                        st.warning(
+                            f"⚠️ Otro usuario modificó esta propiedad mientras la editaba (versión {actual[0]}, "
+                            f"usted editaba la {propiedad['version']}). No se guardaron sus cambios: "
+                            "vuelva a abrirla desde la lista para ver los datos actuales."
+                        )
+                    return None
+                propiedad_id = fila[0]
+
+                conn.commit()
+                return propiedad_id
+
+            except ERRORES_BD as e:
+                st.error(f"Error al guardar la propiedad: {e}")
+                conn.rollback()
+                return None
+    return None
+
+
+def guardar_propiedades_lote(propiedades):
+    """
+    Inserta o actualiza muchas propiedades en una sola transacción.
+
+    Ejecuta UPSERT_PROPIEDAD (`ON CONFLICT(rut_norm, rol_propiedad) DO UPDATE`)
+    una vez por propiedad, consumiendo el iterable a medida que avanza (no se
+    cargan todas las filas en memoria). Cada sentencia devuelve la versión de
+    la fila: 1 si se insertó, mayor si actualizó una existente. Las
+    propiedades pueden venir con las claves del formulario ('RUT', 'ROL
+    Propiedad', ...) o con los nombres de columna ('rut', ...).
+
+    Args:
+        propiedades (iterable): Diccionarios con los datos de cada propiedad.
+
+    Returns:
+        dict: 'procesadas', 'insertadas' y 'actualizadas', o None si hubo un error.
+    """
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                backend_actual().iniciar_escritura(cursor)
+                procesadas = insertadas = 0
+                for propiedad in propiedades:
+                    cursor.execute(UPSERT_PROPIEDAD + ' RETURNING version', valores_propiedad(propiedad))
+                    insertadas += cursor.fetchone()[0] == 1
+                    procesadas += 1
+                conn.commit()
+                return {
+                    'procesadas': procesadas,
+                    'insertadas': insertadas,
+                    'actualizadas': procesadas - insertadas
+                }
+            except ERRORES_BD as e:
+                st.error(f"Error al guardar el lote de propiedades: {e}")
+                conn.rollback()
+                return None
+    return None
+
+
+def actualizar_celdas(cambios, versiones=None):
+    """
+    Guarda solo las celdas modificadas de varias propiedades en una transacción.
+
+    Args:
+        cambios (dict): {propiedad_id: {columna: nuevo_valor}}, por ejemplo a partir
+            del `edited_rows` de `st.data_editor`. Solo se escriben las columnas de
+            COLUMNAS_PROPIEDAD; el resto (id, fechas, fotos) se ignora. Las columnas
+            derivadas (lat/lon, textos normalizados) se recalculan junto con su origen.
+        versiones (dict, opcional): {propiedad_id: version leída}. Las propiedades
+            que otra sesión cambió desde entonces no se escriben y quedan en 'conflictos'.
+
+    Returns:
+        dict: 'propiedades' y 'celdas' actualizadas, 'ignoradas' (columnas no
+        editables recibidas), 'conflictos' (ids no guardados por cambio de
+        versión) y 'versiones' ({id: nueva versión} de las guardadas con versión),
+        o None si hubo un error.
+    """
+    editables = {columna for columna, _, _ in COLUMNAS_PROPIEDAD}
+    ignoradas = set()
+    # Celdas editadas por propiedad (sin contar las columnas derivadas)
+    editadas = {}
+    # Agrupar por conjunto de columnas para reutilizar cada UPDATE con executemany
+    por_columnas = {}
+    for propiedad_id, celdas in cambios.items():
+        validas = {columna: valor for columna, valor in celdas.items() if columna in editables}
+        ignoradas.update(set(celdas) - editables)
+        if validas:
+            editadas[propiedad_id] = len(validas)
+            validas.update(columnas_derivadas(validas))
+            columnas = tuple(sorted(validas))
+            por_columnas.setdefault(columnas, []).append(
+                tuple(validas[columna] for columna in columnas) + (propiedad_id,)
             )
-            ''')
-            
-            # Crear índices para búsquedas frecuentes
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_rut ON propiedades(rut)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_propiedades_rol ON propiedades(rol_propiedad)')
-            cursor.execute('CREATE INDEX IF NOT EXISTS idx_fotos_propiedad ON fotos(propiedad_id)')
-            
-            conn.commit()
-            return True
-            
-        except Error as e:
-            st.error(f"Error al inicializar la base de datos: {e}")
-            return False
-        finally:
-            conn.close()
+
+    resumen = {
+        'propiedades': len(editadas),
+        'celdas': sum(editadas.values()),
+        'ignoradas': sorted(ignoradas),
+        'conflictos': [],
+        'versiones': {}
+    }
+    if not por_columnas:
+        return resumen
+
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                for columnas, filas in por_columnas.items():
+                    asignaciones = ', '.join(f"{columna} = ?" for columna in columnas)
+                    query = (
+                        f"UPDATE propiedades SET {asignaciones}, version = version + 1, "
+                        f"fecha_actualizacion = CURRENT_TIMESTAMP WHERE id = ?"
+                    )
+                    if versiones is None:
+                        cursor.executemany(query, filas)
+                        continue
+                    # Con versiones, fila por fila para saber cuáles no coincidieron
+                    for fila in filas:
+                        propiedad_id = fila[-1]
+                        version = versiones.get(propiedad_id)
+                        if version is None:
+                            cursor.execute(query, fila)
+                            continue
+                        cursor.execute(query + ' AND version = ?', fila + (version,))
+                        if cursor.rowcount:
+                            resumen['versiones'][propiedad_id] = version + 1
+                        else:
+                            resumen['conflictos'].append(propiedad_id)
+                            resumen['propiedades'] -= 1
+                            resumen['celdas'] -= editadas[propiedad_id]
+                conn.commit()
+                resumen['conflictos'].sort()
+                return resumen
+            except ERRORES_BD as e:
+                st.error(f"Error al guardar los cambios: {e}")
+                conn.rollback()
+                return None
+    return None
+
+
+def guardar_fotos(propiedad_id, fotos):
+    """Guarda las rutas de las fotos en la base de datos"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                # Primero eliminamos las fotos existentes
+                cursor.execute('DELETE FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
+                # Luego insertamos las nuevas
+                for foto in fotos:
+                    cursor.execute(
+                        'INSERT INTO fotos (propiedad_id, ruta_archivo) VALUES (?, ?)',
+                        (propiedad_id, foto)
+                    )
+                conn.commit()
+                return True
+            except ERRORES_BD as e:
+                st.error(f"Error al guardar las fotos: {e}")
+                conn.rollback()
+                return False
     return False
+
+
+def obtener_fotos(propiedad_id):
+    """Obtiene las rutas de las fotos de una propiedad"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT ruta_archivo FROM fotos WHERE propiedad_id = ? ORDER BY id',
+                    (propiedad_id,)
+                )
+                return [foto[0] for foto in cursor.fetchall()]
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener las fotos: {e}")
+                return []
+    return []
+
+
+def eliminar_propiedad_bd(propiedad_id):
+    """
+    Elimina una propiedad y los registros de sus fotos.
+
+    Returns:
+        list: Rutas de las fotos que tenía la propiedad (para borrar los archivos),
+        o None si hubo un error.
+    """
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT ruta_archivo FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
+                fotos = [foto[0] for foto in cursor.fetchall()]
+                cursor.execute('DELETE FROM fotos WHERE propiedad_id = ?', (propiedad_id,))
+                cursor.execute('DELETE FROM propiedades WHERE id = ?', (propiedad_id,))
+                conn.commit()
+                return fotos
+            except ERRORES_BD as e:
+                st.error(f"❌ Error al eliminar la propiedad: {e}")
+                conn.rollback()
+                return None
+    return None
+
+
+def obtener_total_propiedades():
+    """Obtiene el número total de propiedades registradas (desde los contadores, O(1))"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT total FROM conteos_propiedades WHERE categoria = 'total'")
+                fila = cursor.fetchone()
+                return fila[0] if fila else 0
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener el total de propiedades: {e}")
+                return 0
+    return 0
+
+
+def obtener_conteos_categoria(categoria, filtros=None):
+    """
+    Obtiene el total de propiedades por cada valor de una categoría.
+
+    Sin filtros se leen los contadores; con filtros se agrupan en SQL las
+    propiedades que los cumplen (todas, no solo una página).
+
+    Args:
+        categoria (str): Una de las columnas de CATEGORIAS_CONTEO (p. ej. 'fiscalizacion_dom').
+        filtros (dict, opcional): Filtros por columna (ver FILTROS_PROPIEDADES).
+
+    Returns:
+        dict: {valor: total}; los valores vacíos o nulos se agrupan bajo ''.
+    """
+    if categoria not in CATEGORIAS_CONTEO:
+        raise ValueError(f"Categoría sin contador: {categoria}")
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                condiciones, params = compilar_filtros(filtros)
+                if condiciones:
+                    cursor.execute(
+                        f"SELECT COALESCE({categoria}, ''), COUNT(*) FROM propiedades "
+                        f"WHERE {' AND '.join(condiciones)} GROUP BY COALESCE({categoria}, '')",
+                        params
+                    )
+                    return dict(cursor.fetchall())
+                cursor.execute(
+                    'SELECT valor, total FROM conteos_propiedades WHERE categoria = ? AND total > 0',
+                    (categoria,)
+                )
+                return dict(cursor.fetchall())
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener los totales por {categoria}: {e}")
+                return {}
+    return {}
+
+
+def propiedades_duplicadas_archivadas():
+    """
+    Cantidad de propiedades repetidas (mismo RUT en otro formato y ROL) que
+    `migracion_rut_canonico_obligatorio` unió a otra y archivó en
+    propiedades_duplicadas.
+    """
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COUNT(*) FROM propiedades_duplicadas')
+                return cursor.fetchone()[0]
+            except ERRORES_BD as e:
+                st.error(f"Error al contar las propiedades duplicadas: {e}")
+                return 0
+    return 0
+
+
+def resumen_propietario(rut):
+    """
+    Resumen de las propiedades de un RUT (en cualquier formato), agregado
+    sobre el índice de rut_norm.
+
+    Returns:
+        dict: 'rut', 'propietario', 'propiedades' y 'avaluo_total', o None si
+        el RUT no tiene propiedades.
+    """
+    rut = normalizar_rut(rut)
+    if not rut:
+        return None
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT MAX(rut), MAX(propietario), COUNT(*), COALESCE(SUM(avaluo_total), 0) '
+                    'FROM propiedades WHERE rut_norm = ?',
+                    (rut,)
+                )
+                fila = cursor.fetchone()
+                if not fila or not fila[2]:
+                    return None
+                return {'rut': fila[0], 'propietario': fila[1], 'propiedades': fila[2], 'avaluo_total': fila[3]}
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener el resumen del propietario: {e}")
+                return None
+    return None
+
+
+# Filtros admitidos en obtener_propiedades, obtener_propiedades_cursor y
+# propiedades_en_bbox: {columna: tipo}. Solo estas columnas llegan al SQL.
+# - 'texto': subcadena (str) o valores exactos (lista)
+# - 'rango': (mínimo, máximo), cualquiera None para dejarlo abierto
+# - 'categoria': lista de valores exactos ('' también incluye los nulos)
+# - 'fecha': (desde, hasta) como date/datetime o texto ISO; una fecha `hasta` incluye todo ese día
+FILTROS_PROPIEDADES = {
+    'rut': 'texto',
+    'propietario': 'texto',
+    'direccion': 'texto',
+    'rol_propiedad': 'texto',
+    'avaluo_total': 'rango',
+    'm2_terreno': 'rango',
+    'm2_construidos': 'rango',
+    'ano_construccion': 'rango',
+    'destino_sii': 'categoria',
+    'destino_dom': 'categoria',
+    'fiscalizacion_dom': 'categoria',
+    'patente_comercial': 'categoria',
+    'fecha_creacion': 'fecha',
+    'fecha_actualizacion': 'fecha',
+}
+
+
+def filtro_vacio(valor):
+    """Un filtro sin valor (None, '' o una lista vacía) no restringe nada"""
+    return valor is None or valor == '' or (isinstance(valor, (list, tuple, set)) and not valor)
+
+
+def _limites(campo, valor):
+    """Valida un filtro de rango o fecha y devuelve (mínimo, máximo)"""
+    if not isinstance(valor, (list, tuple)) or len(valor) != 2:
+        raise ValueError(f"El filtro {campo} debe ser un par (desde, hasta)")
+    return valor
+
+
+def compilar_filtros(filtros, alias=''):
+    """
+    Traduce los filtros a condiciones WHERE parametrizadas.
+
+    Cada columna debe estar en FILTROS_PROPIEDADES y su valor tener la forma de
+    su tipo; si no, se lanza ValueError. Las condiciones son comparaciones
+    directas sobre la columna (IN, >=, <=, <) para que puedan usar sus índices.
+    Propietario y dirección se comparan normalizados (ver `normalizar_texto`)
+    y el RUT canónico (ver `normalizar_rut`).
+
+    Args:
+        filtros (dict): {columna: valor}; los valores vacíos o None se ignoran.
+        alias (str): Prefijo de las columnas en la consulta (p. ej. 'p.').
+
+    Returns:
+        tuple: (lista de condiciones, lista de parámetros).
+    """
+    condiciones = []
+    params = []
+    like = backend_actual().operador_like
+    for campo, valor in (filtros or {}).items():
+        tipo = FILTROS_PROPIEDADES.get(campo)
+        if tipo is None:
+            raise ValueError(f"Filtro no admitido: {campo}")
+        if filtro_vacio(valor):
+            continue
+        columna = f'{alias}{campo}'
+
+        if tipo == 'texto':
+            if campo in COLUMNAS_NORMALIZADAS or campo == 'rut':
+                # Comparar contra la columna normalizada (sin tildes, mayúsculas ni abreviaturas)
+                normalizar = normalizar_rut if campo == 'rut' else normalizar_texto
+                columna = f'{columna}_norm'
+                if isinstance(valor, (list, tuple, set)):
+                    valor = [normalizar(v) for v in valor]
+                else:
+                    valor = normalizar(valor)
+            if isinstance(valor, (list, tuple, set)):
+                valores = list(valor)
+                comparacion = f"IN ({', '.join('?' for _ in valores)})"
+            else:
+                valores = [f"%{valor}%"]
+                comparacion = f"{like} ?"
+            condiciones.append(f"{columna} {comparacion}")
+            params.extend(valores)
+
+        elif tipo == 'categoria':
+            valores = [valor] if isinstance(valor, str) else list(valor)
+            condicion = f"{columna} IN ({', '.join('?' for _ in valores)})"
+            if '' in valores:
+                condicion = f"({condicion} OR {columna} IS NULL)"
+            condiciones.append(condicion)
+            params.extend(valores)
+
+        elif tipo == 'rango':
+            minimo, maximo = _limites(campo, valor)
+            for limite, operador in ((minimo, '>='), (maximo, '<=')):
+                if limite is None:
+                    continue
+                if isinstance(limite, bool) or not isinstance(limite, (int, float)):
+                    raise ValueError(f"El filtro {campo} necesita números: {limite!r}")
+                condiciones.append(f"{columna} {operador} ?")
+                params.append(limite)
+
+        else:
+            desde, hasta = _limites(campo, valor)
+            if desde is not None:
+                condiciones.append(f"{columna} >= ?")
+                params.append(_texto_fecha(campo, desde))
+            if hasta is not None:
+                if isinstance(hasta, date) and not isinstance(hasta, datetime):
+                    # Una fecha sin hora incluye todo el día
+                    condiciones.append(f"{columna} < ?")
+                    params.append((hasta + timedelta(days=1)).isoformat())
+                else:
+                    condiciones.append(f"{columna} <= ?")
+                    params.append(_texto_fecha(campo, hasta))
+    return condiciones, params
+
+
+def _texto_fecha(campo, valor):
+    """Fecha de un filtro como texto ISO, comparable con los TIMESTAMP de la base"""
+    if isinstance(valor, datetime):
+        return valor.isoformat(sep=' ')
+    if isinstance(valor, date):
+        return valor.isoformat()
+    try:
+        return datetime.fromisoformat(str(valor)).isoformat(sep=' ')
+    except ValueError:
+        raise ValueError(f"El filtro {campo} necesita fechas ISO (AAAA-MM-DD): {valor!r}") from None
+
+
+def filas_como_dicts(descripcion, filas):
+    """Convierte filas en diccionarios {columna: valor}, sin las columnas normalizadas ni rut_norm (uso interno)"""
+    columnas = [desc[0] for desc in descripcion]
+    visibles = [(i, columna) for i, columna in enumerate(columnas) if not columna.endswith('_norm')]
+    return [{columna: fila[i] for i, columna in visibles} for fila in filas]
+
+
+def agregar_fotos(cursor, propiedades):
+    """
+    Agrega las listas 'Fotos' y 'Miniatura' a cada propiedad.
+
+    Las fotos de toda la página se leen en una sola consulta (los ids viajan
+    como un arreglo JSON), en lugar de una consulta por propiedad.
+    """
+    fotos_por_propiedad = {propiedad['id']: [] for propiedad in propiedades}
+    if fotos_por_propiedad:
+        cursor.execute(
+            'SELECT propiedad_id, ruta_archivo FROM fotos '
+            f'WHERE propiedad_id IN ({backend_actual().sql_lista_json}) '
+            'ORDER BY propiedad_id, id',
+            (json.dumps(list(fotos_por_propiedad)),)
+        )
+        for propiedad_id, ruta_archivo in cursor.fetchall():
+            fotos_por_propiedad[propiedad_id].append(ruta_archivo)
+
+    for propiedad in propiedades:
+        fotos = fotos_por_propiedad[propiedad['id']]
+        propiedad['Fotos'] = fotos
+        # Agregar miniatura (primera foto) si existe
+        propiedad['Miniatura'] = fotos[0] if fotos else None
+
+
+def total_filtrado(cursor, filtros, condiciones, params):
+    """
+    Cantidad de propiedades que cumplen los filtros ya compilados.
+
+    Sin filtros, o con un único filtro de una columna de CATEGORIAS_CONTEO, el
+    total se lee de los contadores mantenidos por triggers; en otro caso se
+    cuenta con una consulta aparte, para que la consulta de la página siga
+    ordenándose por el índice (un COUNT(*) OVER () en ella obliga a leer
+    todas las filas filtradas y ordenarlas).
+    """
+    activos = [campo for campo, valor in (filtros or {}).items() if not filtro_vacio(valor)]
+    if not condiciones or (len(activos) == 1 and activos[0] in CATEGORIAS_CONTEO):
+        if not condiciones:
+            cursor.execute("SELECT total FROM conteos_propiedades WHERE categoria = 'total'")
+        else:
+            valores = filtros[activos[0]]
+            valores = [valores] if isinstance(valores, str) else list(dict.fromkeys(valores))
+            cursor.execute(
+                f"SELECT COALESCE(SUM(total), 0) FROM conteos_propiedades "
+                f"WHERE categoria = ? AND valor IN ({', '.join('?' for _ in valores)})",
+                [activos[0]] + valores
+            )
+        fila = cursor.fetchone()
+        return fila[0] if fila else 0
+    cursor.execute('SELECT COUNT(*) FROM propiedades WHERE ' + ' AND '.join(condiciones), params)
+    return cursor.fetchone()[0]
+
+
+def obtener_propiedades(pagina=1, por_pagina=10, filtros=None):
+    """Obtiene propiedades paginadas con filtros opcionales (ver FILTROS_PROPIEDADES)"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+
+                # Construir consulta con filtros
+                condiciones, params = compilar_filtros(filtros)
+                query = 'SELECT * FROM propiedades'
+                if condiciones:
+                    query += ' WHERE ' + ' AND '.join(condiciones)
+                total = total_filtrado(cursor, filtros, condiciones, params)
+
+                # Aplicar paginación (id desempata registros creados en el mismo segundo)
+                offset = (pagina - 1) * por_pagina
+                query += ' ORDER BY fecha_creacion DESC, id DESC LIMIT ? OFFSET ?'
+                lector = backend_actual().cursor_lectura(conn)
+                lector.execute(query, params + [por_pagina, offset])
+                # En PostgreSQL el cursor con nombre solo tiene description después de leer
+                filas = lector.fetchall()
+                propiedades = filas_como_dicts(lector.description, filas)
+                lector.close()
+
+                # Obtener fotos para cada propiedad
+                agregar_fotos(cursor, propiedades)
+
+                return {
+                    'datos': propiedades,
+                    'total': total,
+                    'pagina': pagina,
+                    'por_pagina': por_pagina,
+                    'total_paginas': (total + por_pagina - 1) // por_pagina
+                }
+
+            except (*ERRORES_BD, ValueError) as e:
+                st.error(f"Error al obtener propiedades: {e}")
+                return {'datos': [], 'total': 0, 'pagina': 1, 'por_pagina': por_pagina, 'total_paginas': 0}
+    return {'datos': [], 'total': 0, 'pagina': 1, 'por_pagina': por_pagina, 'total_paginas': 0}
+
+
+# Tipos de las columnas en `obtener_propiedades_df`; las demás quedan como texto
+TIPOS_DATAFRAME = {
+    'id': 'int64',
+    'avaluo_total': 'float64',
+    'lat': 'float64',
+    'lon': 'float64',
+    'm2_terreno': 'float64',
+    'm2_construidos': 'float64',
+    'ano_construccion': 'Int64',
+    'version': 'int64',
+    'destino_sii': 'category',
+    'destino_dom': 'category',
+    'fiscalizacion_dom': 'category',
+    'patente_comercial': 'category',
+    'fecha_creacion': 'datetime64[ns]',
+    'fecha_actualizacion': 'datetime64[ns]',
+}
+
+# Filas por lote al leer un DataFrame desde el cursor
+LOTE_DATAFRAME = 5000
+
+
+def columna_dataframe(columna, valores):
+    """Convierte los valores leídos de una columna al tipo de TIPOS_DATAFRAME"""
+    tipo = TIPOS_DATAFRAME.get(columna)
+    if tipo == 'category':
+        return pd.Categorical(valores)
+    if tipo and tipo.startswith('datetime'):
+        return pd.to_datetime(pd.Series(valores, dtype='object'), format='ISO8601', errors='coerce').astype(tipo)
+    if tipo:
+        # SQLite no impone tipos: un texto en una columna numérica queda como nulo
+        return pd.to_numeric(pd.Series(valores, dtype='object'), errors='coerce').astype(tipo)
+    return valores
+
+
+def obtener_propiedades_df(filtros=None, columnas=None, con_fotos=False):
+    """
+    Todas las propiedades que cumplen los filtros, como DataFrame con tipos.
+
+    Las filas se leen del cursor por lotes y se acumulan por columna (sin
+    armar un diccionario por fila), y cada columna se convierte una sola vez
+    a su tipo de TIPOS_DATAFRAME; destino, fiscalización y patente quedan
+    como categorías. Pensado para exportar y para estadísticas; la tabla
+    paginada sigue usando `obtener_propiedades`.
+
+    Args:
+        filtros (dict, opcional): Filtros por columna (ver FILTROS_PROPIEDADES).
+        columnas (list, opcional): Columnas a leer (por defecto, todas menos las normalizadas).
+        con_fotos (bool): Agregar 'Fotos' y 'Miniatura' como en `agregar_fotos`.
+
+    Returns:
+        pandas.DataFrame: Ordenado como la lista de propiedades (más recientes primero).
+    """
+    vacio = pd.DataFrame(columns=list(columnas) if columnas else None)
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                condiciones, params = compilar_filtros(filtros)
+                desconocidas = set(columnas or ()) - {columna for columna, _, _ in COLUMNAS_PROPIEDAD} - set(TIPOS_DATAFRAME)
+                if desconocidas:
+                    raise ValueError(f"Columnas no admitidas: {', '.join(sorted(desconocidas))}")
+                seleccion = 'id, ' + ', '.join(c for c in columnas if c != 'id') if columnas else '*'
+                query = f'SELECT {seleccion} FROM propiedades'
+                if condiciones:
+                    query += ' WHERE ' + ' AND '.join(condiciones)
+                query += ' ORDER BY fecha_creacion DESC, id DESC'
+
+                lector = backend_actual().cursor_lectura(conn)
+                lector.execute(query, params)
+                datos = None
+                while True:
+                    filas = lector.fetchmany(LOTE_DATAFRAME)
+                    if datos is None:
+                        # En PostgreSQL el cursor con nombre solo tiene description después de leer
+                        visibles = [(i, desc[0]) for i, desc in enumerate(lector.description)
+                                    if not desc[0].endswith('_norm')]
+                        datos = {columna: [] for _, columna in visibles}
+                    if not filas:
+                        break
+                    por_columna = list(zip(*filas))
+                    for i, columna in visibles:
+                        datos[columna].extend(por_columna[i])
+                lector.close()
+
+                df = pd.DataFrame({columna: columna_dataframe(columna, valores)
+                                   for columna, valores in datos.items()})
+                if con_fotos:
+                    fotos_por_propiedad = {}
+                    if len(df):
+                        cursor = conn.cursor()
+                        cursor.execute(
+                            'SELECT propiedad_id, ruta_archivo FROM fotos '
+                            f'WHERE propiedad_id IN ({backend_actual().sql_lista_json}) '
+                            'ORDER BY propiedad_id, id',
+                            (json.dumps(df['id'].tolist()),)
+                        )
+                        for propiedad_id, ruta_archivo in cursor.fetchall():
+                            fotos_por_propiedad.setdefault(propiedad_id, []).append(ruta_archivo)
+                    df['Fotos'] = [fotos_por_propiedad.get(propiedad_id, []) for propiedad_id in df['id']]
+                    df['Miniatura'] = [fotos[0] if fotos else None for fotos in df['Fotos']]
+                if columnas and 'id' not in columnas:
+                    df = df.drop(columns='id')
+                return df
+            except (*ERRORES_BD, ValueError) as e:
+                st.error(f"Error al obtener propiedades: {e}")
+                return vacio
+    return vacio
+
+
+def codificar_cursor(fecha_creacion, propiedad_id):
+    """Genera un cursor opaco a partir de la clave (fecha_creacion, id) de la última fila"""
+    clave = json.dumps([str(fecha_creacion), propiedad_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(clave.encode('utf-8')).decode('ascii')
+
+
+def decodificar_cursor(token):
+    """Recupera la clave (fecha_creacion, id) de un cursor; ValueError si no es válido"""
+    try:
+        fecha_creacion, propiedad_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError) as e:
+        raise ValueError(f"Cursor de paginación inválido: {token}") from e
+    if not isinstance(propiedad_id, int):
+        raise ValueError(f"Cursor de paginación inválido: {token}")
+    return fecha_creacion, propiedad_id
+
+
+def obtener_propiedades_cursor(despues_de=None, por_pagina=10, filtros=None):
+    """
+    Obtiene una página de propiedades con paginación por clave (keyset).
+
+    A diferencia de `obtener_propiedades`, no usa OFFSET: cada página continúa
+    desde la clave (fecha_creacion, id) de la anterior usando el índice
+    idx_propiedades_fecha_id, por lo que la página N cuesta lo mismo que la primera.
+
+    Args:
+        despues_de (str): Cursor devuelto en 'siguiente_cursor' de la página anterior;
+            None para la primera página.
+        por_pagina (int): Cantidad de propiedades por página.
+        filtros (dict): Filtros por columna (ver FILTROS_PROPIEDADES).
+
+    Returns:
+        dict: 'datos', 'por_pagina', 'siguiente_cursor' (None si no hay más) y 'hay_mas'.
+    """
+    vacio = {'datos': [], 'por_pagina': por_pagina, 'siguiente_cursor': None, 'hay_mas': False}
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+
+                condiciones, params = compilar_filtros(filtros)
+                if despues_de:
+                    condiciones.append('(fecha_creacion, id) < (?, ?)')
+                    params.extend(decodificar_cursor(despues_de))
+
+                query = 'SELECT * FROM propiedades'
+                if condiciones:
+                    query += ' WHERE ' + ' AND '.join(condiciones)
+                # Se pide una fila extra para saber si existe otra página
+                query += ' ORDER BY fecha_creacion DESC, id DESC LIMIT ?'
+                params.append(por_pagina + 1)
+
+                lector = backend_actual().cursor_lectura(conn)
+                lector.execute(query, params)
+                filas = lector.fetchall()
+                hay_mas = len(filas) > por_pagina
+                propiedades = filas_como_dicts(lector.description, filas[:por_pagina])
+                lector.close()
+
+                agregar_fotos(cursor, propiedades)
+
+                siguiente = None
+                if hay_mas and propiedades:
+                    ultima = propiedades[-1]
+                    siguiente = codificar_cursor(ultima['fecha_creacion'], ultima['id'])
+
+                return {
+                    'datos': propiedades,
+                    'por_pagina': por_pagina,
+                    'siguiente_cursor': siguiente,
+                    'hay_mas': hay_mas
+                }
+
+            except (*ERRORES_BD, ValueError) as e:
+                st.error(f"Error al obtener propiedades: {e}")
+                return vacio
+    return vacio
+
+
+def consulta_texto(termino, backend):
+    """
+    Traduce el término ingresado a una consulta de texto completo.
+
+    El término se normaliza como las columnas indexadas (ver `normalizar_texto`).
+    Todas las palabras deben aparecer; la última se busca como prefijo porque
+    puede estar a medio escribir ("av indep" encuentra "Avenida Independencia").
+    Devuelve None si no hay palabras.
+    """
+    palabras = normalizar_texto(termino).split()
+    if not palabras:
+        return None
+    if backend.nombre == 'postgres':
+        return ' & '.join(palabras[:-1] + [f"{palabras[-1]}:*"])
+    return ' '.join([f'"{palabra}"' for palabra in palabras[:-1]] + [f'"{palabras[-1]}"*'])
+
+
+# Máximo de resultados que recorre una búsqueda (todas sus páginas)
+RESULTADOS_MAXIMOS = 500
+
+
+class CacheBusquedas:
+    """
+    Candidatos de las búsquedas recientes (LRU compartido por las sesiones).
+
+    Cada entrada guarda, para un término normalizado, los ids que coinciden en
+    el orden de los resultados junto con el RUT canónico y las palabras
+    indexadas de cada uno, lo que permite refinar la búsqueda sin volver a la
+    base. El caché se vacía cuando cambia la generación de los datos (cualquier
+    escritura en propiedades).
+    """
+
+    def __init__(self, maximo=256):
+        self.maximo = maximo
+        self.generacion = None
+        self.entradas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def obtener(self, generacion, clave):
+        """
+        Candidatos de `clave` ((rut, texto) normalizados) y si son exactos.
+
+        Si el término no está pero extiende uno completo del caché ("inde" tras
+        "ind"), devuelve los candidatos más acotados entre los que lo contienen
+        con exacta=False, para filtrarlos con `refinar_candidatos`.
+        """
+        with self.lock:
+            if generacion != self.generacion:
+                self.generacion = generacion
+                self.entradas.clear()
+            if clave in self.entradas:
+                self.entradas.move_to_end(clave)
+                return self.entradas[clave], True
+            base = None
+            for (rut, texto), candidatos in self.entradas.items():
+                if (candidatos['completa'] and clave[0].startswith(rut) and clave[1].startswith(texto)
+                        and (base is None or len(candidatos['filas']) < len(base['filas']))):
+                    base = candidatos
+            return base, False
+
+    def guardar(self, generacion, clave, candidatos):
+        with self.lock:
+            if generacion != self.generacion:
+                return
+            self.entradas[clave] = candidatos
+            self.entradas.move_to_end(clave)
+            while len(self.entradas) > self.maximo:
+                self.entradas.popitem(last=False)
+
+
+@st.cache_resource(show_spinner=False)
+def cache_busquedas(destino):
+    """Caché de búsquedas del proceso para una base de datos"""
+    return CacheBusquedas()
+
+
+def coincide_texto(palabras_fila, palabras):
+    """Mismo criterio que `consulta_texto`: todas las palabras, la última como prefijo"""
+    return (all(palabra in palabras_fila for palabra in palabras[:-1])
+            and any(indexada.startswith(palabras[-1]) for indexada in palabras_fila))
+
+
+def buscar_candidatos(cursor, backend, termino):
+    """
+    Ids de todas las coincidencias de un término (hasta RESULTADOS_MAXIMOS), en orden.
+
+    Los RUT que comienzan con el término van primero; luego las coincidencias
+    de texto completo por relevancia. Si el texto coincide con más propiedades
+    que el máximo (p. ej. "a"), no se ordena por relevancia, que obligaría a
+    puntuar todas las coincidencias, sino por id descendente (las más
+    recientes primero) y los candidatos quedan incompletos.
+
+    Returns:
+        dict: 'filas' [(id, rut_norm, palabras indexadas, coincide por RUT,
+        relevancia)] y 'completa' (están todas las coincidencias).
+    """
+    columnas = ', '.join(f'p.{columna}' for columna, _ in COLUMNAS_TEXTO)
+    filas = []
+    completa = True
+
+    def agregar(resultado, por_rut):
+        for fila in resultado:
+            palabras = frozenset(palabra for valor in fila[3:] for palabra in palabras_texto(valor))
+            filas.append((fila[0], fila[1], palabras, por_rut, fila[2]))
+
+    rut = normalizar_rut(termino)
+    if rut:
+        cursor.execute(
+            f'SELECT p.id, p.rut_norm, NULL, {columnas} FROM propiedades p '
+            f'WHERE rut_norm >= ? AND rut_norm < ? ORDER BY rut_norm LIMIT ?',
+            (rut, rut + '\uffff', RESULTADOS_MAXIMOS + 1)
+        )
+        agregar(cursor.fetchall(), True)
+        if len(filas) > RESULTADOS_MAXIMOS:
+            return {'filas': filas[:RESULTADOS_MAXIMOS], 'completa': False}
+
+    consulta = consulta_texto(termino, backend)
+    restantes = RESULTADOS_MAXIMOS - len(filas)
+    if consulta and restantes > 0:
+        # Las propiedades ya listadas por RUT no se repiten
+        fuera_de_rut = (
+            " AND NOT (COALESCE(p.rut_norm, '') >= ? AND COALESCE(p.rut_norm, '') < ?)" if rut else ''
+        )
+        params_rut = (rut, rut + '\uffff') if rut else ()
+        if backend.nombre == 'postgres':
+            coincidencias = f"FROM propiedades p, to_tsquery('simple', ?) q WHERE {documento_pg(COLUMNAS_TEXTO)} @@ q"
+            relevancia, recencia = f'-ts_rank({documento_pg(COLUMNAS_TEXTO)}, q)', 'p.id DESC'
+        else:
+            coincidencias = ('FROM propiedades_fts JOIN propiedades p ON p.id = propiedades_fts.rowid '
+                             'WHERE propiedades_fts MATCH ?')
+            # rank es bm25 con los pesos de COLUMNAS_TEXTO; FTS5 ordena por él internamente
+            relevancia, recencia = 'propiedades_fts.rank', 'propiedades_fts.rowid DESC'
+        # Cuántas coincidencias hay, sin pasar del máximo (recorre ids, sin puntuar)
+        cursor.execute(
+            f'SELECT COUNT(*) FROM (SELECT 1 {coincidencias}{fuera_de_rut} LIMIT ?) AS por_texto',
+            (consulta,) + params_rut + (restantes + 1,)
+        )
+        completa = cursor.fetchone()[0] <= restantes
+        cursor.execute(
+            f'SELECT p.id, p.rut_norm, {relevancia}, {columnas} {coincidencias}{fuera_de_rut} '
+            f'ORDER BY {relevancia if completa else recencia} LIMIT ?',
+            (consulta,) + params_rut + (restantes,)
+        )
+        agregar(cursor.fetchall(), False)
+    return {'filas': filas, 'completa': completa}
+
+
+def refinar_candidatos(candidatos, termino):
+    """Filtra en memoria los candidatos de un término más corto con un término que lo extiende"""
+    rut = normalizar_rut(termino)
+    palabras = normalizar_texto(termino).split()
+    por_rut = []
+    por_texto = []
+    for propiedad_id, rut_norm, palabras_fila, _, relevancia in candidatos['filas']:
+        if rut and rut_norm and rut_norm.startswith(rut):
+            por_rut.append((propiedad_id, rut_norm, palabras_fila, True, None))
+        elif palabras and coincide_texto(palabras_fila, palabras):
+            por_texto.append((propiedad_id, rut_norm, palabras_fila, False, relevancia))
+    return {'filas': por_rut + por_texto, 'completa': candidatos['completa']}
+
+
+def fragmento_texto(propiedad, palabras, largo=12):
+    """
+    Fragmento de la columna de texto que mejor coincide con la búsqueda, con
+    las palabras encontradas entre ** y a lo más `largo` palabras.
+
+    Las palabras se comparan como en el índice (sin tildes, en minúsculas y con
+    las abreviaturas expandidas); la última puede coincidir como prefijo.
+    """
+    if not palabras:
+        return None
+
+    def coincide(palabra):
+        palabra = ' '.join(palabras_texto(palabra))
+        palabra = ABREVIATURAS.get(palabra, palabra)
+        return palabra in palabras[:-1] or palabra.startswith(palabras[-1])
+
+    # Columna con más palabras encontradas (a igualdad, la de mayor peso en COLUMNAS_TEXTO)
+    mejor = None
+    for columna, _ in sorted(COLUMNAS_TEXTO, key=lambda par: -par[1]):
+        texto = str(propiedad.get(columna.removesuffix('_norm')) or '')
+        tramos = list(re.finditer(r'\w+', texto))
+        encontradas = [i for i, tramo in enumerate(tramos) if coincide(tramo.group())]
+        if encontradas and (mejor is None or len(encontradas) > len(mejor[2])):
+            mejor = (texto, tramos, encontradas)
+    if mejor is None:
+        return None
+
+    texto, tramos, encontradas = mejor
+    inicio = max(0, min(encontradas[0] - 2, len(tramos) - largo))
+    fin = min(len(tramos), inicio + largo)
+    partes = ['…' if inicio > 0 else '']
+    for i in range(inicio, fin):
+        palabra = tramos[i].group()
+        partes.append(f'**{palabra}**' if i in encontradas else palabra)
+        if i + 1 < fin:
+            partes.append(texto[tramos[i].end():tramos[i + 1].start()])
+    partes.append('…' if fin < len(tramos) else '')
+    return ''.join(partes)
+
+
+def buscar_propiedades(termino, limite=50, desplazamiento=0):
+    """
+    Busca propiedades por RUT, propietario, dirección, ROL, observaciones o expediente DOM.
+
+    Los RUT que comienzan con el término, en cualquier formato, se listan primero
+    (búsqueda por rango del RUT canónico en idx_propiedades_rut_norm_rol); luego
+    las coincidencias de texto completo ordenadas por relevancia (bm25 en
+    SQLite, ts_rank en PostgreSQL). Ver `buscar_candidatos`.
+
+    Los ids de todas las coincidencias (hasta RESULTADOS_MAXIMOS) quedan en el
+    caché de búsquedas hasta la siguiente escritura: las páginas siguientes se
+    sirven desde él y un término que extiende uno ya buscado ("indep" tras
+    "ind") se responde filtrando esos candidatos en memoria, conservando el
+    orden del término anterior. Solo se leen de la base las filas de la página.
+
+    Args:
+        termino (str): Texto ingresado por el usuario.
+        limite (int): Propiedades por página.
+        desplazamiento (int): Resultados ya mostrados (páginas anteriores).
+
+    Returns:
+        dict: 'datos' (propiedades de la página con 'relevancia', menor es
+        mejor, 'fragmento', texto con las coincidencias entre **, y sus fotos),
+        'hay_mas' (quedan páginas) y 'limitada' (la búsqueda alcanzó
+        RESULTADOS_MAXIMOS y se ordenó por recencia).
+    """
+    resultado = {'datos': [], 'hay_mas': False, 'limitada': False}
+    termino = (termino or '').strip()
+    if not termino:
+        return resultado
+    backend = backend_actual()
+    cache = cache_busquedas(DB_PATH if backend.nombre == 'sqlite' else DATABASE_URL)
+    generacion = generacion_datos()
+    clave = (normalizar_rut(termino), normalizar_texto(termino))
+    candidatos, exacta = cache.obtener(generacion, clave)
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                if candidatos is None:
+                    candidatos = buscar_candidatos(cursor, backend, termino)
+                    cache.guardar(generacion, clave, candidatos)
+                elif not exacta:
+                    candidatos = refinar_candidatos(candidatos, termino)
+                    cache.guardar(generacion, clave, candidatos)
+
+                pagina = candidatos['filas'][desplazamiento:desplazamiento + limite]
+                resultado['hay_mas'] = len(candidatos['filas']) > desplazamiento + limite
+                resultado['limitada'] = not candidatos['completa']
+                if not pagina:
+                    return resultado
+
+                # Filas de la página por clave primaria
+                cursor.execute(
+                    f'SELECT * FROM propiedades WHERE id IN ({backend.sql_lista_json})',
+                    (json.dumps([fila[0] for fila in pagina]),)
+                )
+                por_id = {propiedad['id']: propiedad
+                          for propiedad in filas_como_dicts(cursor.description, cursor.fetchall())}
+
+                palabras = normalizar_texto(termino).split()
+                for propiedad_id, _, _, por_rut, relevancia in pagina:
+                    propiedad = por_id.get(propiedad_id)
+                    if propiedad is not None:
+                        propiedad['relevancia'] = relevancia
+                        propiedad['fragmento'] = None if por_rut else fragmento_texto(propiedad, palabras)
+                        resultado['datos'].append(propiedad)
+                # Fotos solo de la página, en una sola consulta
+                agregar_fotos(cursor, resultado['datos'])
+                return resultado
+            except ERRORES_BD as e:
+                st.error(f"Error al realizar la búsqueda: {e}")
+                return resultado
+    return resultado
+
+
+def propiedades_en_bbox(min_lat, min_lon, max_lat, max_lon, limite=None, filtros=None):
+    """
+    Obtiene las propiedades cuyas coordenadas caen dentro de un rectángulo.
+
+    En SQLite la consulta recorre el R*Tree `propiedades_rtree` (que guarda las
+    cotas en precisión simple, redondeadas hacia afuera) y luego confirma con
+    lat/lon exactos. En PostgreSQL usa el índice sobre (lat, lon).
+
+    Args:
+        min_lat, min_lon, max_lat, max_lon (float): Límites del rectángulo (p. ej. el área visible del mapa).
+        limite (int, opcional): Máximo de propiedades a devolver.
+        filtros (dict, opcional): Filtros por columna (ver FILTROS_PROPIEDADES).
+
+    Returns:
+        list: Diccionarios con las columnas de cada propiedad.
+    """
+    if backend_actual().nombre == 'postgres':
+        query = 'SELECT p.* FROM propiedades p WHERE p.lat BETWEEN ? AND ? AND p.lon BETWEEN ? AND ?'
+        params = [min_lat, max_lat, min_lon, max_lon]
+    else:
+        query = '''
+        SELECT p.* FROM propiedades_rtree r
+        JOIN propiedades p ON p.id = r.id
+        WHERE r.max_lat >= ? AND r.min_lat <= ?
+          AND r.max_lon >= ? AND r.min_lon <= ?
+          AND p.lat BETWEEN ? AND ? AND p.lon BETWEEN ? AND ?
+        '''
+        params = [min_lat, max_lat, min_lon, max_lon] * 2
+    condiciones, params_filtros = compilar_filtros(filtros, alias='p.')
+    for condicion in condiciones:
+        query += f' AND {condicion}'
+    params += params_filtros
+    if limite is not None:
+        query += ' LIMIT ?'
+        params.append(limite)
+
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                return filas_como_dicts(cursor.description, cursor.fetchall())
+            except ERRORES_BD as e:
+                st.error(f"Error al buscar propiedades en el área: {e}")
+                return []
+    return []
+
+
+# Radio medio de la Tierra (m), para las distancias por haversine
+RADIO_TIERRA_M = 6371008.8
+
+
+def distancia_metros(lat1, lon1, lat2, lon2):
+    """Distancia en metros entre dos puntos (lat, lon) por la fórmula de haversine"""
+    fi1, fi2 = math.radians(lat1), math.radians(lat2)
+    dfi = fi2 - fi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dfi / 2) ** 2 + math.cos(fi1) * math.cos(fi2) * math.sin(dlambda / 2) ** 2
+    return 2 * RADIO_TIERRA_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def punto_en_poligono(lat, lon, vertices):
+    """
+    Indica si el punto está dentro del polígono de vértices [(lat, lon), ...]
+    (trazado de rayos; suficiente para áreas del tamaño de una comuna).
+    """
+    dentro = False
+    j = len(vertices) - 1
+    for i in range(len(vertices)):
+        lat_i, lon_i = vertices[i]
+        lat_j, lon_j = vertices[j]
+        if (lat_i > lat) != (lat_j > lat):
+            corte = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < corte:
+                dentro = not dentro
+        j = i
+    return dentro
+
+
+def propiedades_en_radio(lat, lon, metros, limite=None, filtros=None):
+    """
+    Propiedades a no más de `metros` del punto (lat, lon), de la más cercana a la más lejana.
+
+    Las candidatas salen del índice espacial con el rectángulo que contiene el
+    círculo (`propiedades_en_bbox`) y luego se confirma la distancia exacta
+    por haversine.
+
+    Args:
+        lat, lon (float): Centro de la búsqueda.
+        metros (float): Radio en metros.
+        limite (int, opcional): Máximo de propiedades a devolver (las más cercanas).
+        filtros (dict, opcional): Filtros por columna (ver FILTROS_PROPIEDADES).
+
+    Returns:
+        list: Propiedades con 'distancia_m'.
+    """
+    delta_lat = math.degrees(metros / RADIO_TIERRA_M)
+    # Cerca de los polos el rectángulo abarca todas las longitudes
+    coseno = math.cos(math.radians(lat))
+    delta_lon = 180.0 if coseno < 1e-6 else min(180.0, delta_lat / coseno)
+    candidatas = propiedades_en_bbox(
+        lat - delta_lat, lon - delta_lon, lat + delta_lat, lon + delta_lon, filtros=filtros
+    )
+
+    resultado = []
+    for propiedad in candidatas:
+        distancia = distancia_metros(lat, lon, propiedad['lat'], propiedad['lon'])
+        if distancia <= metros:
+            propiedad['distancia_m'] = distancia
+            resultado.append(propiedad)
+    resultado.sort(key=lambda propiedad: propiedad['distancia_m'])
+    return resultado[:limite] if limite is not None else resultado
+
+
+def propiedades_en_poligono(vertices, limite=None, filtros=None):
+    """
+    Propiedades dentro de un polígono (p. ej. un área dibujada en el mapa).
+
+    Las candidatas salen del índice espacial con el rectángulo que contiene el
+    polígono (`propiedades_en_bbox`) y luego se confirma cada punto con
+    `punto_en_poligono`.
+
+    Args:
+        vertices (list): Vértices [(lat, lon), ...]; se admite el primero repetido al final.
+        limite (int, opcional): Máximo de propiedades a devolver.
+        filtros (dict, opcional): Filtros por columna (ver FILTROS_PROPIEDADES).
+
+    Returns:
+        list: Diccionarios con las columnas de cada propiedad.
+    """
+    if len(vertices) < 3:
+        raise ValueError("Un polígono necesita al menos 3 vértices")
+    latitudes = [lat for lat, _ in vertices]
+    longitudes = [lon for _, lon in vertices]
+    candidatas = propiedades_en_bbox(
+        min(latitudes), min(longitudes), max(latitudes), max(longitudes), filtros=filtros
+    )
+    resultado = [
+        propiedad for propiedad in candidatas
+        if punto_en_poligono(propiedad['lat'], propiedad['lon'], vertices)
+    ]
+    return resultado[:limite] if limite is not None else resultado
+
+
+class IndiceCercanas:
+    """
+    Árbol k-d de las coordenadas proyectadas de las propiedades, para buscar las más cercanas.
+
+    Las coordenadas se proyectan a metros (equirrectangular en torno a la
+    latitud media, exacta a la escala de una comuna). El árbol es implícito:
+    los puntos se ordenan de modo que cada tramo [inicio, fin) es un nodo cuya
+    mediana separa por x o y según la profundidad. Las propiedades agregadas
+    o movidas después de armarlo quedan en `recientes` (se recorren por fuerza
+    bruta) y las versiones viejas en `descartadas`; cuando se acumulan
+    MAXIMO_PENDIENTES cambios el árbol se rearma en memoria, sin leer la base.
+    """
+
+    HOJA = 16
+    MAXIMO_PENDIENTES = 1024
+
+    def __init__(self):
+        self.generacion = None
+        self.max_id = 0
+        self.marca = None
+        self.lat_referencia = None
+        self.puntos = {}
+        self.recientes = set()
+        self.descartadas = set()
+        self.ids, self.xs, self.ys = [], [], []
+        self.lock = threading.Lock()
+
+    def proyectar(self, lat, lon):
+        x = math.radians(lon) * math.cos(math.radians(self.lat_referencia)) * RADIO_TIERRA_M
+        return x, math.radians(lat) * RADIO_TIERRA_M
+
+    def actualizar(self, filas):
+        """Agrega, mueve o quita (lat nula) los puntos de filas (id, lat, lon)"""
+        for propiedad_id, lat, lon in filas:
+            anterior = self.puntos.pop(propiedad_id, None)
+            if lat is not None and lon is not None:
+                self.puntos[propiedad_id] = self.proyectar(lat, lon)
+                if self.puntos[propiedad_id] == anterior:
+                    continue
+                self.recientes.add(propiedad_id)
+            else:
+                self.recientes.discard(propiedad_id)
+            if anterior is not None:
+                self.descartadas.add(propiedad_id)
+        if len(self.recientes) + len(self.descartadas) > self.MAXIMO_PENDIENTES:
+            self.armar()
+
+    def descartar(self, propiedad_id):
+        """Quita un punto que ya no existe en la base"""
+        if self.puntos.pop(propiedad_id, None) is not None:
+            self.descartadas.add(propiedad_id)
+            self.recientes.discard(propiedad_id)
+
+    def armar(self):
+        """Rearma el árbol con todos los puntos actuales"""
+        ids = list(self.puntos)
+        xs = [x for x, _ in self.puntos.values()]
+        ys = [y for _, y in self.puntos.values()]
+        orden = list(range(len(ids)))
+        pendientes = [(0, len(ids), 0)]
+        while pendientes:
+            inicio, fin, profundidad = pendientes.pop()
+            if fin - inicio <= self.HOJA:
+                continue
+            medio = (inicio + fin) // 2
+            eje = xs if profundidad % 2 == 0 else ys
+            orden[inicio:fin] = sorted(orden[inicio:fin], key=eje.__getitem__)
+            pendientes.append((inicio, medio, profundidad + 1))
+            pendientes.append((medio + 1, fin, profundidad + 1))
+        self.ids = [ids[i] for i in orden]
+        self.xs = [xs[i] for i in orden]
+        self.ys = [ys[i] for i in orden]
+        self.recientes.clear()
+        self.descartadas.clear()
+
+    def vecinos(self, propiedad_id, k):
+        """Ids de las k propiedades más cercanas a `propiedad_id`: [(distancia², id)], de menor a mayor"""
+        if propiedad_id not in self.puntos:
+            return []
+        x, y = self.puntos[propiedad_id]
+        ids, xs, ys, descartadas = self.ids, self.xs, self.ys, self.descartadas
+        # Montículo de máximos (distancias negadas) con las k mejores
+        mejores = []
+
+        def considerar(candidata, cx, cy):
+            if candidata == propiedad_id or candidata in descartadas:
+                return
+            distancia = (cx - x) ** 2 + (cy - y) ** 2
+            if len(mejores) < k:
+                heapq.heappush(mejores, (-distancia, candidata))
+            elif distancia < -mejores[0][0]:
+                heapq.heapreplace(mejores, (-distancia, candidata))
+
+        def visitar(inicio, fin, profundidad):
+            if fin - inicio <= self.HOJA:
+                for i in range(inicio, fin):
+                    considerar(ids[i], xs[i], ys[i])
+                return
+            medio = (inicio + fin) // 2
+            considerar(ids[medio], xs[medio], ys[medio])
+            diferencia = (x - xs[medio]) if profundidad % 2 == 0 else (y - ys[medio])
+            cerca, lejos = ((inicio, medio), (medio + 1, fin)) if diferencia < 0 else ((medio + 1, fin), (inicio, medio))
+            visitar(*cerca, profundidad + 1)
+            # El otro lado solo si la esfera actual cruza el plano de corte
+            if len(mejores) < k or diferencia * diferencia < -mejores[0][0]:
+                visitar(*lejos, profundidad + 1)
+
+        visitar(0, len(ids), 0)
+        # La versión reciente de un punto movido vale aunque la del árbol esté descartada
+        descartadas = ()
+        for candidata in self.recientes:
+            considerar(candidata, *self.puntos[candidata])
+        return sorted((-distancia, candidata) for distancia, candidata in mejores)
+
+    def sincronizar(self, cursor, generacion):
+        """Trae de la base los cambios desde la última generación vista (todo, la primera vez)"""
+        if generacion == self.generacion:
+            return
+        # Por separado, cada MAX se resuelve con un extremo de su índice
+        cursor.execute('SELECT MAX(id) FROM propiedades')
+        max_id = cursor.fetchone()[0]
+        cursor.execute('SELECT MAX(fecha_actualizacion) FROM propiedades')
+        marca = cursor.fetchone()[0]
+        if self.lat_referencia is None:
+            # Carga completa; sin coordenadas aún no hay latitud media y se repite en la siguiente generación
+            cursor.execute(
+                'SELECT id, lat, lon FROM propiedades WHERE lat IS NOT NULL AND lon IS NOT NULL'
+            )
+            filas = cursor.fetchall()
+            if filas:
+                self.lat_referencia = sum(fila[1] for fila in filas) / len(filas)
+            self.puntos = {propiedad_id: self.proyectar(lat, lon) for propiedad_id, lat, lon in filas}
+            self.armar()
+        else:
+            # Nuevas por id; editadas por fecha de actualización (>= porque tiene resolución de segundos)
+            query, params = 'SELECT id, lat, lon FROM propiedades WHERE id > ?', [self.max_id]
+            if self.marca is not None:
+                query += ' OR fecha_actualizacion >= ?'
+                params.append(self.marca)
+            cursor.execute(query, params)
+            self.actualizar(cursor.fetchall())
+        self.generacion, self.max_id, self.marca = generacion, max_id or 0, marca
+
+
+@st.cache_resource(show_spinner=False)
+def indice_cercanas(destino):
+    """Árbol k-d de propiedades cercanas del proceso para una base de datos"""
+    return IndiceCercanas()
+
+
+def cercanas(propiedad_id, k=10):
+    """
+    Las k propiedades más cercanas a una propiedad, de la más cercana a la más lejana.
+
+    Usa el árbol k-d en memoria (`IndiceCercanas`), que se pone al día con los
+    cambios de la base cuando cambia la generación de los datos; luego lee las
+    filas por clave primaria y calcula la distancia exacta por haversine.
+
+    Args:
+        propiedad_id (int): ID de la propiedad de referencia.
+        k (int): Cantidad de vecinas.
+
+    Returns:
+        list: Propiedades con 'distancia_m'; vacía si la propiedad no tiene coordenadas.
+    """
+    if k < 1:
+        raise ValueError("k debe ser al menos 1")
+    backend = backend_actual()
+    indice = indice_cercanas(DB_PATH if backend.nombre == 'sqlite' else DATABASE_URL)
+    generacion = generacion_datos()
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                with indice.lock:
+                    indice.sincronizar(cursor, generacion)
+                cursor.execute('SELECT lat, lon FROM propiedades WHERE id = ?', (propiedad_id,))
+                origen = cursor.fetchone()
+                while origen is not None and origen[0] is not None:
+                    with indice.lock:
+                        vecinas = indice.vecinos(propiedad_id, k)
+                    cursor.execute(
+                        f'SELECT * FROM propiedades WHERE id IN ({backend.sql_lista_json})',
+                        (json.dumps([candidata for _, candidata in vecinas]),)
+                    )
+                    por_id = {propiedad['id']: propiedad
+                              for propiedad in filas_como_dicts(cursor.description, cursor.fetchall())}
+                    # Eliminadas desde la última sincronización: se quitan del índice y se vuelve a buscar
+                    faltantes = [candidata for _, candidata in vecinas if candidata not in por_id]
+                    if faltantes:
+                        with indice.lock:
+                            for candidata in faltantes:
+                                indice.descartar(candidata)
+                        continue
+                    resultado = []
+                    for _, candidata in vecinas:
+                        propiedad = por_id[candidata]
+                        propiedad['distancia_m'] = distancia_metros(
+                            origen[0], origen[1], propiedad['lat'], propiedad['lon']
+                        )
+                        resultado.append(propiedad)
+                    resultado.sort(key=lambda propiedad: propiedad['distancia_m'])
+                    return resultado
+                return []
+            except ERRORES_BD as e:
+                st.error(f"Error al buscar propiedades cercanas: {e}")
+                return []
+    return []
+
+
+def generacion_datos():
+    """Número que cambia con cada escritura en propiedades (clave para los cachés en memoria)"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT total FROM conteos_propiedades WHERE categoria = 'generacion'")
+                fila = cursor.fetchone()
+                return fila[0] if fila else 0
+            except ERRORES_BD as e:
+                st.error(f"Error al leer la generación de los datos: {e}")
+                return 0
+    return 0
+
+
+# Búsqueda aproximada: similitud mínima para corregir una palabra o sugerir una propiedad
+SIMILITUD_MINIMA = 0.3
+
+
+def trigramas(texto):
+    """Conjunto de trigramas de un texto; cada palabra se rellena con espacios (como pg_trgm)"""
+    resultado = set()
+    for palabra in texto.split():
+        palabra = f'  {palabra} '
+        resultado.update(palabra[i:i + 3] for i in range(len(palabra) - 2))
+    return resultado
+
+
+def similitud_trigramas(consulta, texto):
+    """
+    Similitud (0 a 1) entre la consulta y la parte más parecida de un texto, ambos normalizados.
+
+    Compara por Jaccard de trigramas contra cada tramo del texto con tantas
+    palabras como la consulta, de modo que "indepndencia" se parece a
+    "avenida independencia 1234" tanto como a "independencia".
+    """
+    buscados = trigramas(consulta)
+    if not buscados:
+        return 0.0
+    palabras = texto.split()
+    largo = len(consulta.split())
+    mejor = 0.0
+    for inicio in range(max(1, len(palabras) - largo + 1)):
+        tramo = trigramas(' '.join(palabras[inicio:inicio + largo]))
+        if tramo:
+            mejor = max(mejor, len(buscados & tramo) / len(buscados | tramo))
+    return mejor
+
+
+class IndiceTrigramas:
+    """
+    Índice invertido trigrama -> palabras del vocabulario de propietario y dirección.
+
+    La primera vez se arma con el vocabulario del índice de texto completo
+    (`propiedades_fts_vocab`); después, con cada generación de los datos,
+    solo se agregan las palabras de las filas nuevas o editadas, como en
+    `IndiceCercanas`. Las palabras que dejaron de usarse siguen en el índice
+    hasta que se acumulan MAXIMO_PENDIENTES filas cambiadas y se rearma.
+    `corregir` busca las palabras que comparten trigramas con la dada y las
+    ordena por similitud de Jaccard.
+    """
+
+    MAXIMO_PENDIENTES = 5000
+
+    def __init__(self, palabras=()):
+        self.palabras = {}
+        self.posteo = {}
+        self.generacion = None
+        self.max_id = 0
+        self.marca = None
+        self.pendientes = 0
+        self.lock = threading.Lock()
+        self.agregar(palabras)
+
+    def agregar(self, palabras):
+        """Suma al vocabulario los pares (palabra, frecuencia)"""
+        for palabra, frecuencia in palabras:
+            if palabra in self.palabras:
+                self.palabras[palabra] += frecuencia
+                continue
+            self.palabras[palabra] = frecuencia
+            for trigrama in trigramas(palabra):
+                self.posteo.setdefault(trigrama, []).append(palabra)
+
+    def sincronizar(self, cursor, generacion):
+        """Trae de la base las palabras nuevas desde la última generación vista (todo, la primera vez)"""
+        if generacion == self.generacion:
+            return
+        cursor.execute('SELECT MAX(id) FROM propiedades')
+        max_id = cursor.fetchone()[0]
+        cursor.execute('SELECT MAX(fecha_actualizacion) FROM propiedades')
+        marca = cursor.fetchone()[0]
+        columnas = [f'{columna}_norm' for columna in COLUMNAS_NORMALIZADAS]
+        if self.generacion is None or self.pendientes > self.MAXIMO_PENDIENTES:
+            cursor.execute(
+                f"SELECT term, doc FROM propiedades_fts_vocab "
+                f"WHERE col IN ({', '.join('?' for _ in columnas)})",
+                columnas
+            )
+            self.palabras, self.posteo, self.pendientes = {}, {}, 0
+            self.agregar(cursor.fetchall())
+        else:
+            # Nuevas por id; editadas por fecha de actualización (>= porque tiene resolución de segundos)
+            query, params = f"SELECT {', '.join(columnas)} FROM propiedades WHERE id > ?", [self.max_id]
+            if self.marca is not None:
+                query += ' OR fecha_actualizacion >= ?'
+                params.append(self.marca)
+            cursor.execute(query, params)
+            filas = cursor.fetchall()
+            self.pendientes += len(filas)
+            self.agregar((palabra, 1) for fila in filas for valor in fila for palabra in (valor or '').split())
+        self.generacion, self.max_id, self.marca = generacion, max_id or 0, marca
+
+    def corregir(self, palabra, cantidad=3):
+        """Palabras del vocabulario más parecidas a `palabra`: [(similitud, palabra)], de mayor a menor"""
+        if palabra in self.palabras:
+            return [(1.0, palabra)]
+        buscados = trigramas(palabra)
+        comunes = {}
+        for trigrama in buscados:
+            for candidata in self.posteo.get(trigrama, ()):
+                comunes[candidata] = comunes.get(candidata, 0) + 1
+        puntajes = []
+        for candidata, compartidos in comunes.items():
+            similitud = compartidos / (len(buscados) + len(trigramas(candidata)) - compartidos)
+            if similitud >= SIMILITUD_MINIMA:
+                # A igual similitud, preferir la palabra más frecuente
+                puntajes.append((similitud, self.palabras[candidata], candidata))
+        puntajes.sort(reverse=True)
+        return [(similitud, candidata) for similitud, _, candidata in puntajes[:cantidad]]
+
+
+@st.cache_resource(show_spinner=False)
+def indice_vocabulario(destino):
+    """Índice de trigramas del vocabulario de propietario_norm y direccion_norm (SQLite) del proceso"""
+    return IndiceTrigramas()
+
+
+def corregir_termino(termino):
+    """
+    Corrige cada palabra del término a la más parecida del vocabulario de
+    propietarios y direcciones ("indepndencia" -> "independencia").
+
+    Solo en SQLite, que expone el vocabulario del índice de texto completo.
+    El índice de trigramas se pone al día con los cambios de la base cuando
+    cambia la generación de los datos (ver `IndiceTrigramas.sincronizar`).
+
+    Returns:
+        str: Término corregido (normalizado), o None si no hay corrección posible
+        o el término ya estaba bien escrito.
+    """
+    palabras = normalizar_texto(termino).split()
+    if not palabras or backend_actual().nombre != 'sqlite':
+        return None
+    indice = indice_vocabulario(DB_PATH)
+    generacion = generacion_datos()
+    with get_db_connection() as conn:
+        if conn is None:
+            return None
+        try:
+            with indice.lock:
+                indice.sincronizar(conn.cursor(), generacion)
+        except ERRORES_BD as e:
+            st.error(f"Error al leer el vocabulario de búsqueda: {e}")
+            return None
+    corregidas = []
+    with indice.lock:
+        for palabra in palabras:
+            opciones = indice.corregir(palabra, 1)
+            if not opciones:
+                return None
+            corregidas.append(opciones[0][1])
+    return None if corregidas == palabras else ' '.join(corregidas)
+
+
+def sugerir_propiedades(termino, k=10):
+    """
+    Sugerencias "¿quiso decir?": propiedades cuyo propietario o dirección se
+    parecen al término aunque esté mal escrito.
+
+    En SQLite cada palabra se corrige con el índice de trigramas del
+    vocabulario (`corregir_termino`) y las candidatas salen del índice de
+    texto completo con el término corregido. En PostgreSQL las candidatas
+    salen de pg_trgm (word_similarity). En ambos casos se ordenan por
+    `similitud_trigramas` con el término original.
+
+    Returns:
+        list: Hasta `k` propiedades con 'similitud' (0 a 1) y 'coincidencia'
+        (propietario o dirección que se parece al término).
+    """
+    consulta = normalizar_texto(termino)
+    if not consulta:
+        return []
+    backend = backend_actual()
+    if backend.nombre == 'sqlite':
+        correccion = corregir_termino(consulta)
+        if correccion is None:
+            return []
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                if backend.nombre == 'postgres':
+                    condiciones = ' OR '.join(f'? <% {columna}_norm' for columna in COLUMNAS_NORMALIZADAS)
+                    similitudes = ', '.join(f'word_similarity(?, {columna}_norm)' for columna in COLUMNAS_NORMALIZADAS)
+                    cursor.execute(
+                        f'SELECT * FROM propiedades WHERE {condiciones} '
+                        f'ORDER BY GREATEST({similitudes}) DESC LIMIT ?',
+                        [consulta] * (2 * len(COLUMNAS_NORMALIZADAS)) + [k * 5]
+                    )
+                else:
+                    columnas = ' '.join(f'{columna}_norm' for columna in COLUMNAS_NORMALIZADAS)
+                    palabras = ' '.join(f'"{palabra}"' for palabra in correccion.split())
+                    # El filtro de columnas abarca todas las palabras solo si van entre paréntesis
+                    cursor.execute(
+                        'SELECT p.* FROM propiedades_fts '
+                        'JOIN propiedades p ON p.id = propiedades_fts.rowid '
+                        'WHERE propiedades_fts MATCH ? '
+                        'ORDER BY propiedades_fts.rank LIMIT ?',
+                        (f'{{{columnas}}} : ({palabras})', k * 5)
+                    )
+                candidatas = filas_como_dicts(cursor.description, cursor.fetchall())
+
+                sugerencias = []
+                for propiedad in candidatas:
+                    similitud, coincidencia = max(
+                        ((similitud_trigramas(consulta, normalizar_texto(propiedad[columna])), propiedad[columna])
+                         for columna in COLUMNAS_NORMALIZADAS),
+                        key=lambda par: par[0]
+                    )
+                    if similitud >= SIMILITUD_MINIMA:
+                        propiedad['similitud'] = similitud
+                        propiedad['coincidencia'] = coincidencia
+                        sugerencias.append(propiedad)
+                sugerencias.sort(key=lambda propiedad: propiedad['similitud'], reverse=True)
+                sugerencias = sugerencias[:k]
+
+                agregar_fotos(cursor, sugerencias)
+                return sugerencias
+            except ERRORES_BD as e:
+                st.error(f"Error al buscar sugerencias: {e}")
+                return []
+    return []
+
+
+# Autocompletado: tipos de sugerencia y la columna indexada por la que se recorre cada uno
+COLUMNAS_AUTOCOMPLETAR = (
+    ('ROL', 'rol_propiedad', 'rol_propiedad'),
+    ('RUT', 'rut_norm', 'rut'),
+    ('Calle', 'direccion_norm', 'direccion'),
+    ('Propietario', 'propietario_norm', 'propietario'),
+)
+
+
+def _calle(direccion_norm):
+    """Nombre de la calle de una dirección normalizada: todo antes del último número ("calle 12 45" -> "calle 12")"""
+    palabras = direccion_norm.split()
+    for i in range(len(palabras) - 1, 0, -1):
+        if palabras[i].isdigit():
+            return ' '.join(palabras[:i])
+    return None
+
+
+def valores_con_prefijo(cursor, columna, visible, prefijo, limite):
+    """
+    Valores distintos de `columna` que comienzan con `prefijo`, en orden.
+
+    Recorre el índice de la columna saltando de un valor al siguiente (una
+    búsqueda por rango con LIMIT 1 por valor), así el costo depende de
+    `limite` y no de cuántas filas comparten el prefijo. Las direcciones se
+    agrupan por calle, saltando todos los números de cada una.
+
+    Returns:
+        list: Tuplas (valor en `columna`, valor en `visible`).
+    """
+    valores = []
+    desde, operador = prefijo, '>='
+    while len(valores) < limite:
+        cursor.execute(
+            f'SELECT {columna}, {visible} FROM propiedades '
+            f'WHERE {columna} {operador} ? AND {columna} < ? ORDER BY {columna} LIMIT 1',
+            (desde, prefijo + '\uffff')
+        )
+        fila = cursor.fetchone()
+        if fila is None:
+            break
+        valor, texto = fila
+        calle = _calle(valor) if columna == 'direccion_norm' else None
+        if calle is not None and calle.startswith(prefijo):
+            # Mostrar la dirección original sin su número y saltar al fin de la calle
+            # (':' ordena después de los dígitos, así "calle 12 :" queda antes de "calle 120")
+            texto = re.sub(r'[\s#,.-]*\d+\s*$', '', texto)
+            desde, operador = calle + ' :', '>='
+        else:
+            desde, operador = valor, '>'
+        if texto and all(texto != visto for _, visto in valores):
+            valores.append((valor, texto))
+    return valores
+
+
+@st.cache_data(show_spinner=False, max_entries=512)
+def _autocompletar(destino, generacion, prefijo, limite):
+    """Sugerencias de `autocompletar` para una generación de los datos (caché de prefijos recientes)"""
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                sugerencias = []
+                for tipo, columna, visible in COLUMNAS_AUTOCOMPLETAR:
+                    if columna == 'rut_norm':
+                        buscado = normalizar_rut(prefijo)
+                    elif columna == 'rol_propiedad':
+                        buscado = prefijo.strip()
+                    else:
+                        buscado = normalizar_texto(prefijo)
+                    restantes = limite - len(sugerencias)
+                    if not buscado or restantes <= 0:
+                        continue
+                    sugerencias.extend(
+                        {'tipo': tipo, 'texto': texto}
+                        for _, texto in valores_con_prefijo(cursor, columna, visible, buscado, restantes)
+                    )
+                return sugerencias
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener sugerencias de búsqueda: {e}")
+                return []
+    return []
+
+
+def autocompletar(prefijo, limite=8):
+    """
+    Sugerencias mientras se escribe en Buscar Propiedades: ROL, RUT, calles y
+    propietarios que comienzan con `prefijo`, en ese orden.
+
+    Cada tipo se resuelve con saltos por su índice (ver `valores_con_prefijo`)
+    y los prefijos recientes se guardan en caché hasta la siguiente escritura
+    (`generacion_datos`).
+
+    Returns:
+        list: Hasta `limite` diccionarios con 'tipo' y 'texto' (valor a buscar).
+    """
+    prefijo = (prefijo or '').strip()
+    if not prefijo:
+        return []
+    destino = DB_PATH if BACKEND == 'sqlite' else DATABASE_URL
+    return _autocompletar(destino, generacion_datos(), prefijo, limite)
+
+
+# Columnas con lista de valores para los filtros de la barra lateral: {columna: columna indexada que agrupa}
+COLUMNAS_VALORES_DISTINTOS = {
+    'rut': 'rut_norm',
+    'propietario': 'propietario_norm',
+    'rol_propiedad': 'rol_propiedad',
+    'direccion': 'direccion_norm',
+}
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _valores_distintos(destino, generacion, columna):
+    """Valores de `valores_distintos` para una generación de los datos"""
+    agrupada = COLUMNAS_VALORES_DISTINTOS[columna]
+    if agrupada == columna:
+        consultas = [f'SELECT {columna}, {columna} FROM propiedades GROUP BY {columna}']
+        normalizar = None
+    else:
+        # Un valor original por valor normalizado, más las filas sin valor normalizado
+        # (escritas directamente en la base, sin pasar por db_utils; rut_norm es obligatorio)
+        consultas = [
+            f'SELECT {agrupada}, MAX({columna}) FROM propiedades WHERE {agrupada} IS NOT NULL GROUP BY {agrupada}',
+        ]
+        if columna != 'rut':
+            consultas.append(f'SELECT NULL, {columna} FROM propiedades WHERE {agrupada} IS NULL')
+        normalizar = normalizar_rut if columna == 'rut' else normalizar_texto
+    with get_db_connection() as conn:
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                valores = {}
+                for query in consultas:
+                    cursor.execute(query)
+                    for clave, valor in cursor.fetchall():
+                        # Sin recortar espacios: el filtro compara el valor tal como está en la base
+                        if valor and valor.strip():
+                            valores.setdefault(normalizar(valor) if clave is None else clave, valor)
+                return [valores[clave] for clave in sorted(valores)]
+            except ERRORES_BD as e:
+                st.error(f"Error al obtener los valores de {columna}: {e}")
+                return []
+    return []
+
+
+def valores_distintos(columna):
+    """
+    Valores distintos de una columna para las opciones de los filtros de la barra lateral.
+
+    RUT, propietario y dirección se agrupan por su versión normalizada (las
+    variantes de mayúsculas, tildes o formato cuentan como un solo valor,
+    igual que al filtrar con `compilar_filtros`). Las listas se guardan en
+    caché hasta la siguiente escritura (`generacion_datos`).
+
+    Args:
+        columna (str): Una de COLUMNAS_VALORES_DISTINTOS.
+
+    Returns:
+        list: Valores ordenados.
+    """
+    if columna not in COLUMNAS_VALORES_DISTINTOS:
+        raise ValueError(f"Columna sin lista de valores: {columna}")
+    destino = DB_PATH if BACKEND == 'sqlite' else DATABASE_URL
+    return _valores_distintos(destino, generacion_datos(), columna)
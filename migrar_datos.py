@@ -1,3 +1,9 @@
+"""
+Traslada la base SQLite antigua (junto al código) a ~/.catastro_propiedades.
+
+Solo aplica al backend SQLite; con CATASTRO_DB_BACKEND=postgres no hay
+archivo que trasladar.
+"""
 import sqlite3
 import os
 import shutil
@@ -16,6 +22,10 @@ def migrar_datos():
     print(f"Destino: {db_nueva}")
     print("-" * 50)
     
+    if os.environ.get('CATASTRO_DB_BACKEND', 'sqlite').lower() != 'sqlite':
+        print("[ERROR] La migración de archivos solo aplica al backend SQLite.")
+        return
+    
     # Verificar si existe la base de datos antigua
     if not db_vieja.exists():
         print("[ERROR] No se encontró la base de datos antigua en la ubicación esperada.")
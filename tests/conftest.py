@@ -0,0 +1,128 @@
+"""
+Fixtures de las pruebas de db_utils.
+
+Las pruebas que usan `bd` corren una vez por backend:
+
+- sqlite: un archivo nuevo en el directorio temporal de cada prueba.
+- postgres: la base indicada en CATASTRO_TEST_DATABASE_URL (use una base
+  dedicada: su esquema public se borra antes de cada prueba). Sin esa
+  variable, las pruebas de PostgreSQL se omiten; con ella, fallan si el
+  servidor no responde (así la integración continua no las omite sin avisar).
+"""
+import os
+import sys
+
+import pytest
+import streamlit as st
+
+# Importar los módulos de la aplicación desde la raíz del repositorio
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils  # noqa: E402
+
+TEST_DATABASE_URL = os.environ.get('CATASTRO_TEST_DATABASE_URL')
+
+
+class Avisos:
+    """Mensajes de st.error y st.warning emitidos durante una prueba"""
+
+    def __init__(self):
+        self.errores = []
+        self.advertencias = []
+
+
+def vaciar_esquema_postgres(dsn):
+    """Borra todas las tablas, funciones y extensiones del esquema public"""
+    import psycopg2
+    try:
+        conn = psycopg2.connect(dsn)
+    except psycopg2.OperationalError as e:
+        pytest.fail(f"PostgreSQL no disponible en CATASTRO_TEST_DATABASE_URL: {e}")
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute('DROP SCHEMA public CASCADE')
+        cursor.execute('CREATE SCHEMA public')
+    conn.close()
+
+
+@pytest.fixture
+def avisos(monkeypatch):
+    """Captura st.error y st.warning (db_utils informa los errores de la base con ellos)"""
+    capturados = Avisos()
+    monkeypatch.setattr(st, 'error', lambda mensaje, *args, **kwargs: capturados.errores.append(str(mensaje)))
+    monkeypatch.setattr(st, 'warning', lambda mensaje, *args, **kwargs: capturados.advertencias.append(str(mensaje)))
+    return capturados
+
+
+@pytest.fixture(params=['sqlite', 'postgres'])
+def bd(request, tmp_path, monkeypatch, avisos):
+    """
+    Base de datos vacía e inicializada con `init_db` en el backend del parámetro.
+
+    Los cachés de Streamlit (backend, índices en memoria, listas de valores)
+    se vacían antes y después, para que ninguna prueba vea datos de otra.
+    Al terminar, la prueba falla si db_utils informó algún error no esperado.
+    """
+    if request.param == 'postgres':
+        if not TEST_DATABASE_URL:
+            pytest.skip("Defina CATASTRO_TEST_DATABASE_URL para probar el backend PostgreSQL")
+        vaciar_esquema_postgres(TEST_DATABASE_URL)
+        monkeypatch.setattr(db_utils, 'DATABASE_URL', TEST_DATABASE_URL)
+    else:
+        monkeypatch.setattr(db_utils, 'DB_PATH', str(tmp_path / 'catastro_propiedades.db'))
+    monkeypatch.setattr(db_utils, 'BACKEND', request.param)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    assert db_utils.init_db(), avisos.errores
+    backend = db_utils.backend_actual()
+    yield backend
+
+    # La prueba pudo reemplazar el backend (ver `reiniciar_base`)
+    db_utils.backend_actual().cerrar()
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    assert not avisos.errores, avisos.errores
+
+
+def reiniciar_base(backend, migraciones=None):
+    """
+    Borra la base de la prueba y la vuelve a crear con `init_db`, aplicando
+    solo las primeras `migraciones` de MIGRACIONES (como una base creada por
+    una versión anterior de la aplicación). Devuelve el backend nuevo.
+    """
+    backend.cerrar()
+    if backend.nombre == 'postgres':
+        vaciar_esquema_postgres(TEST_DATABASE_URL)
+    else:
+        for sufijo in ('', '-wal', '-shm'):
+            if os.path.exists(backend.db_path + sufijo):
+                os.remove(backend.db_path + sufijo)
+    st.cache_resource.clear()
+    st.cache_data.clear()
+
+    todas = db_utils.MIGRACIONES
+    db_utils.MIGRACIONES = todas[:migraciones]
+    try:
+        assert db_utils.init_db()
+    finally:
+        db_utils.MIGRACIONES = todas
+    return db_utils.backend_actual()
+
+
+def propiedad(numero, **valores):
+    """Datos de una propiedad de prueba, distinta para cada `numero`"""
+    datos = {
+        'rut': f'{10000000 + numero}-{numero % 10}',
+        'propietario': f'Propietario {numero}',
+        'direccion': f'Avenida Independencia {1000 + numero}',
+        'rol_propiedad': f'{numero // 100}-{numero % 100}',
+        'avaluo_total': 1000000 + numero,
+        'destino_sii': 'Habitacional',
+        'destino_dom': 'Habitacional',
+        'patente_comercial': 'SIN PATENTE',
+        'fiscalizacion_dom': 'SIN FISCALIZAR',
+        'coordenadas': f'{-33.41 - numero * 0.0001}, {-70.66 - numero * 0.0001}',
+        'ano_construccion': 1950 + numero % 70,
+    }
+    datos.update(valores)
+    return datos
@@ -0,0 +1,154 @@
+"""Pruebas de almacenamiento.py: perfil de PRAGMA de SQLite y pools de conexiones"""
+import pytest
+import streamlit as st
+
+import almacenamiento
+import db_utils
+from almacenamiento import BackendSQLite, perfil_rendimiento
+
+
+def config_bd(**valores):
+    """Configuración de base de datos por defecto con los valores indicados"""
+    return {**almacenamiento.DEFAULT_CONFIG['base_datos'], **valores}
+
+
+def pragma(conn, nombre):
+    return conn.execute(f'PRAGMA {nombre}').fetchone()[0]
+
+
+def test_perfil_por_defecto_activa_wal(tmp_path):
+    backend = BackendSQLite(str(tmp_path / 'catastro.db'), config_bd())
+    conn = backend.adquirir()
+    try:
+        assert pragma(conn, 'journal_mode') == 'wal'
+        assert pragma(conn, 'synchronous') == 1  # NORMAL
+        assert pragma(conn, 'temp_store') == 2  # MEMORY
+        assert pragma(conn, 'busy_timeout') == 5000
+        assert pragma(conn, 'cache_size') == -20000
+        assert pragma(conn, 'foreign_keys') == 1
+    finally:
+        backend.liberar(conn)
+        backend.cerrar()
+
+
+def test_perfil_configurable(tmp_path):
+    config = config_bd(journal_mode='delete', synchronous='full', cache_size='-4000', mmap_size=None)
+    assert perfil_rendimiento(config) == {
+        'busy_timeout': 5000, 'cache_size': -4000, 'journal_mode': 'DELETE',
+        'synchronous': 'FULL', 'temp_store': 'MEMORY',
+    }
+    backend = BackendSQLite(str(tmp_path / 'catastro.db'), config)
+    with backend.pool.conexion() as conn:
+        assert pragma(conn, 'journal_mode') == 'delete'
+        assert pragma(conn, 'synchronous') == 2  # FULL
+        assert pragma(conn, 'cache_size') == -4000
+    backend.cerrar()
+
+
+@pytest.mark.parametrize('valores', [
+    {'journal_mode': 'WAL; DROP TABLE propiedades'},
+    {'synchronous': 'SIEMPRE'},
+    {'cache_size': 'mucho'},
+])
+def test_perfil_rechaza_valores_no_permitidos(valores):
+    with pytest.raises(ValueError):
+        perfil_rendimiento(config_bd(**valores))
+
+
+def test_perfil_invalido_se_informa_al_conectar(tmp_path, monkeypatch, avisos):
+    monkeypatch.setattr(db_utils, 'BACKEND', 'sqlite')
+    monkeypatch.setattr(db_utils, 'DB_PATH', str(tmp_path / 'catastro.db'))
+    monkeypatch.setattr(almacenamiento, 'obtener_valor', lambda clave: {'journal_mode': 'RAPIDO'})
+    st.cache_resource.clear()
+    try:
+        with db_utils.get_db_connection() as conn:
+            assert conn is None
+        assert not db_utils.init_db()
+        assert db_utils.obtener_propiedades()['datos'] == []
+    finally:
+        st.cache_resource.clear()
+    assert avisos.errores and all('PRAGMA journal_mode' in error for error in avisos.errores)
+
+
+def test_pool_reutiliza_la_conexion(tmp_path):
+    pool = almacenamiento.PoolConexiones(str(tmp_path / 'catastro.db'), tamano=2)
+    with pool.conexion() as primera:
+        pass
+    with pool.conexion() as segunda:
+        assert segunda is primera
+    # Dos préstamos simultáneos usan conexiones distintas
+    with pool.conexion() as una, pool.conexion() as otra:
+        assert una is not otra
+    assert pool._creadas == 2
+    pool.cerrar()
+    assert pool._creadas == 0
+
+
+def test_pool_descarta_conexiones_que_no_responden(tmp_path):
+    pool = almacenamiento.PoolConexiones(str(tmp_path / 'catastro.db'), tamano=1)
+    with pool.conexion() as conn:
+        pass
+    conn.close()
+    with pool.conexion() as nueva:
+        assert nueva is not conn
+        assert nueva.execute('SELECT 1').fetchone() == (1,)
+    assert pool._creadas == 1
+    pool.cerrar()
+
+
+def test_pool_agotado_espera_y_falla(tmp_path):
+    pool = almacenamiento.PoolConexiones(str(tmp_path / 'catastro.db'), tamano=1, timeout=0.05)
+    with pool.conexion():
+        with pytest.raises(almacenamiento.Error, match='No hay conexiones disponibles'):
+            pool.adquirir()
+    pool.cerrar()
+
+
+def test_pool_deshace_la_transaccion_pendiente(tmp_path):
+    pool = almacenamiento.PoolConexiones(str(tmp_path / 'catastro.db'), tamano=1)
+    with pool.conexion() as conn:
+        conn.execute('CREATE TABLE t (x INTEGER)')
+        conn.commit()
+        conn.execute('INSERT INTO t VALUES (1)')
+    with pool.conexion() as conn:
+        assert not conn.in_transaction
+        assert conn.execute('SELECT COUNT(*) FROM t').fetchone() == (0,)
+    pool.cerrar()
+
+
+def test_get_db_connection_presta_del_pool(bd):
+    with db_utils.get_db_connection() as primera:
+        pass
+    with db_utils.get_db_connection() as segunda:
+        pass
+    # El backend se comparte entre llamadas (st.cache_resource) y la conexión se reutiliza
+    assert db_utils.backend_actual() is bd
+    if bd.nombre == 'sqlite':
+        assert segunda is primera
+    else:
+        assert segunda.raw is primera.raw
+
+
+def test_cursor_postgres_traduce_marcadores():
+    traducir = almacenamiento.CursorPostgres._traducir
+    assert traducir("SELECT * FROM propiedades WHERE rut = ? AND direccion LIKE ?") == (
+        "SELECT * FROM propiedades WHERE rut = %s AND direccion LIKE %s"
+    )
+    # Los % literales se duplican para que psycopg2 no los tome como marcadores
+    assert traducir("SELECT '100%' WHERE x LIKE '%a%' AND y = ?") == "SELECT '100%%' WHERE x LIKE '%%a%%' AND y = %s"
+
+
+def test_cursor_lectura_postgres_es_del_servidor(bd):
+    if bd.nombre != 'postgres':
+        pytest.skip("Solo PostgreSQL tiene cursores con nombre")
+    db_utils.guardar_propiedades_lote({'rut': f'{numero}-0', 'rol_propiedad': str(numero)} for numero in range(1, 6))
+    conn = bd.adquirir()
+    try:
+        lector = bd.cursor_lectura(conn)
+        lector.execute("SELECT rol_propiedad FROM propiedades WHERE rol_propiedad LIKE ? ORDER BY id", ('%',))
+        assert lector._cursor.name
+        assert [fila[0] for fila in lector.fetchmany(2)] == ['1', '2']
+        assert [fila[0] for fila in lector.fetchall()] == ['3', '4', '5']
+        lector.close()
+    finally:
+        bd.liberar(conn)
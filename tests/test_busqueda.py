@@ -0,0 +1,208 @@
+"""Pruebas de Buscar Propiedades: páginas de resultados, caché de búsquedas, búsqueda aproximada ("¿quiso decir?") y su vocabulario"""
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+@pytest.fixture
+def solo_sqlite(bd):
+    # La corrección por vocabulario usa fts5vocab; PostgreSQL sugiere con pg_trgm
+    if bd.nombre != 'sqlite':
+        pytest.skip("Vocabulario de búsqueda solo en SQLite")
+    return bd
+
+
+def test_filtro_de_columnas_abarca_todas_las_palabras(solo_sqlite):
+    db_utils.guardar_propiedad(propiedad(1, propietario='Pedro Soto', direccion='Independencia 100',
+                                         observaciones='juana'))
+    ambas = db_utils.guardar_propiedad(propiedad(2, propietario='Juana Rojas', direccion='Independencia 200'))
+    # "juana" solo está en observaciones de la primera: no cuenta para propietario o dirección
+    assert [fila['id'] for fila in db_utils.sugerir_propiedades('indepndencia juana')] == [ambas]
+
+
+def test_vocabulario_se_actualiza_por_incrementos(solo_sqlite):
+    db_utils.guardar_propiedad(propiedad(1, direccion='Avenida Independencia 100'))
+    assert db_utils.corregir_termino('indepndencia') == 'independencia'
+    indice = db_utils.indice_vocabulario(db_utils.DB_PATH)
+    assert indice.pendientes == 0
+
+    nueva = db_utils.guardar_propiedad(propiedad(2, direccion='Pasaje Quilicura 5'))
+    assert db_utils.corregir_termino('quilicra') == 'quilicura'
+    # Solo se leyeron las filas cambiadas, sin rearmar desde el vocabulario completo
+    assert indice.pendientes > 0
+
+    db_utils.actualizar_celdas({nueva: {'propietario': 'Rosalía Fernández'}})
+    assert db_utils.corregir_termino('rosalia fernandes') == 'rosalia fernandez'
+
+
+def test_vocabulario_se_rearma_tras_muchos_cambios(solo_sqlite, monkeypatch):
+    monkeypatch.setattr(db_utils.IndiceTrigramas, 'MAXIMO_PENDIENTES', 1)
+    primera = db_utils.guardar_propiedad(propiedad(1, direccion='Calle Quilicura 1'))
+    assert db_utils.corregir_termino('quilicra') == 'quilicura'
+    db_utils.actualizar_celdas({primera: {'direccion': 'Calle Colina 1'}})
+    db_utils.guardar_propiedad(propiedad(2))
+    db_utils.corregir_termino('colna')
+    db_utils.guardar_propiedad(propiedad(3))
+    # Al rearmar desaparecen las palabras que ya no usa ninguna propiedad
+    assert db_utils.corregir_termino('quilicra') is None
+    assert db_utils.corregir_termino('colna') == 'colina'
+
+
+def contar_llamadas(monkeypatch, nombre):
+    """Reemplaza db_utils.<nombre> por una versión que registra sus argumentos"""
+    llamadas = []
+    original = getattr(db_utils, nombre)
+
+    def registrar(*args):
+        llamadas.append(args)
+        return original(*args)
+    monkeypatch.setattr(db_utils, nombre, registrar)
+    return llamadas
+
+
+def test_termino_mas_largo_se_refina_en_memoria(bd, monkeypatch):
+    db_utils.guardar_propiedad(propiedad(1, propietario='Juana Pérez', direccion='Calle Independencia 10'))
+    db_utils.guardar_propiedad(propiedad(2, propietario='Juan Soto', direccion='Calle Independencia 20'))
+    db_utils.guardar_propiedad(propiedad(3, propietario='Juana Rojas', direccion='Pasaje Los Olmos 5'))
+    consultas = contar_llamadas(monkeypatch, 'buscar_candidatos')
+
+    assert len(db_utils.buscar_propiedades('juan')['datos']) == 3
+    refinada = db_utils.buscar_propiedades('juana')
+    assert len(consultas) == 1
+    assert sorted(fila['propietario'] for fila in refinada['datos']) == ['Juana Pérez', 'Juana Rojas']
+    assert [fila['propietario'] for fila in db_utils.buscar_propiedades('juana independencia')['datos']] == [
+        'Juana Pérez'
+    ]
+    assert len(consultas) == 1
+
+    # Lo refinado coincide con una búsqueda directa en la base
+    db_utils.cache_busquedas.clear()
+    directa = db_utils.buscar_propiedades('juana')
+    assert len(consultas) == 2
+    assert {fila['id'] for fila in directa['datos']} == {fila['id'] for fila in refinada['datos']}
+
+
+def test_escritura_invalida_los_candidatos(bd, monkeypatch):
+    db_utils.guardar_propiedad(propiedad(1, propietario='Juana Pérez'))
+    consultas = contar_llamadas(monkeypatch, 'buscar_candidatos')
+    assert len(db_utils.buscar_propiedades('juan')['datos']) == 1
+
+    db_utils.guardar_propiedad(propiedad(2, propietario='Juana Rojas'))
+    # Nueva generación: ni el término exacto ni su extensión salen de los candidatos anteriores
+    assert len(db_utils.buscar_propiedades('juana')['datos']) == 2
+    assert len(db_utils.buscar_propiedades('juan')['datos']) == 2
+    assert len(consultas) == 3
+
+
+def test_cache_elige_la_base_mas_acotada():
+    cache = db_utils.CacheBusquedas(maximo=3)
+    amplia = {'filas': [(1, '1', frozenset(), False, None)] * 5, 'completa': True}
+    acotada = {'filas': [(1, '1', frozenset(), False, None)] * 2, 'completa': True}
+    incompleta = {'filas': [], 'completa': False}
+    # Como en buscar_propiedades: se consulta (y fija la generación) antes de guardar
+    assert cache.obtener(1, ('', 'j')) == (None, False)
+    cache.guardar(1, ('', 'j'), amplia)
+    cache.guardar(1, ('', 'ju'), acotada)
+    cache.guardar(1, ('', 'jua'), incompleta)
+
+    assert cache.obtener(1, ('', 'ju')) == (acotada, True)
+    # Una búsqueda incompleta (más de RESULTADOS_MAXIMOS) no sirve de base para refinar
+    assert cache.obtener(1, ('', 'juana')) == (acotada, False)
+    assert cache.obtener(1, ('', 'pedro')) == (None, False)
+
+    # LRU: 'j' es la menos usada y sale al pasar del máximo
+    cache.guardar(1, ('', 'x'), amplia)
+    assert ('', 'j') not in cache.entradas and len(cache.entradas) == 3
+
+    # Otra generación vacía el caché, y no se guarda lo calculado con la anterior
+    assert cache.obtener(2, ('', 'ju')) == (None, False)
+    cache.guardar(1, ('', 'ju'), acotada)
+    assert not cache.entradas
+
+
+def test_paginas_se_sirven_del_cache_hasta_una_escritura(bd, monkeypatch):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(25))
+    consultas = contar_llamadas(monkeypatch, 'buscar_candidatos')
+
+    def todas_las_paginas():
+        paginas = [db_utils.buscar_propiedades('independencia', 10, desplazamiento) for desplazamiento in (0, 10, 20)]
+        return paginas, [fila['id'] for pagina in paginas for fila in pagina['datos']]
+
+    paginas, ids = todas_las_paginas()
+    assert [len(pagina['datos']) for pagina in paginas] == [10, 10, 5]
+    assert [pagina['hay_mas'] for pagina in paginas] == [True, True, False]
+    assert len(set(ids)) == 25
+    # Las páginas siguientes salen de los candidatos de la primera
+    assert len(consultas) == 1
+
+    # Una escritura cambia la generación: las mismas páginas se recalculan con los datos nuevos
+    db_utils.eliminar_propiedad_bd(ids[0])
+    nueva = db_utils.guardar_propiedad(propiedad(99))
+    _, ids_despues = todas_las_paginas()
+    assert len(consultas) == 2
+    assert sorted(ids_despues) == sorted(set(ids) - {ids[0]} | {nueva})
+
+
+def test_busqueda_amplia_se_limita(bd, monkeypatch):
+    monkeypatch.setattr(db_utils, 'RESULTADOS_MAXIMOS', 12)
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(30))
+    primera = db_utils.buscar_propiedades('independencia', 10)
+    assert primera['limitada'] and primera['hay_mas']
+    ultima = db_utils.buscar_propiedades('independencia', 10, 10)
+    assert len(ultima['datos']) == 2 and not ultima['hay_mas']
+
+
+def test_relevancia_pondera_las_columnas(solo_sqlite):
+    # bm25 con los pesos de COLUMNAS_TEXTO: propietario > dirección > observaciones
+    en_observaciones = db_utils.guardar_propiedad(propiedad(1, observaciones='Vecino de los olmos'))
+    en_direccion = db_utils.guardar_propiedad(propiedad(2, direccion='Pasaje Los Olmos 5'))
+    en_propietario = db_utils.guardar_propiedad(propiedad(3, propietario='Marta Olmos'))
+    datos = db_utils.buscar_propiedades('olmos')['datos']
+    assert [fila['id'] for fila in datos] == [en_propietario, en_direccion, en_observaciones]
+    assert [fila['relevancia'] for fila in datos] == sorted(fila['relevancia'] for fila in datos)
+    assert datos[0]['fragmento'] == 'Marta **Olmos**'
+
+
+def test_mas_coincidencias_ordenan_primero(bd):
+    una = db_utils.guardar_propiedad(propiedad(1, direccion='Pasaje Los Olmos 5'))
+    varias = db_utils.guardar_propiedad(propiedad(2, direccion='Pasaje Los Olmos 7', observaciones='olmos olmos'))
+    db_utils.guardar_propiedad(propiedad(3))
+    assert [fila['id'] for fila in db_utils.buscar_propiedades('olmos')['datos']] == [varias, una]
+
+
+def test_quiso_decir_tras_una_busqueda_sin_resultados(solo_sqlite):
+    olmos = db_utils.guardar_propiedad(propiedad(1, direccion='Pasaje Los Olmos 5'))
+    db_utils.guardar_propiedad(propiedad(2, direccion='Calle Olivos 10'))
+    db_utils.guardar_propiedad(propiedad(3, propietario='Olga Molina'))
+    # Como en app.py: las sugerencias se piden cuando la búsqueda no encuentra nada
+    assert db_utils.buscar_propiedades('pasaje olmso')['datos'] == []
+    assert db_utils.corregir_termino('pasaje olmso') == 'pasaje olmos'
+    sugerencias = db_utils.sugerir_propiedades('pasaje olmso')
+    assert [fila['id'] for fila in sugerencias] == [olmos]
+    assert sugerencias[0]['coincidencia'] == 'Pasaje Los Olmos 5'
+    assert db_utils.SIMILITUD_MINIMA <= sugerencias[0]['similitud'] < 1
+
+    # Un término bien escrito, o sin nada parecido en el vocabulario, no tiene sugerencias
+    assert db_utils.sugerir_propiedades('pasaje olmos') == []
+    assert db_utils.sugerir_propiedades('xyzzy') == []
+
+
+def test_indice_trigramas_tolera_un_caracter():
+    indice = db_utils.IndiceTrigramas([('independencia', 3), ('fernandez', 1), ('quilicura', 2), ('fernando', 1)])
+    for escrita in ('indepemdencia', 'independenca', 'independenciaa'):  # cambiada, faltante, sobrante
+        (similitud, corregida), = indice.corregir(escrita, 1)
+        assert corregida == 'independencia' and db_utils.SIMILITUD_MINIMA <= similitud < 1
+    assert indice.corregir('fernandes', 1)[0][1] == 'fernandez'
+    assert indice.corregir('quilicura') == [(1.0, 'quilicura')]
+    assert indice.corregir('valparaiso') == []
+
+
+@pytest.mark.parametrize('escrita', ['Rosalia Fernandes', 'Rosalía Ferández', 'rosallia fernandez'])
+def test_sugerencia_con_un_error_de_tipeo(bd, escrita):
+    buscada = db_utils.guardar_propiedad(propiedad(1, propietario='Rosalía Fernández'))
+    db_utils.guardar_propiedad(propiedad(2, propietario='Rosa Fuentes'))
+    db_utils.guardar_propiedad(propiedad(3, propietario='Fernando Ríos'))
+    sugerencias = db_utils.sugerir_propiedades(escrita)
+    assert sugerencias and sugerencias[0]['id'] == buscada
+    assert sugerencias[0]['coincidencia'] == 'Rosalía Fernández'
@@ -0,0 +1,98 @@
+"""Pruebas de las propiedades cercanas (árbol k-d en memoria de IndiceCercanas)"""
+import random
+
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def cercanas_por_fuerza_bruta(propiedad_id, k):
+    """Ids de las k propiedades más cercanas, comparando contra todas"""
+    filas = {fila['id']: fila for fila in db_utils.obtener_propiedades(1, 10000)['datos'] if fila['lat'] is not None}
+    origen = filas.pop(propiedad_id)
+    distancias = sorted(
+        (db_utils.distancia_metros(origen['lat'], origen['lon'], fila['lat'], fila['lon']), fila['id'])
+        for fila in filas.values()
+    )
+    return [propiedad_id for _, propiedad_id in distancias[:k]]
+
+
+def guardar_en(numero, lat, lon):
+    return db_utils.guardar_propiedad(propiedad(numero, coordenadas=f'{lat}, {lon}'))
+
+
+def test_cercanas_coincide_con_fuerza_bruta(bd):
+    azar = random.Random(1)
+    ids = [guardar_en(numero, -33.43 + azar.random() * 0.03, -70.67 + azar.random() * 0.03) for numero in range(120)]
+    for propiedad_id in ids[::17]:
+        vecinas = db_utils.cercanas(propiedad_id, 5)
+        assert [fila['id'] for fila in vecinas] == cercanas_por_fuerza_bruta(propiedad_id, 5)
+        distancias = [fila['distancia_m'] for fila in vecinas]
+        assert distancias == sorted(distancias)
+
+
+def test_cercanas_sin_coordenadas_o_inexistente(bd):
+    sin_coordenadas = db_utils.guardar_propiedad(propiedad(1, coordenadas=''))
+    guardar_en(2, -33.42, -70.66)
+    assert db_utils.cercanas(sin_coordenadas) == []
+    assert db_utils.cercanas(999) == []
+    with pytest.raises(ValueError):
+        db_utils.cercanas(sin_coordenadas, k=0)
+
+
+def test_cercanas_con_tabla_vacia_al_armar(bd):
+    # La primera sincronización no encuentra coordenadas; las siguientes deben proyectarlas igual
+    assert db_utils.cercanas(1) == []
+    origen = guardar_en(1, -33.4172, -70.6506)
+    # 0.0011° de longitud son ~102 m a esta latitud (y ~122 m proyectando en el ecuador); 0.001° de latitud, ~111 m
+    al_este = guardar_en(2, -33.4172, -70.6495)
+    al_sur = guardar_en(3, -33.4182, -70.6506)
+    vecinas = db_utils.cercanas(origen, 1)
+    assert [fila['id'] for fila in vecinas] == [al_este]
+    assert [fila['id'] for fila in db_utils.cercanas(origen, 2)] == [al_este, al_sur]
+    assert vecinas[0]['distancia_m'] == pytest.approx(102.1, abs=0.5)
+
+
+def test_cercanas_sigue_los_cambios(bd):
+    origen = guardar_en(1, -33.42, -70.66)
+    lejos = guardar_en(2, -33.43, -70.67)
+    assert [fila['id'] for fila in db_utils.cercanas(origen)] == [lejos]
+
+    # Agregada después de armar el árbol: queda entre las recientes
+    nueva = guardar_en(3, -33.4201, -70.6601)
+    assert [fila['id'] for fila in db_utils.cercanas(origen)] == [nueva, lejos]
+
+    # Sin coordenadas deja de ser vecina (también estando entre las recientes)
+    db_utils.actualizar_celdas({nueva: {'coordenadas': ''}})
+    assert [fila['id'] for fila in db_utils.cercanas(origen)] == [lejos]
+
+    # Movida más cerca
+    db_utils.actualizar_celdas({lejos: {'coordenadas': '-33.4202, -70.6602'}})
+    assert [fila['id'] for fila in db_utils.cercanas(origen)] == [lejos]
+
+    # Eliminada
+    db_utils.eliminar_propiedad_bd(lejos)
+    assert db_utils.cercanas(origen) == []
+
+
+def test_indice_cercanas_rearma_con_muchos_cambios(monkeypatch):
+    monkeypatch.setattr(db_utils.IndiceCercanas, 'MAXIMO_PENDIENTES', 8)
+    azar = random.Random(2)
+    indice = db_utils.IndiceCercanas()
+    indice.lat_referencia = -33.42
+    indice.actualizar([(i, -33.43 + azar.random() * 0.03, -70.67 + azar.random() * 0.03) for i in range(200)])
+    assert not indice.recientes and not indice.descartadas
+    # Movidas y quitadas por debajo del máximo de pendientes
+    indice.actualizar([(i, -33.43 + azar.random() * 0.03, -70.67 + azar.random() * 0.03) for i in range(3)])
+    indice.actualizar([(3, None, None), (4, None, None)])
+    indice.descartar(5)
+    assert indice.recientes == {0, 1, 2}
+
+    for propiedad_id in (0, 10, 150):
+        x, y = indice.puntos[propiedad_id]
+        esperadas = sorted(
+            ((ox - x) ** 2 + (oy - y) ** 2, otra) for otra, (ox, oy) in indice.puntos.items() if otra != propiedad_id
+        )[:6]
+        assert indice.vecinos(propiedad_id, 6) == esperadas
+    assert indice.vecinos(3, 6) == []
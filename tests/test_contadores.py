@@ -0,0 +1,85 @@
+"""Pruebas de los contadores de propiedades mantenidos por triggers (conteos_propiedades)"""
+import random
+
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def conteos_reales(columna):
+    """Totales por valor de una categoría calculados recorriendo la tabla"""
+    conteos = {}
+    for fila in db_utils.obtener_propiedades(1, 10000)['datos']:
+        valor = fila[columna] or ''
+        conteos[valor] = conteos.get(valor, 0) + 1
+    return conteos
+
+
+def verificar_contadores():
+    assert db_utils.obtener_total_propiedades() == len(db_utils.obtener_propiedades(1, 10000)['datos'])
+    for columna in db_utils.CATEGORIAS_CONTEO:
+        assert db_utils.obtener_conteos_categoria(columna) == conteos_reales(columna)
+
+
+def test_contadores_siguen_las_escrituras(bd):
+    azar = random.Random(3)
+    fiscalizacion = ['CONSTRUCCION REGULARIZADA', 'CONSTRUCCION IRREGULAR', 'SIN FISCALIZAR', None]
+    db_utils.guardar_propiedades_lote(
+        propiedad(numero, fiscalizacion_dom=azar.choice(fiscalizacion)) for numero in range(40)
+    )
+    verificar_contadores()
+
+    ids = [fila['id'] for fila in db_utils.obtener_propiedades(1, 100)['datos']]
+    db_utils.actualizar_celdas({
+        propiedad_id: {'fiscalizacion_dom': azar.choice(fiscalizacion[:3]), 'destino_sii': 'Comercio'}
+        for propiedad_id in ids[:15]
+    })
+    # Un UPSERT sobre una existente actualiza, no suma
+    db_utils.guardar_propiedad(propiedad(0, patente_comercial='PATENTE AL DIA'))
+    for propiedad_id in ids[-5:]:
+        db_utils.eliminar_propiedad_bd(propiedad_id)
+    verificar_contadores()
+    assert db_utils.obtener_total_propiedades() == 35
+
+
+def test_valores_vacios_se_agrupan(bd):
+    db_utils.guardar_propiedad(propiedad(1, destino_dom=None))
+    db_utils.guardar_propiedad(propiedad(2, destino_dom=''))
+    assert db_utils.obtener_conteos_categoria('destino_dom') == {'': 2}
+
+
+def test_conteos_con_filtros(bd):
+    db_utils.guardar_propiedades_lote(
+        propiedad(
+            numero,
+            destino_sii='Comercio' if numero % 2 else 'Habitacional',
+            patente_comercial=['PATENTE AL DIA', 'SIN PATENTE', None][numero % 3],
+        )
+        for numero in range(60)
+    )
+    # Todas las filtradas, aunque superen una página de obtener_propiedades
+    assert db_utils.obtener_conteos_categoria('patente_comercial', {'destino_sii': ['Comercio']}) == {
+        'PATENTE AL DIA': 10, 'SIN PATENTE': 10, '': 10,
+    }
+    assert db_utils.obtener_conteos_categoria('destino_sii', {'avaluo_total': (1000000, 1000009)}) == {
+        'Comercio': 5, 'Habitacional': 5,
+    }
+    # Filtros vacíos equivalen a ninguno (se leen los contadores)
+    assert db_utils.obtener_conteos_categoria('patente_comercial', {'destino_sii': []}) == \
+        db_utils.obtener_conteos_categoria('patente_comercial') == {'PATENTE AL DIA': 20, 'SIN PATENTE': 20, '': 20}
+
+
+def test_contadores_se_llenan_con_datos_existentes(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(7))
+    with db_utils.get_db_connection() as conn:
+        conn.cursor().execute("DELETE FROM conteos_propiedades WHERE categoria <> 'generacion'")
+        conn.commit()
+    assert db_utils.obtener_total_propiedades() == 0
+    assert db_utils.init_db()
+    verificar_contadores()
+
+
+def test_categoria_sin_contador(bd):
+    with pytest.raises(ValueError):
+        db_utils.obtener_conteos_categoria('propietario')
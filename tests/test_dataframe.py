@@ -0,0 +1,58 @@
+"""Pruebas de obtener_propiedades_df (lectura por columnas con tipos explícitos)"""
+import pandas as pd
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def test_tipos_de_las_columnas(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(3))
+    db_utils.guardar_propiedad(propiedad(3, ano_construccion=None, coordenadas='', destino_sii=None))
+    df = db_utils.obtener_propiedades_df()
+    for columna, tipo in db_utils.TIPOS_DATAFRAME.items():
+        assert str(df[columna].dtype) == tipo, columna
+    assert not any(columna.endswith('_norm') for columna in df.columns)
+
+    # Los nulos quedan como faltantes del tipo, no como None en una columna object
+    sin_datos = df[df['rol_propiedad'] == '0-3'].iloc[0]
+    assert sin_datos['ano_construccion'] is pd.NA
+    assert pd.isna(sin_datos['lat']) and pd.isna(sin_datos['lon'])
+    # Una categoría por valor distinto (el formulario guarda '' en vez de nulo)
+    assert sorted(df['destino_sii'].cat.categories) == ['', 'Habitacional']
+
+
+def test_mismo_contenido_que_obtener_propiedades(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(12))
+    filas = db_utils.obtener_propiedades(1, 12)['datos']
+    df = db_utils.obtener_propiedades_df(con_fotos=True)
+    assert df['id'].tolist() == [fila['id'] for fila in filas]
+    assert df['avaluo_total'].tolist() == [fila['avaluo_total'] for fila in filas]
+    assert df['fiscalizacion_dom'].astype(str).tolist() == [fila['fiscalizacion_dom'] for fila in filas]
+    assert df['Fotos'].tolist() == [[] for _ in filas]
+
+
+def test_lee_por_lotes(bd, monkeypatch):
+    monkeypatch.setattr(db_utils, 'LOTE_DATAFRAME', 4)
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(10))
+    df = db_utils.obtener_propiedades_df(columnas=['avaluo_total'])
+    assert list(df.columns) == ['avaluo_total']
+    assert sorted(df['avaluo_total']) == [1000000 + numero for numero in range(10)]
+
+
+def test_texto_en_columna_numerica(bd):
+    if bd.nombre != 'sqlite':
+        pytest.skip("PostgreSQL impone el tipo de la columna")
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1))
+    with db_utils.get_db_connection() as conn:
+        conn.cursor().execute("UPDATE propiedades SET m2_terreno = 'sin dato' WHERE id = ?", (propiedad_id,))
+        conn.commit()
+    df = db_utils.obtener_propiedades_df(columnas=['m2_terreno'])
+    assert df['m2_terreno'].dtype == 'float64' and pd.isna(df['m2_terreno'].iloc[0])
+
+
+def test_columnas_no_admitidas(bd, avisos):
+    df = db_utils.obtener_propiedades_df(columnas=['rut', 'rut_norm'])
+    assert df.empty and list(df.columns) == ['rut', 'rut_norm']
+    assert len(avisos.errores) == 1 and 'Columnas no admitidas' in avisos.errores[0]
+    avisos.errores.clear()
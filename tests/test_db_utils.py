@@ -0,0 +1,365 @@
+"""Pruebas de la API de db_utils, en SQLite y PostgreSQL (fixture `bd`)"""
+import pandas as pd
+import pytest
+
+import db_utils
+from conftest import propiedad, reiniciar_base
+
+
+def guardar(*numeros, **valores):
+    """Guarda las propiedades de prueba indicadas y devuelve sus ids"""
+    return [db_utils.guardar_propiedad(propiedad(numero, **valores)) for numero in numeros]
+
+
+def test_init_db_es_idempotente(bd):
+    guardar(1)
+    assert db_utils.init_db()
+    assert db_utils.obtener_total_propiedades() == 1
+
+
+def test_guardar_y_leer_propiedad(bd):
+    propiedad_id, = guardar(1, observaciones='Esquina')
+    datos = db_utils.obtener_propiedades(1, 10)['datos']
+    assert [fila['id'] for fila in datos] == [propiedad_id]
+    fila = datos[0]
+    assert fila['rut'] == '10000001-1'
+    assert fila['observaciones'] == 'Esquina'
+    assert fila['lat'] == pytest.approx(-33.4101)
+    assert fila['lon'] == pytest.approx(-70.6601)
+    assert fila['Fotos'] == [] and fila['Miniatura'] is None
+    # Las columnas normalizadas son de uso interno
+    assert not any(columna.endswith('_norm') for columna in fila)
+
+
+def test_guardar_con_claves_del_formulario(bd):
+    formulario = {clave: propiedad(1).get(columna, defecto) for columna, clave, defecto in db_utils.COLUMNAS_PROPIEDAD}
+    propiedad_id = db_utils.guardar_propiedad(formulario)
+    assert db_utils.obtener_propiedades()['datos'][0]['id'] == propiedad_id
+
+
+def test_guardar_mismo_rut_en_otro_formato_actualiza(bd):
+    propiedad_id, = guardar(1)
+    otra = db_utils.guardar_propiedad(propiedad(1, rut='10.000.001-1', propietario='Nuevo Dueño'))
+    assert otra == propiedad_id
+    assert db_utils.obtener_total_propiedades() == 1
+    assert db_utils.obtener_propiedades()['datos'][0]['propietario'] == 'Nuevo Dueño'
+
+
+def test_guardar_por_id_actualiza_la_fila(bd):
+    propiedad_id, = guardar(1)
+    assert db_utils.guardar_propiedad(propiedad(1, id=propiedad_id, rol_propiedad='9-9')) == propiedad_id
+    assert db_utils.obtener_propiedades()['datos'][0]['rol_propiedad'] == '9-9'
+
+
+def test_guardar_propiedades_lote(bd):
+    resumen = db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(20))
+    assert resumen == {'procesadas': 20, 'insertadas': 20, 'actualizadas': 0}
+    resumen = db_utils.guardar_propiedades_lote(propiedad(numero, avaluo_total=5) for numero in range(15, 25))
+    assert resumen == {'procesadas': 10, 'insertadas': 5, 'actualizadas': 5}
+    assert db_utils.obtener_total_propiedades() == 25
+
+
+def test_actualizar_celdas(bd):
+    primera, segunda = guardar(1, 2)
+    resumen = db_utils.actualizar_celdas({
+        primera: {'propietario': 'Av. Independencia', 'Fotos': []},
+        segunda: {'coordenadas': '-33.5, -70.5'},
+    })
+    assert resumen['propiedades'] == 2
+    assert resumen['ignoradas'] == ['Fotos']
+    por_id = {fila['id']: fila for fila in db_utils.obtener_propiedades()['datos']}
+    assert por_id[primera]['propietario'] == 'Av. Independencia'
+    assert (por_id[segunda]['lat'], por_id[segunda]['lon']) == (-33.5, -70.5)
+    # La columna normalizada se recalcula junto con su origen
+    assert db_utils.obtener_propiedades(filtros={'propietario': 'avenida indep'})['total'] == 1
+
+
+def test_actualizar_celdas_con_columnas_mezcladas(bd):
+    primera, segunda, tercera, cuarta = guardar(1, 2, 3, 4)
+    resumen = db_utils.actualizar_celdas({
+        primera: {'propietario': 'Ana Rojas', 'avaluo_total': 7},
+        segunda: {'avaluo_total': 8},
+        tercera: {'rut': '20.000.003-3', 'id': 99, 'fecha_creacion': None, 'rut = NULL; --': 'x'},
+        cuarta: {'version': 50},
+    })
+    # Solo columnas de COLUMNAS_PROPIEDAD; el resto se informa y nunca llega al SQL
+    assert resumen == {
+        'propiedades': 3, 'celdas': 4, 'conflictos': [], 'versiones': {},
+        'ignoradas': ['fecha_creacion', 'id', 'rut = NULL; --', 'version'],
+    }
+    por_id = {fila['id']: fila for fila in db_utils.obtener_propiedades()['datos']}
+    assert (por_id[primera]['propietario'], por_id[primera]['avaluo_total']) == ('Ana Rojas', 7)
+    assert (por_id[segunda]['propietario'], por_id[segunda]['avaluo_total']) == ('Propietario 2', 8)
+    assert por_id[tercera]['rut'] == '20.000.003-3' and 99 not in por_id
+    assert db_utils.obtener_propiedades(filtros={'rut': ['200000033']})['datos'][0]['id'] == tercera
+    assert [por_id[propiedad_id]['version'] for propiedad_id in (primera, segunda, tercera, cuarta)] == [2, 2, 2, 1]
+
+
+def test_actualizar_celdas_devuelve_las_versiones_nuevas(bd):
+    primera, segunda, tercera = guardar(1, 2, 3)
+    db_utils.actualizar_celdas({segunda: {'observaciones': 'antes'}})
+    resumen = db_utils.actualizar_celdas(
+        {
+            primera: {'observaciones': 'a', 'avaluo_total': 1},
+            segunda: {'observaciones': 'b'},
+            tercera: {'observaciones': 'c'},
+        },
+        versiones={primera: 1, segunda: 2},
+    )
+    # Sin versión leída (tercera) se escribe sin comprobarla y no aparece en el mapa
+    assert resumen['versiones'] == {primera: 2, segunda: 3}
+    assert resumen['conflictos'] == [] and resumen['propiedades'] == 3 and resumen['celdas'] == 4
+    versiones = {fila['id']: fila['version'] for fila in db_utils.obtener_propiedades()['datos']}
+    assert versiones == {primera: 2, segunda: 3, tercera: 2}
+
+
+def test_fotos(bd):
+    propiedad_id, = guardar(1)
+    assert db_utils.guardar_fotos(propiedad_id, ['a.jpg', 'b.jpg'])
+    assert db_utils.obtener_fotos(propiedad_id) == ['a.jpg', 'b.jpg']
+    fila = db_utils.obtener_propiedades()['datos'][0]
+    assert fila['Fotos'] == ['a.jpg', 'b.jpg'] and fila['Miniatura'] == 'a.jpg'
+    assert db_utils.guardar_fotos(propiedad_id, ['c.jpg'])
+    assert db_utils.obtener_fotos(propiedad_id) == ['c.jpg']
+
+
+def test_eliminar_propiedad(bd):
+    propiedad_id, otra = guardar(1, 2)
+    db_utils.guardar_fotos(propiedad_id, ['a.jpg'])
+    assert db_utils.eliminar_propiedad_bd(propiedad_id) == ['a.jpg']
+    assert db_utils.obtener_fotos(propiedad_id) == []
+    assert [fila['id'] for fila in db_utils.obtener_propiedades()['datos']] == [otra]
+    assert db_utils.obtener_total_propiedades() == 1
+
+
+def test_resumen_propietario(bd):
+    guardar(1)
+    db_utils.guardar_propiedad(propiedad(1, rol_propiedad='7-7', avaluo_total=10))
+    resumen = db_utils.resumen_propietario('10.000.001-1')
+    assert resumen['propiedades'] == 2
+    assert resumen['avaluo_total'] == 1000001 + 10
+    assert db_utils.resumen_propietario('99999999-9') is None
+    assert db_utils.resumen_propietario('') is None
+
+
+def test_obtener_propiedades_pagina_y_filtros(bd):
+    db_utils.guardar_propiedades_lote(
+        propiedad(numero, destino_sii='Comercio' if numero % 3 == 0 else 'Habitacional') for numero in range(25)
+    )
+    pagina = db_utils.obtener_propiedades(2, 10)
+    assert pagina['total'] == 25 and pagina['total_paginas'] == 3
+    assert len(pagina['datos']) == 10
+    # Más recientes primero (el id desempata las creadas en el mismo instante)
+    ids = [fila['id'] for fila in db_utils.obtener_propiedades(1, 25)['datos']]
+    assert ids == sorted(ids, reverse=True)
+
+    comercio = db_utils.obtener_propiedades(1, 5, {'destino_sii': ['Comercio']})
+    assert comercio['total'] == 9 and len(comercio['datos']) == 5
+    assert all(fila['destino_sii'] == 'Comercio' for fila in comercio['datos'])
+    fuera_de_rango = db_utils.obtener_propiedades(5, 5, {'destino_sii': ['Comercio']})
+    assert fuera_de_rango['datos'] == [] and fuera_de_rango['total'] == 9
+
+    rango = db_utils.obtener_propiedades(1, 50, {'avaluo_total': (1000010, 1000014)})
+    assert sorted(fila['avaluo_total'] for fila in rango['datos']) == [1000010, 1000011, 1000012, 1000013, 1000014]
+
+
+def test_total_filtrado(bd):
+    db_utils.guardar_propiedades_lote(
+        propiedad(numero, destino_dom=[None, '', 'Comercial'][numero % 3]) for numero in range(12)
+    )
+
+    def total(filtros):
+        return db_utils.obtener_propiedades(1, 2, filtros)['total']
+
+    # Un filtro de categoría se cuenta con conteos_propiedades; los demás con COUNT(*)
+    assert total({'destino_dom': ['']}) == 8
+    assert total({'destino_dom': 'Comercial', 'rut': ''}) == 4
+    assert total({'destino_dom': ['Comercial', '', 'Comercial']}) == 12
+    assert total({'destino_dom': ['Comercial'], 'avaluo_total': (1000006, None)}) == 2
+    assert total({'propietario': 'propietario 1'}) == 3
+
+
+def test_pagina_filtrada_usa_el_indice(bd):
+    if bd.nombre != 'sqlite':
+        pytest.skip("Plan de consulta de SQLite")
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(5))
+    sentencias = []
+    # Un solo hilo: el pool vuelve a prestar la misma conexión
+    conn = bd.adquirir()
+    conn.set_trace_callback(sentencias.append)
+    bd.liberar(conn)
+    db_utils.obtener_propiedades(1, 2, {'fiscalizacion_dom': ['SIN FISCALIZAR']})
+    conn.set_trace_callback(None)
+    pagina, = [sentencia for sentencia in sentencias if 'LIMIT' in sentencia]
+    plan = ' '.join(fila[3] for fila in conn.execute('EXPLAIN QUERY PLAN ' + pagina))
+    assert 'TEMP B-TREE' not in plan and 'idx_propiedades_fiscalizacion_dom_fecha' in plan
+
+
+def test_obtener_propiedades_df(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(5))
+    df = db_utils.obtener_propiedades_df(filtros={'avaluo_total': (1000002, None)},
+                                         columnas=['rut', 'avaluo_total'], con_fotos=True)
+    assert list(df.columns) == ['rut', 'avaluo_total', 'Fotos', 'Miniatura']
+    assert len(df) == 3
+    vacio = db_utils.obtener_propiedades_df(filtros={'avaluo_total': (0, 1)})
+    assert isinstance(vacio, pd.DataFrame) and vacio.empty
+
+
+def test_buscar_propiedades(bd):
+    guardar(1, propietario='Juana Pérez', direccion='Av. Independencia 123')
+    guardar(2, propietario='Pedro Soto', direccion='Pasaje Los Olmos 45')
+
+    por_nombre = db_utils.buscar_propiedades('perez')
+    assert [fila['propietario'] for fila in por_nombre['datos']] == ['Juana Pérez']
+    assert '**Pérez**' in por_nombre['datos'][0]['fragmento']
+    # Abreviatura expandida y última palabra como prefijo
+    assert [fila['propietario'] for fila in db_utils.buscar_propiedades('avenida indep')['datos']] == ['Juana Pérez']
+    por_rut = db_utils.buscar_propiedades('10.000.002')
+    assert [fila['propietario'] for fila in por_rut['datos']] == ['Pedro Soto']
+    assert db_utils.buscar_propiedades('inexistente')['datos'] == []
+
+
+def test_buscar_propiedades_ve_las_escrituras(bd):
+    guardar(1, propietario='Juana Pérez')
+    assert len(db_utils.buscar_propiedades('juana')['datos']) == 1
+    guardar(2, propietario='Juana Rojas')
+    assert len(db_utils.buscar_propiedades('juana')['datos']) == 2
+
+
+def test_propiedades_en_area(bd):
+    cerca, lejos = guardar(1, coordenadas='-33.4172, -70.6650'), guardar(2, coordenadas='-33.5, -70.5')
+    guardar(3, coordenadas='')
+    en_bbox = db_utils.propiedades_en_bbox(-33.42, -70.67, -33.41, -70.66)
+    assert [fila['id'] for fila in en_bbox] == cerca
+    en_radio = db_utils.propiedades_en_radio(-33.4172, -70.6651, 100)
+    assert [fila['id'] for fila in en_radio] == cerca
+    assert en_radio[0]['distancia_m'] == pytest.approx(9.3, abs=0.5)
+    cuadrado = [(-33.6, -70.6), (-33.4, -70.6), (-33.4, -70.4), (-33.6, -70.4)]
+    assert [fila['id'] for fila in db_utils.propiedades_en_poligono(cuadrado)] == lejos
+
+
+def test_generacion_cambia_con_cada_escritura(bd):
+    inicial = db_utils.generacion_datos()
+    propiedad_id, = guardar(1)
+    despues_de_insertar = db_utils.generacion_datos()
+    assert despues_de_insertar > inicial
+    db_utils.actualizar_celdas({propiedad_id: {'observaciones': 'x'}})
+    assert db_utils.generacion_datos() > despues_de_insertar
+
+
+def test_autocompletar(bd):
+    guardar(1, propietario='Juana Pérez', direccion='Av. Independencia 123')
+    guardar(2, propietario='Juan Soto', direccion='Av. Independencia 456')
+    sugerencias = db_utils.autocompletar('av. indep')
+    assert sugerencias == [{'tipo': 'Calle', 'texto': 'Av. Independencia'}]
+    propietarios = [s['texto'] for s in db_utils.autocompletar('juan') if s['tipo'] == 'Propietario']
+    assert propietarios == ['Juan Soto', 'Juana Pérez']
+
+
+def test_valores_distintos(bd):
+    guardar(1, propietario='Juana Pérez')
+    guardar(2, propietario='JUANA PEREZ')
+    guardar(3, propietario='Pedro Soto')
+    assert len(db_utils.valores_distintos('propietario')) == 2
+    assert db_utils.valores_distintos('rol_propiedad') == ['0-1', '0-2', '0-3']
+    with pytest.raises(ValueError):
+        db_utils.valores_distintos('observaciones')
+
+
+def contar_consultas_de_prefijo(monkeypatch):
+    """Registra los prefijos que _autocompletar resuelve en la base (fuera del caché)"""
+    consultados = []
+    original = db_utils.valores_con_prefijo
+
+    def registrar(cursor, columna, visible, prefijo, limite):
+        consultados.append(prefijo)
+        return original(cursor, columna, visible, prefijo, limite)
+    monkeypatch.setattr(db_utils, 'valores_con_prefijo', registrar)
+    return consultados
+
+
+def test_autocompletar_usa_el_cache_hasta_una_escritura(bd, monkeypatch):
+    guardar(1, propietario='Juana Pérez')
+    consultados = contar_consultas_de_prefijo(monkeypatch)
+    assert [s['texto'] for s in db_utils.autocompletar('juan')] == ['Juana Pérez']
+    consultas = len(consultados)
+    assert consultas > 0
+    assert [s['texto'] for s in db_utils.autocompletar('juan')] == ['Juana Pérez']
+    assert len(consultados) == consultas
+
+    # La escritura cambia la generación: el mismo prefijo se vuelve a consultar y ve el valor nuevo
+    guardar(2, propietario='Juan Soto')
+    assert [s['texto'] for s in db_utils.autocompletar('juan')] == ['Juan Soto', 'Juana Pérez']
+    assert len(consultados) > consultas
+
+
+def test_autocompletar_guarda_hasta_512_prefijos(bd, monkeypatch):
+    guardar(1)
+    consultados = contar_consultas_de_prefijo(monkeypatch)
+    prefijos = [f'calle {numero}' for numero in range(513)]
+    db_utils.autocompletar(prefijos[0])
+    for prefijo in prefijos[1:512]:
+        db_utils.autocompletar(prefijo)
+    # Con 512 entradas, el primero sigue en caché
+    del consultados[:]
+    db_utils.autocompletar(prefijos[0])
+    assert consultados == []
+
+    # El 513.º desplaza al menos usado (prefijos[1]), no al recién consultado
+    db_utils.autocompletar(prefijos[512])
+    del consultados[:]
+    db_utils.autocompletar(prefijos[0])
+    assert consultados == []
+    db_utils.autocompletar(prefijos[1])
+    assert consultados
+
+
+def test_valores_distintos_tras_una_escritura(bd):
+    guardar(1, propietario='Juana Pérez')
+    assert db_utils.valores_distintos('propietario') == ['Juana Pérez']
+    propiedad_id, = guardar(2, propietario='Pedro Soto')
+    assert db_utils.valores_distintos('propietario') == ['Juana Pérez', 'Pedro Soto']
+    db_utils.actualizar_celdas({propiedad_id: {'propietario': 'Ana Rojas'}})
+    assert db_utils.valores_distintos('propietario') == ['Ana Rojas', 'Juana Pérez']
+    assert db_utils.valores_distintos('rol_propiedad') == ['0-1', '0-2']
+
+
+def test_sugerir_propiedades(bd):
+    guardar(1, propietario='Juana Pérez', direccion='Avenida Independencia 123')
+    guardar(2, propietario='Pedro Soto', direccion='Pasaje Los Olmos 45')
+    sugerencias = db_utils.sugerir_propiedades('indepndencia')
+    assert [fila['propietario'] for fila in sugerencias] == ['Juana Pérez']
+    assert sugerencias[0]['coincidencia'] == 'Avenida Independencia 123'
+
+
+def test_migraciones_unen_las_propiedades_repetidas(bd, avisos):
+    # Base anterior a la migración 5: la misma propiedad con el RUT en otros formatos
+    bd = reiniciar_base(bd, migraciones=4)
+    with db_utils.get_db_connection() as conn:
+        cursor = conn.cursor()
+        for rut, avaluo in (('10000001-1', 1), ('10.000.001-1', 2), ('10.000.001-1 ', 3)):
+            cursor.execute(
+                "INSERT INTO propiedades (rut, propietario, direccion, rol_propiedad, avaluo_total) "
+                "VALUES (?, 'Propietario 1', 'Avenida Independencia 1001', '0-1', ?)",
+                (rut, avaluo)
+            )
+        cursor.execute('SELECT MIN(id), MAX(id) FROM propiedades')
+        primera, conservada = cursor.fetchone()
+        cursor.execute("INSERT INTO fotos (propiedad_id, ruta_archivo) VALUES (?, 'a.jpg')", (primera,))
+        conn.commit()
+
+    assert db_utils.init_db()
+    # La capa de datos no muestra avisos; la aplicación los pide con propiedades_duplicadas_archivadas
+    assert avisos.advertencias == []
+    assert db_utils.propiedades_duplicadas_archivadas() == 2
+    assert db_utils.obtener_total_propiedades() == 1
+    fila, = db_utils.obtener_propiedades()['datos']
+    assert (fila['id'], fila['avaluo_total'], fila['Fotos']) == (conservada, 3, ['a.jpg'])
+
+    # Sin la restricción UNIQUE(rut, rol_propiedad) original, otro formato actualiza la misma fila
+    assert db_utils.guardar_propiedad(propiedad(1, rut='10000001 1')) == conservada
+    resumen = db_utils.guardar_propiedades_lote([propiedad(1, rut='10.000.001-1'), propiedad(2)])
+    assert resumen == {'procesadas': 2, 'insertadas': 1, 'actualizadas': 1}
+    with pytest.raises(db_utils.ERRORES_BD):
+        with db_utils.get_db_connection() as conn:
+            conn.cursor().execute('UPDATE propiedades SET rut_norm = NULL')
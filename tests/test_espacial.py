@@ -0,0 +1,71 @@
+"""Pruebas de las columnas lat/lon, el índice espacial y propiedades_en_bbox"""
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def ids_en_bbox(*limites, **opciones):
+    return sorted(fila['id'] for fila in db_utils.propiedades_en_bbox(*limites, **opciones))
+
+
+def test_lat_lon_se_calculan_desde_coordenadas(bd):
+    textos = ['-33.45, -70.66', '(-33.46,-70.67)', 'sin coordenadas', '-95, -70', '']
+    ids = [db_utils.guardar_propiedad(propiedad(numero, coordenadas=texto)) for numero, texto in enumerate(textos)]
+    por_id = {fila['id']: (fila['lat'], fila['lon']) for fila in db_utils.obtener_propiedades(1, 10)['datos']}
+    assert [por_id[propiedad_id] for propiedad_id in ids] == [
+        (-33.45, -70.66), (-33.46, -70.67), (None, None), (None, None), (None, None),
+    ]
+
+
+def test_indice_espacial_sigue_las_escrituras(bd):
+    dentro = db_utils.guardar_propiedad(propiedad(1, coordenadas='-33.45, -70.66'))
+    fuera = db_utils.guardar_propiedad(propiedad(2, coordenadas='-33.60, -70.80'))
+    sin_coordenadas = db_utils.guardar_propiedad(propiedad(3, coordenadas=''))
+    area = (-33.5, -70.7, -33.4, -70.6)
+    assert ids_en_bbox(*area) == [dentro]
+
+    db_utils.actualizar_celdas({
+        fuera: {'coordenadas': '-33.41, -70.61'},
+        sin_coordenadas: {'coordenadas': '-33.42, -70.62'},
+    })
+    assert ids_en_bbox(*area) == sorted([dentro, fuera, sin_coordenadas])
+    db_utils.actualizar_celdas({dentro: {'coordenadas': ''}})
+    db_utils.eliminar_propiedad_bd(fuera)
+    assert ids_en_bbox(*area) == [sin_coordenadas]
+
+    if bd.nombre == 'sqlite':
+        with db_utils.get_db_connection() as conn:
+            assert conn.execute('SELECT id FROM propiedades_rtree').fetchall() == [(sin_coordenadas,)]
+
+
+def test_bbox_con_filtros_y_limite(bd):
+    db_utils.guardar_propiedades_lote(
+        propiedad(numero, destino_sii='Comercio' if numero % 2 else 'Habitacional') for numero in range(10)
+    )
+    area = (-33.42, -70.67, -33.40, -70.65)
+    assert len(ids_en_bbox(*area)) == 10
+    assert len(ids_en_bbox(*area, filtros={'destino_sii': ['Comercio']})) == 5
+    assert len(ids_en_bbox(*area, limite=3)) == 3
+    # Los bordes del rectángulo se incluyen (el R*Tree redondea hacia afuera y se confirma con lat/lon)
+    assert len(ids_en_bbox(-33.4101, -70.6601, -33.4101, -70.6601)) == 1
+
+
+def test_base_sin_lat_lon_se_completa(bd):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1, coordenadas='-33.45, -70.66'))
+    db_utils.guardar_propiedad(propiedad(2, coordenadas='no válida'))
+    # Base anterior a las columnas lat/lon: solo el texto de coordenadas
+    with db_utils.get_db_connection() as conn:
+        cursor = conn.cursor()
+        if bd.nombre == 'sqlite':
+            for operacion in ('insert', 'update', 'delete'):
+                cursor.execute(f'DROP TRIGGER trg_rtree_{operacion}')
+            cursor.execute('DELETE FROM propiedades_rtree')
+        for columna in ('lat', 'lon'):
+            cursor.execute(f'ALTER TABLE propiedades DROP COLUMN {columna}')
+        conn.commit()
+
+    assert db_utils.init_db()
+    fila = next(fila for fila in db_utils.obtener_propiedades()['datos'] if fila['id'] == propiedad_id)
+    assert (fila['lat'], fila['lon']) == (pytest.approx(-33.45), pytest.approx(-70.66))
+    assert ids_en_bbox(-33.5, -70.7, -33.4, -70.6) == [propiedad_id]
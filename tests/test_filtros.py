@@ -0,0 +1,99 @@
+"""Pruebas de los filtros por columna (compilar_filtros y las listas de valores de la barra lateral)"""
+from datetime import date, datetime
+
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def ejecutar(sql, params=()):
+    """Escribe directo en la base, como lo haría una migración o un dato heredado"""
+    with db_utils.get_db_connection() as conn:
+        conn.cursor().execute(sql, params)
+        conn.commit()
+
+
+def ids_filtrados(filtros):
+    return sorted(fila['id'] for fila in db_utils.obtener_propiedades(1, 100, filtros)['datos'])
+
+
+def test_valor_con_espacios_sigue_filtrando(bd):
+    con_espacios = db_utils.guardar_propiedad(propiedad(1, rol_propiedad=' 12-3 '))
+    db_utils.guardar_propiedad(propiedad(2))
+    opciones = db_utils.valores_distintos('rol_propiedad')
+    assert ' 12-3 ' in opciones
+    assert ids_filtrados({'rol_propiedad': [' 12-3 ']}) == [con_espacios]
+
+
+def test_rut_en_otro_formato_aparece_y_filtra(bd):
+    repetida = db_utils.guardar_propiedad(propiedad(1, rut='11.111.111-1'))
+    otra = db_utils.guardar_propiedad(propiedad(2))
+
+    assert db_utils.valores_distintos('rut') == ['10000002-2', '11.111.111-1']
+    assert ids_filtrados({'rut': ['11.111.111-1']}) == [repetida]
+    assert ids_filtrados({'rut': ['111111111']}) == [repetida]
+    assert ids_filtrados({'rut': '1111111'}) == [repetida]
+    assert ids_filtrados({'rut': ['10000002-2']}) == [otra]
+
+
+def test_valores_distintos_agrupa_por_valor_normalizado(bd):
+    db_utils.guardar_propiedad(propiedad(1, propietario='María Soto'))
+    db_utils.guardar_propiedad(propiedad(2, propietario='MARIA SOTO'))
+    db_utils.guardar_propiedad(propiedad(3, propietario='Ana Rojas'))
+    opciones = db_utils.valores_distintos('propietario')
+    assert len(opciones) == 2 and opciones[0] == 'Ana Rojas'
+    assert len(ids_filtrados({'propietario': [opciones[1]]})) == 2
+
+
+@pytest.mark.parametrize('filtros', [
+    {'id; DROP TABLE propiedades': 'x'},
+    {'observaciones': 'x'},
+    {'avaluo_total': 5},
+    {'avaluo_total': (1, 2, 3)},
+    {'avaluo_total': ('1000', None)},
+    {'m2_terreno': (True, None)},
+    {'fecha_creacion': ('ayer', None)},
+])
+def test_filtros_rechazados(bd, avisos, filtros):
+    with pytest.raises(ValueError):
+        db_utils.compilar_filtros(filtros)
+    # Las consultas informan el error y no devuelven filas
+    db_utils.guardar_propiedad(propiedad(1))
+    assert db_utils.obtener_propiedades(1, 10, filtros)['datos'] == []
+    assert db_utils.obtener_propiedades_cursor(None, 10, filtros)['datos'] == []
+    assert len(avisos.errores) == 2
+    avisos.errores.clear()
+
+
+def test_filtros_vacios_se_ignoran(bd):
+    condiciones, params = db_utils.compilar_filtros(
+        {'rut': '', 'destino_sii': [], 'avaluo_total': None, 'propietario': ()}
+    )
+    assert condiciones == [] and params == []
+
+
+def test_filtros_por_tipo(bd):
+    juana = db_utils.guardar_propiedad(propiedad(1, propietario='Juana Pérez', destino_dom=None,
+                                                 avaluo_total=500, m2_terreno=80))
+    pedro = db_utils.guardar_propiedad(propiedad(2, propietario='Pedro Soto', destino_dom='Comercial',
+                                                 avaluo_total=1500, m2_terreno=200))
+    # Texto: subcadena normalizada o valores exactos
+    assert ids_filtrados({'propietario': 'PEREZ'}) == [juana]
+    assert ids_filtrados({'propietario': ['pedro soto', 'nadie']}) == [pedro]
+    # Categoría: '' también incluye los nulos
+    assert ids_filtrados({'destino_dom': ['']}) == [juana]
+    assert ids_filtrados({'destino_dom': 'Comercial'}) == [pedro]
+    # Rango con extremos abiertos
+    assert ids_filtrados({'avaluo_total': (1000, None)}) == [pedro]
+    assert ids_filtrados({'avaluo_total': (None, 500)}) == [juana]
+    assert ids_filtrados({'avaluo_total': (0, 2000), 'm2_terreno': (100.5, None)}) == [pedro]
+
+
+def test_filtro_de_fecha_incluye_todo_el_dia(bd):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1))
+    ejecutar('UPDATE propiedades SET fecha_creacion = ? WHERE id = ?', ('2024-05-20 15:30:00', propiedad_id))
+    assert ids_filtrados({'fecha_creacion': (date(2024, 5, 20), date(2024, 5, 20))}) == [propiedad_id]
+    assert ids_filtrados({'fecha_creacion': ('2024-05-20', None)}) == [propiedad_id]
+    assert ids_filtrados({'fecha_creacion': (None, datetime(2024, 5, 20, 15))}) == []
+    assert ids_filtrados({'fecha_creacion': (None, date(2024, 5, 19))}) == []
@@ -0,0 +1,52 @@
+"""Pruebas de la lectura de fotos por página (agregar_fotos)"""
+import pytest
+
+import db_utils
+from conftest import propiedad
+
+
+def sentencias_sqlite(backend, llamada):
+    """Sentencias que `llamada` envía a SQLite (un solo hilo: el pool presta siempre la misma conexión)"""
+    sentencias = []
+    conn = backend.adquirir()
+    conn.set_trace_callback(sentencias.append)
+    backend.liberar(conn)
+    try:
+        llamada()
+    finally:
+        conn.set_trace_callback(None)
+    return sentencias
+
+
+def test_fotos_de_cada_propiedad_en_orden(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(6))
+    ids = [fila['id'] for fila in db_utils.obtener_propiedades(1, 6)['datos']]
+    for posicion, propiedad_id in enumerate(ids[:4]):
+        db_utils.guardar_fotos(propiedad_id, [f'{propiedad_id}_{n}.jpg' for n in range(posicion + 1)])
+
+    for fila in db_utils.obtener_propiedades(1, 6)['datos']:
+        esperadas = [f"{fila['id']}_{n}.jpg" for n in range(ids.index(fila['id']) + 1)] if fila['id'] in ids[:4] else []
+        assert fila['Fotos'] == esperadas
+        assert fila['Miniatura'] == (esperadas[0] if esperadas else None)
+    # La búsqueda usa la misma lectura por página
+    encontrada, = db_utils.buscar_propiedades(f"propietario {ids[0] - 1}")['datos']
+    assert encontrada['Fotos'] == [f'{ids[0]}_0.jpg']
+
+
+@pytest.mark.parametrize('leer', [
+    lambda: db_utils.obtener_propiedades(1, 50),
+    lambda: db_utils.obtener_propiedades_cursor(None, 50),
+    lambda: db_utils.buscar_propiedades('independencia', limite=50),
+])
+def test_una_consulta_de_fotos_por_pagina(bd, leer):
+    if bd.nombre != 'sqlite':
+        pytest.skip("Cuenta las sentencias con el trace de SQLite")
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(40))
+    for propiedad_id in range(1, 41):
+        db_utils.guardar_fotos(propiedad_id, ['a.jpg', 'b.jpg'])
+
+    # Sin las internas de los triggers y del índice de texto ('-- ...')
+    sentencias = [sentencia for sentencia in sentencias_sqlite(bd, leer) if not sentencia.startswith('--')]
+    assert len([sentencia for sentencia in sentencias if 'FROM fotos' in sentencia]) == 1
+    # Unas pocas sentencias por página, no una por propiedad
+    assert len(sentencias) < 10
@@ -0,0 +1,58 @@
+"""Pruebas del guardado masivo (guardar_propiedades_lote)"""
+import db_utils
+from conftest import propiedad
+
+
+def test_cuenta_insertadas_y_actualizadas(bd):
+    resumen = db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(30))
+    assert resumen == {'procesadas': 30, 'insertadas': 30, 'actualizadas': 0}
+    resumen = db_utils.guardar_propiedades_lote(
+        propiedad(numero, observaciones='Segunda carga') for numero in range(20, 40)
+    )
+    assert resumen == {'procesadas': 20, 'insertadas': 10, 'actualizadas': 10}
+    assert db_utils.obtener_total_propiedades() == 40
+    assert db_utils.obtener_propiedades(1, 100, {'avaluo_total': (1000020, 1000039)})['total'] == 20
+
+
+def test_repetida_en_el_mismo_lote(bd):
+    # La segunda aparición actualiza la fila que insertó la primera (el RUT canónico es el mismo)
+    resumen = db_utils.guardar_propiedades_lote([
+        propiedad(1, avaluo_total=10),
+        propiedad(2),
+        propiedad(1, rut='10.000.001-1', avaluo_total=20),
+    ])
+    assert resumen == {'procesadas': 3, 'insertadas': 2, 'actualizadas': 1}
+    avaluos = {fila['rut']: fila['avaluo_total'] for fila in db_utils.obtener_propiedades()['datos']}
+    assert avaluos == {'10.000.001-1': 20, '10000002-2': 1000002}
+
+
+def test_consume_el_iterable_una_vez(bd):
+    leidas = []
+
+    def propiedades():
+        for numero in range(5):
+            leidas.append(numero)
+            yield propiedad(numero)
+
+    assert db_utils.guardar_propiedades_lote(propiedades())['insertadas'] == 5
+    assert leidas == [0, 1, 2, 3, 4]
+
+
+def test_claves_del_formulario(bd):
+    formulario = {clave: propiedad(1).get(columna, defecto) for columna, clave, defecto in db_utils.COLUMNAS_PROPIEDAD}
+    assert db_utils.guardar_propiedades_lote([formulario])['insertadas'] == 1
+    fila, = db_utils.obtener_propiedades()['datos']
+    assert fila['rut'] == '10000001-1' and fila['lat'] is not None
+
+
+def test_lote_vacio(bd):
+    assert db_utils.guardar_propiedades_lote([]) == {'procesadas': 0, 'insertadas': 0, 'actualizadas': 0}
+
+
+def test_error_deshace_todo_el_lote(bd, avisos):
+    lote = [propiedad(1), propiedad(2), propiedad(3, observaciones={'no': 'es texto'})]
+    assert db_utils.guardar_propiedades_lote(lote) is None
+    assert len(avisos.errores) == 1 and 'Error al guardar el lote' in avisos.errores[0]
+    avisos.errores.clear()
+    assert db_utils.obtener_total_propiedades() == 0
+    assert db_utils.obtener_propiedades()['datos'] == []
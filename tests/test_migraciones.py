@@ -0,0 +1,91 @@
+"""Pruebas de las migraciones versionadas del esquema (aplicar_migraciones)"""
+import pytest
+
+import db_utils
+from conftest import reiniciar_base
+
+
+def insertar_fila_antigua():
+    """Inserta una propiedad solo con las columnas del esquema original (sin pasar por db_utils)"""
+    with db_utils.get_db_connection() as conn:
+        conn.cursor().execute(
+            "INSERT INTO propiedades (rut, propietario, direccion, rol_propiedad, avaluo_total, coordenadas) "
+            "VALUES ('12.345.678-5', 'José Núñez', 'Av. Matta 100', '3-4', 5, '-33.45, -70.65')"
+        )
+        conn.commit()
+
+
+def version_actual():
+    with db_utils.get_db_connection() as conn:
+        return db_utils.backend_actual().version_esquema(conn.cursor())
+
+
+def registrar_migraciones(monkeypatch, aplicadas, falla_en=None):
+    """Reemplaza MIGRACIONES por las mismas funciones, registrando cada número aplicado"""
+    def envolver(numero, migracion):
+        def aplicar(cursor, backend):
+            aplicadas.append(numero)
+            migracion(cursor, backend)
+            if numero == falla_en:
+                cursor.execute('SELECT * FROM tabla_inexistente')
+        return aplicar
+    monkeypatch.setattr(db_utils, 'MIGRACIONES', tuple(
+        (numero, envolver(numero, migracion)) for numero, migracion in db_utils.MIGRACIONES
+    ))
+
+
+def test_base_nueva_queda_en_la_ultima_version(bd):
+    numeros = [numero for numero, _ in db_utils.MIGRACIONES]
+    assert numeros == sorted(numeros) and len(set(numeros)) == len(numeros)
+    assert version_actual() == numeros[-1]
+
+
+def test_aplica_solo_las_pendientes_una_vez(bd, monkeypatch):
+    reiniciar_base(bd, migraciones=2)
+    assert version_actual() == 2
+    insertar_fila_antigua()
+
+    aplicadas = []
+    registrar_migraciones(monkeypatch, aplicadas)
+    assert db_utils.init_db()
+    assert aplicadas == [numero for numero, _ in db_utils.MIGRACIONES if numero > 2]
+    assert version_actual() == db_utils.MIGRACIONES[-1][0]
+
+    # Volver a inicializar no aplica nada ni cambia los datos
+    del aplicadas[:]
+    assert db_utils.init_db()
+    assert aplicadas == []
+    assert db_utils.obtener_total_propiedades() == 1
+    assert len(db_utils.buscar_propiedades('jose')['datos']) == 1
+
+
+def test_migracion_fallida_no_deja_cambios(bd, monkeypatch, avisos):
+    bd = reiniciar_base(bd, migraciones=6)
+    aplicadas = []
+    with monkeypatch.context() as parche:
+        # La migración 7 agrega la columna version y luego falla
+        registrar_migraciones(parche, aplicadas, falla_en=7)
+        assert not db_utils.init_db()
+    assert len(avisos.errores) == 1 and 'Error al inicializar' in avisos.errores[0]
+    avisos.errores.clear()
+    assert aplicadas == [7]
+
+    # Todo init_db es una transacción: ni la versión ni la columna quedaron
+    assert version_actual() == 6
+    with db_utils.get_db_connection() as conn:
+        assert 'version' not in db_utils.columnas_tabla(conn.cursor(), bd, 'propiedades')
+
+    assert db_utils.init_db()
+    assert version_actual() == db_utils.MIGRACIONES[-1][0]
+
+
+@pytest.mark.parametrize('migraciones', [0, 2])
+def test_migra_una_base_con_datos(bd, migraciones):
+    reiniciar_base(bd, migraciones=migraciones)
+    insertar_fila_antigua()
+
+    assert db_utils.init_db()
+    # Las migraciones completan las columnas derivadas de las filas existentes
+    assert db_utils.obtener_propiedades(filtros={'rut': ['12345678-5'], 'propietario': 'jose nunez'})['total'] == 1
+    assert [fila['rol_propiedad'] for fila in db_utils.buscar_propiedades('avenida matta')['datos']] == ['3-4']
+    assert db_utils.resumen_propietario('123456785')['propiedades'] == 1
@@ -0,0 +1,60 @@
+"""Pruebas de la paginación por clave (obtener_propiedades_cursor)"""
+import db_utils
+from conftest import propiedad
+
+
+def recorrer(por_pagina, filtros=None):
+    """Ids de todas las páginas, siguiendo 'siguiente_cursor'"""
+    ids, cursor = [], None
+    while True:
+        pagina = db_utils.obtener_propiedades_cursor(cursor, por_pagina, filtros)
+        assert len(pagina['datos']) <= por_pagina
+        ids.extend(fila['id'] for fila in pagina['datos'])
+        cursor = pagina['siguiente_cursor']
+        assert (cursor is not None) == pagina['hay_mas']
+        if cursor is None:
+            return ids
+
+
+def test_recorre_todas_las_paginas_en_orden(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(23))
+    ids = recorrer(5)
+    assert len(ids) == 23 and len(set(ids)) == 23
+    # Mismo orden que la paginación con OFFSET
+    assert ids == [fila['id'] for fila in db_utils.obtener_propiedades(1, 23)['datos']]
+    assert recorrer(23) == ids
+
+
+def test_con_filtros(bd):
+    db_utils.guardar_propiedades_lote(
+        propiedad(numero, destino_sii='Comercio' if numero % 2 else 'Habitacional') for numero in range(20)
+    )
+    ids = recorrer(3, {'destino_sii': ['Comercio']})
+    assert len(ids) == 10
+    comercio = db_utils.obtener_propiedades(1, 20, {'destino_sii': ['Comercio']})['datos']
+    assert ids == [fila['id'] for fila in comercio]
+
+
+def test_insertar_entre_paginas_no_repite_filas(bd):
+    db_utils.guardar_propiedades_lote(propiedad(numero) for numero in range(10))
+    primera = db_utils.obtener_propiedades_cursor(None, 4)
+    # Una propiedad nueva queda antes de la primera página y no desplaza las siguientes
+    db_utils.guardar_propiedad(propiedad(99))
+    segunda = db_utils.obtener_propiedades_cursor(primera['siguiente_cursor'], 4)
+    ids_primera = [fila['id'] for fila in primera['datos']]
+    ids_segunda = [fila['id'] for fila in segunda['datos']]
+    assert not set(ids_primera) & set(ids_segunda)
+    assert max(ids_segunda) < min(ids_primera)
+
+
+def test_tabla_vacia(bd):
+    pagina = db_utils.obtener_propiedades_cursor()
+    assert pagina['datos'] == [] and pagina['siguiente_cursor'] is None and not pagina['hay_mas']
+
+
+def test_cursor_invalido(bd, avisos):
+    db_utils.guardar_propiedad(propiedad(1))
+    pagina = db_utils.obtener_propiedades_cursor('no-es-un-cursor')
+    assert pagina['datos'] == [] and pagina['siguiente_cursor'] is None
+    assert len(avisos.errores) == 1 and 'Cursor de paginación inválido' in avisos.errores[0]
+    avisos.errores.clear()
@@ -0,0 +1,112 @@
+"""Pruebas del control de concurrencia optimista (columna version)"""
+import pandas as pd
+import pytest
+
+import db_utils
+from conftest import propiedad, reiniciar_base
+
+
+def leer(propiedad_id):
+    """Fila actual de una propiedad"""
+    return next(fila for fila in db_utils.obtener_propiedades(1, 100)['datos'] if fila['id'] == propiedad_id)
+
+
+def test_cada_escritura_incrementa_la_version(bd):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1))
+    assert leer(propiedad_id)['version'] == 1
+    db_utils.guardar_propiedad(propiedad(1, observaciones='upsert'))
+    assert leer(propiedad_id)['version'] == 2
+    db_utils.actualizar_celdas({propiedad_id: {'observaciones': 'celda'}})
+    assert leer(propiedad_id)['version'] == 3
+
+
+def test_datos_formulario_desde_la_tabla(bd):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1, ano_construccion=None, m2_terreno=None))
+    fila = next(fila for _, fila in pd.DataFrame(db_utils.obtener_propiedades()['datos']).iterrows())
+    datos = db_utils.datos_formulario(fila.to_dict())
+    assert datos['id'] == propiedad_id and datos['version'] == 1
+    assert datos['RUT'] == '10000001-1'
+    assert datos['ROL Propiedad'] == '0-1'
+    assert datos['Año de Construcción'] is None
+
+
+def test_formulario_con_version_vieja_no_sobrescribe(bd, avisos):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1))
+    formulario = db_utils.datos_formulario(leer(propiedad_id))
+    # Otra sesión cambia la propiedad mientras el formulario está abierto
+    db_utils.actualizar_celdas({propiedad_id: {'propietario': 'Cambio de otra sesión'}})
+
+    formulario['Propietario'] = 'Cambio del formulario'
+    assert db_utils.guardar_propiedad(formulario) is None
+    assert len(avisos.advertencias) == 1 and 'Otro usuario modificó' in avisos.advertencias[0]
+    fila = leer(propiedad_id)
+    assert fila['propietario'] == 'Cambio de otra sesión' and fila['version'] == 2
+
+    # Releída, la edición se guarda
+    formulario = db_utils.datos_formulario(fila)
+    formulario['Propietario'] = 'Cambio del formulario'
+    assert db_utils.guardar_propiedad(formulario) == propiedad_id
+    fila = leer(propiedad_id)
+    assert fila['propietario'] == 'Cambio del formulario' and fila['version'] == 3
+
+
+def test_formulario_de_propiedad_eliminada(bd, avisos):
+    propiedad_id = db_utils.guardar_propiedad(propiedad(1))
+    formulario = db_utils.datos_formulario(leer(propiedad_id))
+    db_utils.eliminar_propiedad_bd(propiedad_id)
+    assert db_utils.guardar_propiedad(formulario) is None
+    assert len(avisos.advertencias) == 1 and 'fue eliminada' in avisos.advertencias[0]
+    assert avisos.errores == []
+
+
+def test_version_nula_se_completa(bd):
+    bd = reiniciar_base(bd, migraciones=6)
+    # Base donde la columna version se agregó sin NOT NULL ni DEFAULT
+    with db_utils.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute('ALTER TABLE propiedades ADD COLUMN version INTEGER')
+        cursor.execute(
+            "INSERT INTO propiedades (rut, rut_norm, propietario, direccion, rol_propiedad, avaluo_total) "
+            "VALUES ('10000001-1', '100000011', 'José', 'Calle 1', '0-1', 1)"
+        )
+        conn.commit()
+
+    assert db_utils.init_db()
+    fila, = db_utils.obtener_propiedades()['datos']
+    assert fila['version'] == 1
+    formulario = db_utils.datos_formulario(fila)
+    formulario['Propietario'] = 'Cambio del formulario'
+    assert db_utils.guardar_propiedad(formulario) == fila['id']
+    assert leer(fila['id'])['version'] == 2
+
+    # La columna quedó obligatoria y con valor por defecto
+    with db_utils.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO propiedades (rut, rut_norm, propietario, direccion, rol_propiedad, avaluo_total) "
+            "VALUES ('10000002-2', '100000022', 'Ana', 'Calle 2', '0-2', 2) RETURNING version"
+        )
+        assert cursor.fetchone()[0] == 1
+        with pytest.raises(db_utils.ERRORES_BD):
+            cursor.execute('UPDATE propiedades SET version = NULL')
+        conn.rollback()
+
+
+def test_actualizar_celdas_informa_conflictos(bd):
+    primera = db_utils.guardar_propiedad(propiedad(1))
+    segunda = db_utils.guardar_propiedad(propiedad(2))
+    versiones = {primera: 1, segunda: 1}
+    db_utils.actualizar_celdas({segunda: {'observaciones': 'otra sesión'}})
+
+    resumen = db_utils.actualizar_celdas(
+        {primera: {'observaciones': 'editor'}, segunda: {'observaciones': 'editor'}}, versiones
+    )
+    assert resumen['conflictos'] == [segunda]
+    assert resumen['versiones'] == {primera: 2}
+    assert resumen['propiedades'] == 1
+    assert leer(primera)['observaciones'] == 'editor'
+    assert leer(segunda)['observaciones'] == 'otra sesión'
+
+    # Con la versión devuelta, la siguiente edición de la misma fila no es un conflicto
+    resumen = db_utils.actualizar_celdas({primera: {'observaciones': 'de nuevo'}}, resumen['versiones'])
+    assert resumen['conflictos'] == [] and resumen['versiones'] == {primera: 3}